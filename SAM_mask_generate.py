@@ -16,9 +16,9 @@ import math
 from matplotlib import pyplot as plt
 from tqdm import tqdm
 
-from segment_anything import SamAutomaticMaskGenerator, sam_model_registry
-
 from utils import *
+from models.partition_cache import PartitionCache, SAM_PARAMS
+from models.sam_pipeline import SamMaskStore, MaskFileWriter, SuperpixelMaskGenerator, run_mask_pipeline
 
 def parse_args():
     parser = argparse.ArgumentParser(description='Segment Anything')
@@ -34,73 +34,67 @@ def parse_args():
                         type=str, 
                         default='./SAM_mask/CUB-resnet',
                         help='')
+    parser.add_argument('--partition-cache-dir',
+                        type=str, default=None,
+                        help='On-disk partition cache shared with the -sam drivers, masks found there are not generated again (default: off).')
+    parser.add_argument('--store',
+                        type=str, default="files",
+                        choices=["files", "shards"],
+                        help='files: one .npz ElementSet per image; shards: run-length encoded label maps in shards, read by the -sam drivers with --sam-store.')
+    parser.add_argument('--shard-size',
+                        type=int, default=256,
+                        help='Images per shard.')
+    parser.add_argument('--prefetch',
+                        type=int, default=4,
+                        help='Images read ahead of the one being segmented.')
+    parser.add_argument('--backend',
+                        type=str, default="sam",
+                        choices=["sam", "superpixel"],
+                        help='Mask generator, superpixel is a lightweight stand-in that runs without the SAM checkpoint.')
     args = parser.parse_args()
     return args
 
-def processing_sam_concepts(sam_masks, image):
-    """
-    Process the regions divided by SAM to prevent intersection of sub-regions.
-        sam_mask: Masks generated by Segment Anything Model
-    """
-    num = len(sam_masks)
-    mask_sets_V = [mask['segmentation'].astype(np.uint8) for mask in sam_masks]
-
-    for i in range(num-1):
-        for j in range(i+1, num):
-            intersection_region = (mask_sets_V[i] + mask_sets_V[j] == 2).astype(np.uint8)
-            # no intersection region
-            if intersection_region.sum() == 0:
-                continue
-            else:
-                proportion_1 = intersection_region.sum() / mask_sets_V[i].sum()
-                proportion_2 = intersection_region.sum() / mask_sets_V[j].sum()
-                if proportion_1 > proportion_2:
-                    mask_sets_V[j] -= intersection_region
-                else:
-                    mask_sets_V[i] -= intersection_region
-    element_sets_V = []
-    for mask in mask_sets_V:
-        if mask.mean() > 0.0005:
-            element_sets_V.append(image * mask[:,:,np.newaxis])
-    element_sets_V.append(image - np.array(element_sets_V).sum(0).astype(np.uint8))
-
-    return element_sets_V
-
 def main(args):
     # Load model
-    sam = sam_model_registry["vit_h"](checkpoint="ckpt/pytorch_model/sam_vit_h_4b8939.pth")
-    sam.to("cuda")
-    mask_generator = SamAutomaticMaskGenerator(sam, stability_score_thresh=0.8)
+    if args.backend == "sam":
+        from segment_anything import SamAutomaticMaskGenerator, sam_model_registry
+        sam = sam_model_registry[SAM_PARAMS["model_type"]](checkpoint="ckpt/pytorch_model/sam_vit_h_4b8939.pth")
+        sam.to("cuda")
+        mask_generator = SamAutomaticMaskGenerator(sam, stability_score_thresh=SAM_PARAMS["stability_score_thresh"])
+        cache_params = SAM_PARAMS
+    else:
+        mask_generator = SuperpixelMaskGenerator()
+        cache_params = {"model_type": "superpixel", "region_size": mask_generator.region_size, "ruler": mask_generator.ruler}
+    
+    partition_cache = None
+    if args.partition_cache_dir is not None:
+        partition_cache = PartitionCache(args.partition_cache_dir)
     
     # data preproccess
     with open(args.image_file, "r") as f:
         datas = f.read().split('\n')
     
     input_data = []
-    label = []
     for data in datas[:]:
-        label.append(int(data.strip().split(" ")[-1]))
+        if data.strip() == "":
+            continue
         input_data.append(
             data.split(" ")[0]
         )
     
     mkdir("SAM_mask")
-    mkdir(args.save_dir)
+    if args.store == "shards":
+        writer = SamMaskStore(args.save_dir, shard_size=args.shard_size)
+    else:
+        writer = MaskFileWriter(args.save_dir)
+    
     print("Begin Inference")
-    for image_path, y_label in zip(input_data, label):
-        try:
-            if os.path.exists(os.path.join(args.save_dir, image_path.replace(".jpg", ".npy").replace(".JPEG", ".npy"))):
-                continue
-            
-            image = cv2.imread(os.path.join(args.image_dir, image_path))
-
-            masks = mask_generator.generate(cv2.cvtColor(image, cv2.COLOR_BGR2RGB))
-            element_sets_V = processing_sam_concepts(masks, image)
-
-            # mkdir(os.path.join(args.save_dir, str(y_label)))
-            np.save(os.path.join(args.save_dir, image_path.replace(".jpg", "").replace(".JPEG", "")), np.array(element_sets_V))
-        except:
-            print("Image {} need larger CUDA.".format(image_path))
+    counts = run_mask_pipeline(
+        mask_generator, input_data, lambda image_path: cv2.imread(os.path.join(args.image_dir, image_path)), writer,
+        prefetch=args.prefetch, partition_cache=partition_cache, cache_params=cache_params)
+    print("Done: {ok} written, {failed} failed, {skipped} already done.".format(**counts))
+    if counts["failed"] > 0:
+        print("Failures are listed in {}".format(writer.manifest.path))
     return
 
 if __name__ == "__main__":
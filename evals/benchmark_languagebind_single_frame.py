@@ -0,0 +1,134 @@
+import argparse
+
+import os
+import time
+import cv2
+import numpy as np
+from PIL import Image
+
+from languagebind import LanguageBind
+
+import torch
+import torchvision.transforms as transforms
+
+from tqdm import tqdm
+
+data_transform = transforms.Compose(
+        [
+            transforms.Resize(
+                (224,224), interpolation=transforms.InterpolationMode.BICUBIC
+            ),
+            # transforms.CenterCrop(224),
+            transforms.ToTensor(),
+            transforms.Normalize(
+                mean=(0.48145466, 0.4578275, 0.40821073),
+                std=(0.26862954, 0.26130258, 0.27577711),
+            ),
+        ]
+    )
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='LanguageBind static image throughput: 8 repeated frames vs expanded view vs single frame')
+    # general
+    parser.add_argument('--Datasets',
+                        type=str,
+                        default='datasets/imagenet/ILSVRC2012_img_val',
+                        help='Datasets.')
+    parser.add_argument('--eval-list',
+                        type=str,
+                        default='datasets/imagenet/val_languagebind_5k_true.txt',
+                        help='Datasets.')
+    parser.add_argument('--semantic-path',
+                        type=str,
+                        default='ckpt/semantic_features/languagebind_imagenet_zeroweights.pt',
+                        help='Zero-shot class weights, top-1 agreement is reported when present.')
+    parser.add_argument('--num-images',
+                        type=int, default=256,
+                        help='')
+    parser.add_argument('--batch-size',
+                        type=int, default=32,
+                        help='')
+    parser.add_argument('--num-frames',
+                        type=int, default=8,
+                        help='')
+    parser.add_argument('--repeats',
+                        type=int, default=3,
+                        help='Timed passes per mode, the best one is reported.')
+    args = parser.parse_args()
+    return args
+
+def to_clip(images, mode, num_frames, device):
+    """
+    Video tower input of a host batch of images [B,C,W,H]
+    """
+    if mode == "repeat":
+        # the current path: every frame is a physical copy, made on the host
+        return images.unsqueeze(2).repeat(1, 1, num_frames, 1, 1).to(device)
+    images = images.to(device).unsqueeze(2)
+    if mode == "expand":
+        return images.expand(-1, -1, num_frames, -1, -1)
+    return images   # single frame
+
+def run(model, images, mode, args, device):
+    embeddings = []
+    with torch.no_grad():
+        for start in range(0, len(images), args.batch_size):
+            clip = to_clip(images[start : start + args.batch_size], mode, args.num_frames, device)
+            embeddings.append(model({"video": {'pixel_values': clip}})["video"].float())
+    if device.type == "cuda":
+        torch.cuda.synchronize(device)
+    return torch.cat(embeddings)
+
+def main(args):
+    device = "cuda" if torch.cuda.is_available() else "cpu"
+    device = torch.device(device)
+
+    model = LanguageBind(clip_type={'video': 'LanguageBind_Video_FT'}, cache_dir='.checkpoints')
+    model = model.to(device)
+    model.eval()
+
+    semantic_feature = None
+    if os.path.exists(args.semantic_path):
+        semantic_feature = torch.load(args.semantic_path, map_location="cpu").to(device)
+
+    with open(args.eval_list, "r") as f:
+        infos = [info for info in f.read().split('\n') if info != ""][:args.num_images]
+
+    images = []
+    for info in tqdm(infos):
+        image = cv2.imread(os.path.join(args.Datasets, info.split(" ")[0]))
+        image = Image.fromarray(cv2.cvtColor(image, cv2.COLOR_BGR2RGB))
+        images.append(data_transform(image))
+    images = torch.stack(images)
+    if device.type == "cuda":
+        images = images.pin_memory()
+
+    # warm up / 预热
+    run(model, images[:args.batch_size], "expand", args, device)
+
+    results = {}
+    for mode in ["repeat", "expand", "single-frame"]:
+        best = None
+        for _ in range(args.repeats):
+            if device.type == "cuda":
+                torch.cuda.reset_peak_memory_stats(device)
+            start = time.perf_counter()
+            embeddings = run(model, images, mode, args, device)
+            seconds = time.perf_counter() - start
+            best = seconds if best is None else min(best, seconds)
+        peak = torch.cuda.max_memory_allocated(device) / 1024 ** 3 if device.type == "cuda" else float("nan")
+        results[mode] = (embeddings, best, peak)
+
+    reference = results["repeat"][0]
+    print("{:<14}{:>12}{:>10}{:>12}{:>14}{:>12}".format("mode", "images/s", "speedup", "peak GB", "min cosine", "top-1 agree"))
+    for mode, (embeddings, seconds, peak) in results.items():
+        cosine = torch.nn.functional.cosine_similarity(embeddings, reference, dim=-1).min().item()
+        agreement = float("nan")
+        if semantic_feature is not None:
+            agreement = ((embeddings @ semantic_feature.T).argmax(-1) == (reference @ semantic_feature.T).argmax(-1)).float().mean().item()
+        print("{:<14}{:>12.1f}{:>10.2f}{:>12.2f}{:>14.6f}{:>12.4f}".format(
+            mode, len(images) / seconds, results["repeat"][1] / seconds, peak, cosine, agreement))
+
+if __name__ == "__main__":
+    args = parse_args()
+    main(args)
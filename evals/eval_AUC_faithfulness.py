@@ -17,6 +17,7 @@ from matplotlib import pyplot as plt
 from PIL import Image
 
 from tqdm import tqdm
+from utils import load_element_set
 
 from sklearn import metrics
 
@@ -51,7 +52,7 @@ def main(args):
 
             with open(json_file_path, 'r', encoding='utf-8') as f:
                 saved_json_file = json.load(f)            
-            submodular_image_set = np.load(npy_file_path)
+            submodular_image_set = load_element_set(npy_file_path)
 
             insertion_area = []
             deletion_area = []
@@ -0,0 +1,111 @@
+import argparse
+
+import os
+import cv2
+import json
+import numpy as np
+from PIL import Image
+
+import clip
+
+import torch
+import torchvision.transforms as transforms
+
+from tqdm import tqdm
+from utils import SubRegionDivision
+from models.token_dropping import TokenDroppingViT, fidelity_report
+
+data_transform = transforms.Compose(
+    [
+        transforms.Resize(
+            (224,224), interpolation=transforms.InterpolationMode.BICUBIC
+        ),
+        # transforms.CenterCrop(224),
+        transforms.ToTensor(),
+        transforms.Normalize(
+            mean=(0.48145466, 0.4578275, 0.40821073),
+            std=(0.26862954, 0.26130258, 0.27577711),
+        ),
+    ]
+)
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Token dropping fidelity against pixel masking (CLIP ViT-L/14)')
+    # general
+    parser.add_argument('--Datasets',
+                        type=str,
+                        default='datasets/imagenet/ILSVRC2012_img_val',
+                        help='Datasets.')
+    parser.add_argument('--eval-list',
+                        type=str,
+                        default='datasets/imagenet/val_clip_vitl_5k_true.txt',
+                        help='Datasets.')
+    parser.add_argument('--superpixel-algorithm',
+                        type=str,
+                        default="slico",
+                        choices=["slico", "seeds"],
+                        help="")
+    parser.add_argument('--num-images',
+                        type=int, default=100,
+                        help='')
+    parser.add_argument('--samples',
+                        type=int, default=8,
+                        help='Random subsets per revealed fraction and image.')
+    parser.add_argument('--save-path',
+                        type=str, default='./submodular_results/token_dropping_fidelity_clip_vitl.json',
+                        help='')
+    args = parser.parse_args()
+    return args
+
+def transform_vision_data(image):
+    """
+    Input:
+        image: An image read by opencv [w,h,c]
+    Output:
+        image: After preproccessing, is a tensor [c,w,h]
+    """
+    image = Image.fromarray(image)
+    image = data_transform(image)
+    return image
+
+def main(args):
+    device = "cuda" if torch.cuda.is_available() else "cpu"
+    model, _ = clip.load("ViT-L/14", device=device, download_root=".checkpoints/CLIP")
+    model.eval()
+
+    def pixel_model(vision_inputs):
+        image_features = model.encode_image(vision_inputs)
+        return image_features / image_features.norm(dim=-1, keepdim=True)
+    token_model = TokenDroppingViT(
+        model.visual, transform_vision_data(np.zeros((224, 224, 3), dtype=np.uint8)).to(device), normalize=True)
+
+    semantic_feature = torch.load("ckpt/semantic_features/clip_vitl_imagenet_zeroweights.pt", map_location="cpu").to(device)
+
+    with open(args.eval_list, "r") as f:
+        infos = [info for info in f.read().split('\n') if info != ""][:args.num_images]
+
+    reports = []
+    for info in tqdm(infos):
+        image = cv2.imread(os.path.join(args.Datasets, info.split(" ")[0]))
+        image = cv2.resize(image, (224, 224))
+        element_sets_V = SubRegionDivision(image, mode=args.superpixel_algorithm)
+        reports.append(fidelity_report(
+            pixel_model, token_model, semantic_feature, element_sets_V, transform_vision_data, int(info.split(" ")[1]),
+            samples=args.samples, device=device))
+
+    # mean over the images, per revealed fraction / 按可见比例对图像取平均
+    summary = []
+    for rows in zip(*reports):
+        summary.append({key: float(np.mean([row[key] for row in rows])) for key in rows[0]})
+
+    print("{:>10}{:>14}{:>10}{:>18}{:>16}{:>10}".format("fraction", "kept tokens", "cosine", "target score gap", "top-1 agree", "speedup"))
+    for row in summary:
+        print("{:>10.2f}{:>14.3f}{:>10.4f}{:>18.4f}{:>16.3f}{:>10.2f}".format(
+            row["fraction"], row["kept_tokens"], row["cosine"], row["target_score_gap"], row["top1_agreement"], row["speedup"]))
+
+    with open(args.save_path, "w") as f:
+        f.write(json.dumps({"summary": summary, "images": reports}, ensure_ascii=False, indent=4, separators=(',', ':')))
+
+if __name__ == "__main__":
+    args = parse_args()
+    main(args)
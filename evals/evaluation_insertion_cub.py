@@ -20,6 +20,7 @@ from xplique.metrics import Insertion
 from PIL import Image
 
 from tqdm import tqdm
+from utils import load_element_set
 
 img_size = 224
 
@@ -109,7 +110,7 @@ def main(args):
                 os.path.join(args.explanation_method, data.split(" ")[0].replace(".jpg", ".npy")))
         )
         smdl_mask.append(
-            np.load(
+            load_element_set(
                 os.path.join(args.explanation_smdl, data.split(" ")[0].replace(".jpg", ".npy")))    
         )
     label_onehot = tf.one_hot(np.array(label), class_number)
@@ -18,6 +18,7 @@ from PIL import Image
 import torchvision.transforms as transforms
 
 from tqdm import tqdm
+from utils import load_element_set
 
 transform = transforms.Compose([
             transforms.Resize((112,112)),
@@ -120,7 +121,7 @@ def main(args):
                 os.path.join(args.explanation_method, data.split(" ")[0].replace(".jpg", ".npy")))
         )
         smdl_mask.append(
-            np.load(
+            load_element_set(
                 os.path.join(args.explanation_smdl, data.split(" ")[0].replace(".jpg", ".npy")))    
         )
     label_onehot = tf.one_hot(np.array(label), class_number)
@@ -4,6 +4,8 @@ import json
 from tqdm import tqdm
 import numpy as np
 
+from utils import load_element_set
+
 explanation_method = "./submodular_results_iclr_baseline/imagenet-languagebind-false/grad-10x10-4"
 # explanation_method = "explanation_insertion_results/imagenet-fair-clip-vitl/Rise"
 eval_list = "datasets/imagenet/val_languagebind_2k_false.txt"
@@ -33,7 +35,7 @@ def main(percentage):
             continue
         
         insertion_area = []
-        submodular_image_set = np.load(npy_file_path)
+        submodular_image_set = load_element_set(npy_file_path)
         insertion_ours_image = submodular_image_set[0] - submodular_image_set[0] # baseline
         for smdl_sub_mask in submodular_image_set:
             insertion_ours_image += smdl_sub_mask
@@ -16,6 +16,7 @@ import torch
 import torchvision.transforms as transforms
 
 from tqdm import tqdm
+from utils import load_element_set
 
 tf.config.run_functions_eagerly(True)
 
@@ -137,7 +138,7 @@ def main(args):
             transform_vision_data(os.path.join(args.Datasets, data.split(" ")[0]))
         )
         smdl_mask.append(
-            np.load(
+            load_element_set(
                 os.path.join(os.path.join(args.explanation_smdl, data.strip().split(" ")[-1]), data.split(" ")[0].replace(".JPEG", ".npy")))    
         )
     label_onehot = tf.one_hot(np.array(label), class_number)
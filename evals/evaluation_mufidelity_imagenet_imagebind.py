@@ -18,6 +18,7 @@ import torch
 import torchvision.transforms as transforms
 
 from tqdm import tqdm
+from utils import load_element_set
 
 tf.config.run_functions_eagerly(True)
 
@@ -180,7 +181,7 @@ def main(args):
         #         os.path.join(args.explanation_method, data.split(" ")[0].replace(".JPEG", ".npy")))
         # )
         smdl_mask.append(
-            np.load(
+            load_element_set(
                 os.path.join(os.path.join(args.explanation_smdl, data.strip().split(" ")[-1]), data.split(" ")[0].replace(".JPEG", ".npy")))    
         )
     label_onehot = tf.one_hot(np.array(label), class_number)
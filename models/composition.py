@@ -0,0 +1,159 @@
+import numpy as np
+import torch
+
+from .element_set import ElementSet
+from .prefix_cache import PrefixCache
+
+def build_composer(partition_image_set, **kwargs):
+    """
+    Pick the composer matching the element representation
+    """
+    if isinstance(partition_image_set, ElementSet):
+        return ElementSetComposer(partition_image_set, **kwargs)
+    return SubsetComposer(partition_image_set, **kwargs)
+
+class SubsetComposer(PrefixCache):
+    """
+    Compose subset images from a fixed element stack.
+
+    The greedy search only ever asks for `base_set + [candidate]`, where
+    `base_set` is the currently selected (or removed) set. The running state
+    of a base set is its summed image, kept by `PrefixCache`, so each
+    candidate costs `running_sum + element[c]` instead of a full re-sum.
+    """
+    def __init__(self,
+                 partition_image_set,
+                 org_img = None,
+                 dtype = np.uint8,
+                 cache_size = 4):
+        # The element stack is materialized once per image / 元素集只构建一次
+        self.elements = np.asarray(partition_image_set)
+        self.dtype = self.elements.dtype if dtype is None else dtype
+
+        if org_img is None:
+            org_img = self.elements.sum(0).astype(self.dtype)
+        self.org_img = org_img
+
+        super(SubsetComposer, self).__init__(cache_size)
+
+    def __len__(self):
+        return len(self.elements)
+
+    def extend(self, running, index):
+        return (running + self.elements[int(index)]).astype(self.dtype)
+
+    def union(self, index_set):
+        if len(index_set) == 0:
+            return np.zeros(self.elements.shape[1:], dtype=self.dtype)
+        return self.elements[list(index_set)].sum(0).astype(self.dtype)
+
+    def render(self, running):
+        return running
+
+    def compose(self, base_set, candidate):
+        """
+        Image of `base_set + [candidate]`
+        """
+        return self.render(self.extend(self.running_sum(base_set), candidate))
+
+    def compose_reverse(self, base_set, candidate):
+        """
+        Image of the complement of `base_set + [candidate]`
+        """
+        return self.org_img - self.compose(base_set, candidate)
+
+    def merge(self, sub_index_set):
+        """
+        Image of an index set whose last entry is the newly added element
+        """
+        sub_index_set = [int(i) for i in sub_index_set]
+        if len(sub_index_set) == 0:
+            return self.render(self.running_sum([]))
+        return self.compose(sub_index_set[:-1], sub_index_set[-1])
+
+class ElementSetComposer(SubsetComposer):
+    """
+    Composer over an `ElementSet`, the running state of a base set is its
+    boolean pixel mask instead of a summed image.
+    """
+    def __init__(self,
+                 element_set,
+                 org_img = None,
+                 dtype = np.uint8,
+                 cache_size = 4):
+        self.elements = element_set
+        self.dtype = element_set.dtype if dtype is None else dtype
+
+        if org_img is None:
+            org_img = element_set.sum(0).astype(self.dtype)
+        self.org_img = org_img
+
+        # no element stack is materialized / 不构建元素堆叠
+        PrefixCache.__init__(self, cache_size)
+
+    def extend(self, running, index):
+        return running | self.elements.mask(index)
+
+    def union(self, index_set):
+        return self.elements.subset_mask(index_set)
+
+    def render(self, running):
+        return self.elements.apply_mask(running).astype(self.dtype)
+
+class LinearComposer(object):
+    """
+    Compose preprocessed subset batches with one matrix product.
+
+    Resize, ToTensor and Normalize are affine, so the preprocessed image of
+    a subset is approximately `bias + sum(E[i])`, where `bias = f(0)` and
+    `E[i] = f(element_i) - f(0)`. Every element is preprocessed once onto
+    the device, and a batch of subsets is `indicator @ E + bias`.
+
+    Bicubic resizing is clamped and quantized to uint8 by PIL, so the result
+    is a close approximation, not a bit-exact match of the per-image path.
+    """
+    def __init__(self,
+                 partition_image_set,
+                 preproccessing_function,
+                 device = "cuda"):
+        self.device = device
+
+        with torch.no_grad():
+            zero_image = np.zeros_like(np.asarray(partition_image_set[0]))
+            self.bias = preproccessing_function(zero_image).to(device)
+
+            self.features = torch.stack([
+                preproccessing_function(element) for element in partition_image_set
+            ]).to(device)   # N x C x H x W, f(element_i)
+            self.elements = (self.features - self.bias).flatten(1)   # N x CHW, E_i
+
+        self.num_elements = self.elements.shape[0]
+
+    def __len__(self):
+        return self.num_elements
+
+    def indicator(self, sub_index_sets, reverse = False):
+        """
+        Binary [B,N] matrix, row b selects the elements of `sub_index_sets[b]`
+        """
+        indicator = torch.zeros((len(sub_index_sets), self.num_elements), device=self.device)
+        for i, sub_index_set in enumerate(sub_index_sets):
+            indicator[i, np.asarray(sub_index_set, dtype=int)] = 1
+        if reverse:
+            indicator = 1 - indicator
+        return indicator
+
+    def merge(self, sub_index_sets, reverse = False):
+        """
+        Preprocessed batch of the given subsets (or their complements)
+        """
+        indicator = self.indicator(sub_index_sets, reverse = reverse)
+        batch = indicator @ self.elements
+        return batch.view((len(sub_index_sets),) + tuple(self.bias.shape)) + self.bias
+
+    def compose(self, base_set, candidate_set, reverse = False):
+        """
+        Preprocessed batch of `base_set + [candidate]` for every candidate
+        """
+        base_set = [int(i) for i in base_set]
+        return self.merge([base_set + [int(candidate_)] for candidate_ in candidate_set], reverse = reverse)
@@ -0,0 +1,49 @@
+import numpy as np
+
+class EarlyStopping(object):
+    """
+    Convergence policy of the greedy search.
+
+    Exact search stops once the target probability of the selected subset
+    is within `epsilon` of the full image probability, or once the gain of
+    the submodular score stays below `min_gain` for `patience` consecutive
+    steps. The elements left are then ordered by their singleton scores,
+    which the first greedy step has already computed.
+    """
+    def __init__(self,
+                 full_score,
+                 epsilon = None,
+                 min_gain = None,
+                 patience = 3):
+        self.full_score = full_score
+        self.epsilon = epsilon
+        self.min_gain = min_gain
+        self.patience = patience
+
+        self.last_score = None
+        self.low_gain_steps = 0
+
+    def update(self, consistency_score, smdl_score):
+        """
+        Record the scores of the selected subset, True once exact search can stop
+        """
+        if self.epsilon is not None and consistency_score >= self.full_score - self.epsilon:
+            return True
+
+        if self.min_gain is not None:
+            if self.last_score is not None and smdl_score - self.last_score < self.min_gain:
+                self.low_gain_steps += 1
+            else:
+                self.low_gain_steps = 0
+            self.last_score = smdl_score
+            if self.low_gain_steps >= self.patience:
+                return True
+        return False
+
+    @staticmethod
+    def order_tail(remaining, singleton_scores):
+        """
+        Remaining elements by decreasing singleton score, unscored ones last
+        """
+        remaining = np.asarray(remaining, dtype=int)
+        return remaining[np.argsort(-singleton_scores[remaining], kind="stable")]
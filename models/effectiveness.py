@@ -0,0 +1,107 @@
+import numpy as np
+import torch
+
+from .prefix_cache import PrefixCache
+
+class EffectivenessScorer(PrefixCache):
+    """
+    Incremental effectiveness score over a fixed [N,N] distance matrix D.
+
+    score(S) = sum_{s in S} min_{t in S} (D + I)[s, t] is a sum of per-row
+    minima, so the running state of a base set is its members plus their
+    nearest-neighbour distances. Adding c only lowers each member's minimum
+    to D[s, c] and adds the row of c, so all candidates of a step are scored
+    with one vectorized op instead of one sub-matrix reduction per subset.
+    """
+    def __init__(self,
+                 effectiveness_dist,
+                 cache_size = 4):
+        self.dist = np.asarray(effectiveness_dist)
+        self.self_dist = np.diagonal(self.dist) + 1
+
+        super(EffectivenessScorer, self).__init__(cache_size)
+
+    def __len__(self):
+        return len(self.dist)
+
+    def index(self, index_set):
+        return np.asarray(index_set, dtype=int).reshape(-1)
+
+    def minimum(self, a, b):
+        return np.minimum(a, b)
+
+    def row_min(self, x):
+        return x.min(1)
+
+    def concat(self, a, b):
+        return np.concatenate((a, b))
+
+    def extend(self, running, index):
+        members, nearest = running
+        new = self.index([index])
+        if len(members) == 0:
+            return new, self.self_dist[new]
+        nearest = self.minimum(nearest, self.dist[members][:, new][:, 0])
+        own = self.minimum(self.self_dist[new], self.row_min(self.dist[new][:, members]))
+        return self.concat(members, new), self.concat(nearest, own)
+
+    def union(self, index_set):
+        members = self.index(index_set)
+        if len(members) == 0:
+            return members, self.self_dist[members]
+        sub_dist = self.dist[members][:, members]
+        return members, self.row_min(sub_dist + self.eye(len(members)))
+
+    def eye(self, n):
+        return np.eye(n, dtype=self.dist.dtype)
+
+    def score(self, base_set, candidate_set):
+        """
+        Effectiveness score of `base_set + [candidate]` for every candidate
+        """
+        members, nearest = self.running_sum(base_set)
+        candidates = self.index(candidate_set)
+        if len(members) == 0:
+            return self.self_dist[candidates]
+
+        # members' minima can only drop to their distance to the candidate
+        rows = self.minimum(nearest[:, None], self.dist[members][:, candidates]).sum(0)
+        # the candidate's own row over the base set, plus its (D[c,c] + 1) diagonal
+        own = self.minimum(self.self_dist[candidates], self.row_min(self.dist[candidates][:, members]))
+        return rows + own
+
+    def score_sets(self, sub_index_sets):
+        """
+        Same as `score`, for index sets sharing one base set and ending with the candidate
+        """
+        sub_index_sets = [np.asarray(sub_index_set, dtype=int) for sub_index_set in sub_index_sets]
+        return self.score(
+            sub_index_sets[0][:-1], [sub_index_set[-1] for sub_index_set in sub_index_sets])
+
+class TorchEffectivenessScorer(EffectivenessScorer):
+    """
+    `EffectivenessScorer` over a torch distance matrix, kept on its device
+    """
+    def __init__(self,
+                 effectiveness_dist,
+                 cache_size = 4):
+        self.dist = effectiveness_dist
+        self.self_dist = torch.diagonal(effectiveness_dist) + 1
+
+        # the distance matrix stays a torch tensor / 距离矩阵保持为torch张量
+        PrefixCache.__init__(self, cache_size)
+
+    def index(self, index_set):
+        return torch.as_tensor(np.asarray(index_set, dtype=int).reshape(-1), device=self.dist.device)
+
+    def minimum(self, a, b):
+        return torch.minimum(a, b)
+
+    def row_min(self, x):
+        return x.min(1).values
+
+    def concat(self, a, b):
+        return torch.cat((a, b))
+
+    def eye(self, n):
+        return torch.eye(n, device=self.dist.device, dtype=self.dist.dtype)
@@ -0,0 +1,164 @@
+import numpy as np
+
+class ElementSet(object):
+    """
+    Compact image element set: the original image plus a label map.
+
+    Element i is `image * (labels == i)`, pixels labelled -1 belong to no
+    element. An int8 / int16 / int32 label map is kept as given (e.g. the
+    narrow memory map of a PartitionCache entry), numpy indexes with any of
+    them; other dtypes are converted to int32. The set mirrors the dense `N x H x W x C` stack it replaces
+    (len, indexing, iteration, `.sum(0)`, `np.array(...)`), but only builds
+    a full-resolution element when one is actually requested.
+    """
+    def __init__(self, image, labels, num_elements = None):
+        self.image = np.asarray(image)
+        self.labels = np.asarray(labels)
+        if self.labels.dtype not in (np.int8, np.int16, np.int32):
+            self.labels = self.labels.astype(np.int32)
+        assert self.labels.shape == self.image.shape[:2]
+
+        if num_elements is None:
+            num_elements = int(self.labels.max()) + 1 if self.labels.size else 0
+        self.num_elements = int(num_elements)
+
+    @classmethod
+    def from_dense(cls, element_sets_V):
+        """
+        Convert a dense stack of element images, pixels that are black in
+        every element are left unassigned (-1)
+        """
+        element_sets_V = np.asarray(element_sets_V)
+        nonzero = element_sets_V.reshape(element_sets_V.shape[0], element_sets_V.shape[1], element_sets_V.shape[2], -1).any(-1)
+        labels = np.where(nonzero.any(0), nonzero.argmax(0), -1).astype(np.int32)
+        image = element_sets_V.sum(0).astype(element_sets_V.dtype)
+        return cls(image, labels, num_elements = element_sets_V.shape[0])
+
+    @classmethod
+    def load(cls, path):
+        data = np.load(path)
+        return cls(data["image"], data["labels"], num_elements = int(data["num_elements"]))
+
+    def save(self, path):
+        """
+        Save as a compressed `.npz` file (image + label map)
+        """
+        np.savez_compressed(path, image=self.image, labels=self.labels, num_elements=self.num_elements)
+
+    def __len__(self):
+        return self.num_elements
+
+    @property
+    def shape(self):
+        return (self.num_elements,) + self.image.shape
+
+    @property
+    def dtype(self):
+        return self.image.dtype
+
+    def mask(self, index):
+        """
+        Boolean [H,W] mask of one element
+        """
+        return self.labels == int(index)
+
+    def masks(self, indexes = None):
+        """
+        Boolean [n,H,W] masks, all elements by default
+        """
+        if indexes is None:
+            indexes = np.arange(self.num_elements)
+        indexes = np.asarray(indexes, dtype=np.int32)
+        return self.labels[np.newaxis] == indexes[:, np.newaxis, np.newaxis]
+
+    def subset_mask(self, index_set):
+        """
+        Boolean [H,W] mask of the union of some elements
+        """
+        lookup = np.zeros(self.num_elements + 1, dtype=bool)
+        lookup[np.asarray(index_set, dtype=int)] = True
+        # label -1 reads the trailing False
+        return lookup[self.labels]
+
+    def element(self, index):
+        """
+        Dense image of one element
+        """
+        return self.apply_mask(self.mask(index))
+
+    def apply_mask(self, mask):
+        if self.image.ndim == 3:
+            mask = mask[:, :, np.newaxis]
+        return self.image * mask
+
+    def merge(self, index_set):
+        """
+        Dense image of the union of some elements
+        """
+        return self.apply_mask(self.subset_mask(index_set))
+
+    def reorder(self, indexes):
+        """
+        New element set whose element j is element `indexes[j]` of this set,
+        the indexes must be distinct (a label map cannot repeat an element)
+        """
+        indexes = np.asarray(indexes, dtype=int).reshape(-1)
+        if len(np.unique(indexes)) != len(indexes):
+            raise ValueError("reorder needs distinct element indexes")
+        lookup = np.full(self.num_elements + 1, -1, dtype=np.int32)
+        lookup[indexes] = np.arange(len(indexes), dtype=np.int32)
+        return ElementSet(self.image, lookup[self.labels], num_elements = len(indexes))
+
+    def group(self, labels):
+        """
+        Coarse element set over a coarser label map (e.g. a large-region
+        SLIC): each element joins the region it overlaps most. Returns the
+        coarse set and the group of every element.
+        """
+        labels = np.asarray(labels, dtype=np.int64)
+        assert labels.shape == self.labels.shape
+        valid = (self.labels >= 0) & (labels >= 0)
+        num_regions = int(labels.max()) + 1 if valid.any() else 1
+        overlap = np.bincount(
+            self.labels[valid].astype(np.int64) * num_regions + labels[valid],
+            minlength = self.num_elements * num_regions).reshape(self.num_elements, num_regions)
+        # regions that got no element are dropped, groups are contiguous
+        _, groups = np.unique(overlap.argmax(1), return_inverse=True)
+        groups = groups.reshape(-1).astype(np.int32)
+
+        lookup = np.append(groups, -1).astype(np.int32)    # label -1 reads the trailing -1
+        num_groups = int(groups.max()) + 1 if len(groups) else 0
+        return ElementSet(self.image, lookup[self.labels], num_elements = num_groups), groups
+
+    def __getitem__(self, index):
+        if isinstance(index, (int, np.integer)):
+            if index < 0:
+                index += self.num_elements
+            if not 0 <= index < self.num_elements:
+                raise IndexError("element index {} out of range".format(index))
+            return self.element(index)
+        if isinstance(index, slice):
+            return self.reorder(np.arange(self.num_elements)[index])
+        indexes = np.asarray(index, dtype=int).reshape(-1)
+        if len(np.unique(indexes)) != len(indexes):
+            # repeated elements, dense stack like `image_set[indexes]` / 重复元素, 与稠密索引一致
+            return np.stack([self.element(i) for i in indexes])
+        return self.reorder(indexes)
+
+    def __iter__(self):
+        for i in range(self.num_elements):
+            yield self.element(i)
+
+    def sum(self, axis = 0):
+        """
+        Merged image of every element, like `.sum(0)` on the dense stack
+        """
+        assert axis == 0
+        return self.apply_mask(self.labels >= 0)
+
+    def __array__(self, dtype = None, copy = None):
+        if self.image.ndim == 3:
+            dense = self.image[np.newaxis] * self.masks()[..., np.newaxis]
+        else:
+            dense = self.image[np.newaxis] * self.masks()
+        return dense if dtype is None else dense.astype(dtype)
@@ -0,0 +1,88 @@
+import hashlib
+import os
+import shutil
+import uuid
+
+import numpy as np
+
+from .element_set import ElementSet
+
+class ElementFeatureCache(object):
+    """
+    On-disk, content addressed cache of per-image element features.
+
+    An entry is keyed by the hash of the element set (so of the image and
+    its partition) and the model id, and holds one `.npy` file per array:
+    the element embeddings, the `effectiveness_dist` matrix and the
+    embeddings of the full and the empty image. Arrays are memory-mapped on
+    load. An entry is written to a temporary directory and renamed into
+    place, so several worker processes can share one cache directory.
+    With `root = None` the entries are only kept in memory.
+    """
+    def __init__(self,
+                 root,
+                 model_id = "model"):
+        self.root = root
+        self.model_id = model_id
+        self.entries = {}   # in-memory entries, root = None
+
+        self.hits = 0
+        self.misses = 0
+
+    def key(self, partition_image_set):
+        digest = hashlib.sha1()
+        digest.update(self.model_id.encode())
+        if isinstance(partition_image_set, ElementSet):
+            # same key whatever the width the label map is stored in / 与标签图的存储位宽无关
+            arrays = [partition_image_set.image, np.asarray(partition_image_set.labels, dtype=np.int32)]
+        else:
+            arrays = [np.asarray(partition_image_set)]
+        for array in arrays:
+            array = np.ascontiguousarray(array)
+            digest.update("{}{}".format(array.dtype, array.shape).encode())
+            digest.update(array.tobytes())
+        return digest.hexdigest()
+
+    def path(self, key):
+        return os.path.join(self.root, key[:2], key)
+
+    def load(self, partition_image_set):
+        """
+        Cached arrays of an element set (memory-mapped), None if absent
+        """
+        key = self.key(partition_image_set)
+        if self.root is None:
+            if key not in self.entries:
+                self.misses += 1
+                return None
+            self.hits += 1
+            return self.entries[key]
+
+        path = self.path(key)
+        if not os.path.isdir(path):
+            self.misses += 1
+            return None
+        self.hits += 1
+        return {
+            name[:-len(".npy")]: np.load(os.path.join(path, name), mmap_mode="r")
+            for name in os.listdir(path) if name.endswith(".npy")
+        }
+
+    def save(self, partition_image_set, **arrays):
+        key = self.key(partition_image_set)
+        if self.root is None:
+            self.entries[key] = {name: np.asarray(array) for name, array in arrays.items()}
+            return
+
+        path = self.path(key)
+        if os.path.isdir(path):
+            return
+        tmp_path = "{}.tmp-{}".format(path, uuid.uuid4().hex)
+        os.makedirs(tmp_path)
+        for name, array in arrays.items():
+            np.save(os.path.join(tmp_path, name + ".npy"), np.asarray(array))
+        try:
+            os.rename(tmp_path, path)
+        except OSError:
+            # another worker stored the same entry first
+            shutil.rmtree(tmp_path, ignore_errors=True)
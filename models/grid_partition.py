@@ -0,0 +1,67 @@
+import numpy as np
+import cv2
+
+from .element_set import ElementSet
+
+def rank_labels(priors, count, size):
+    """
+    Label rows [B,N] from the priors [B,N]: the `size` highest entries of a
+    row are element 0, the next `size` element 1, ..., `count` elements,
+    the remaining entries -1
+    """
+    index = np.argsort(-priors, axis=1)     # From high to low
+    labels = np.full(priors.shape, -1, dtype=np.int32)
+    ranked = np.arange(count * size, dtype=np.int32) // size
+    labels[np.arange(len(priors))[:, np.newaxis], index[:, :count * size]] = ranked
+    return labels
+
+def pixel_partition(images, priors, partition_number = 112):
+    """
+    ElementSets of a batch of images, the pixels ranked by the explanation
+    prior (e.g. an HSIC map) and cut into `partition_number` sets of equal
+    size, most salient first
+        :param images: [B,H,W,C] or a list of images of one shape
+        :param priors: [B,H,W] saliency maps
+    """
+    images = np.asarray(images)
+    priors = np.asarray(priors)
+    pixels_per_partition = int(priors[0].size / partition_number)
+
+    labels = rank_labels(priors.reshape(len(priors), -1), partition_number, pixels_per_partition)
+    labels = labels.reshape(priors.shape[:3])
+    return [ElementSet(image, label, num_elements=partition_number) for image, label in zip(images, labels)]
+
+def grid_partition(images, priors, grad_size = 28, grad_num_per_set = 8):
+    """
+    ElementSets of a batch of images divided into grad_size x grad_size
+    cells: the cells are ranked by the prior pooled to the grid, each
+    element holds grad_num_per_set cells, most salient first
+        :param images: [B,H,W,C] or a list of images of one shape
+        :param priors: saliency maps, any size
+    """
+    images = np.asarray(images)
+    partition_number = int(grad_size * grad_size / grad_num_per_set)
+
+    pool_z = np.stack([cv2.resize(np.asarray(prior), (grad_size, grad_size)).reshape(-1) for prior in priors])
+    cell_labels = rank_labels(pool_z, partition_number, grad_num_per_set)
+
+    # the grid cell of every pixel, as a nearest upsampling of the grid / 每个像素所属的网格
+    cells = cv2.resize(
+        np.arange(grad_size * grad_size, dtype=np.int32).reshape(grad_size, grad_size),
+        (images.shape[2], images.shape[1]), interpolation=cv2.INTER_NEAREST)
+    labels = cell_labels[:, cells]
+    return [ElementSet(image, label, num_elements=partition_number) for image, label in zip(images, labels)]
+
+def patch_partition(images, partition_size = 10):
+    """
+    ElementSets of a batch of images cut into partition_size x partition_size
+    square patches, row by row
+    """
+    images = np.asarray(images)
+    pixel_length = int(images.shape[1] / partition_size)
+
+    rows = np.arange(images.shape[1]) // pixel_length
+    columns = np.arange(images.shape[2]) // pixel_length
+    label = rows[:, np.newaxis] * partition_size + columns[np.newaxis]
+    label[(rows[:, np.newaxis] >= partition_size) | (columns[np.newaxis] >= partition_size)] = -1
+    return [ElementSet(image, label, num_elements=partition_size * partition_size) for image in images]
@@ -0,0 +1,91 @@
+import heapq
+
+class LazyGreedy(object):
+    """
+    Lazy greedy selection with stale upper bounds.
+
+    A max-heap keeps the last known marginal gain of every remaining
+    candidate. For a submodular objective gains only shrink as the set grows,
+    so a stale gain is an upper bound: only the top entries are re-evaluated,
+    a few at a time, until a fresh gain beats every stale bound. `tolerance`
+    accepts a fresh gain that is within `tolerance` of the best stale bound,
+    which covers score terms that are not exactly submodular.
+    """
+    def __init__(self,
+                 batch_size = 8,
+                 tolerance = 0.0,
+                 forward_passes_per_candidate = 1):
+        self.batch_size = batch_size
+        self.tolerance = tolerance
+        self.forward_passes_per_candidate = forward_passes_per_candidate
+
+        self.heap = []          # (-gain, candidate, step)
+        self.step = 0
+        self.base_score = 0.
+
+        self.evaluated = 0      # candidates actually scored
+        self.full_greedy = 0    # candidates a full greedy pass would score
+
+    def push(self, candidates, scores):
+        for candidate_, score in zip(candidates, scores):
+            heapq.heappush(self.heap, (-(float(score) - self.base_score), int(candidate_), self.step))
+
+    def select(self, candidate_set, evaluate):
+        """
+        Pick the next element from `candidate_set`.
+            @evaluate: candidates -> dict of per-candidate numpy arrays, key "smdl_score" is f(S + c)
+        Return the chosen candidate and its row of `evaluate` results.
+        """
+        candidate_set = [int(c) for c in candidate_set]
+        self.full_greedy += len(candidate_set)
+
+        fresh = {}  # candidate -> row of evaluate results, this step only
+
+        def run(candidates):
+            results = evaluate(candidates)
+            self.evaluated += len(candidates)
+            self.push(candidates, results["smdl_score"])
+            for i, candidate_ in enumerate(candidates):
+                fresh[candidate_] = {key: value[i] for key, value in results.items()}
+
+        if len(self.heap) == 0:
+            run(candidate_set)
+
+        while True:
+            if self.heap[0][2] == self.step:
+                chosen = heapq.heappop(self.heap)[1]
+                break
+
+            best_fresh = [entry for entry in self.heap if entry[2] == self.step]
+            if len(best_fresh) > 0:
+                best_fresh = min(best_fresh)
+                if -best_fresh[0] >= -self.heap[0][0] - self.tolerance:
+                    self.heap.remove(best_fresh)
+                    heapq.heapify(self.heap)
+                    chosen = best_fresh[1]
+                    break
+
+            # re-evaluate the top stale entries in one batch
+            candidates = []
+            stale = []
+            while self.heap and len(candidates) < self.batch_size:
+                entry = heapq.heappop(self.heap)
+                if entry[2] == self.step:
+                    stale.append(entry)
+                else:
+                    candidates.append(entry[1])
+            for entry in stale:
+                heapq.heappush(self.heap, entry)
+            run(candidates)
+
+        self.base_score = float(fresh[chosen]["smdl_score"])
+        self.step += 1
+        return chosen, fresh[chosen]
+
+    @property
+    def forward_passes(self):
+        return self.evaluated * self.forward_passes_per_candidate
+
+    @property
+    def forward_passes_saved(self):
+        return (self.full_greedy - self.evaluated) * self.forward_passes_per_candidate
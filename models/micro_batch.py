@@ -0,0 +1,112 @@
+import os
+import torch
+
+def is_out_of_memory(error):
+    return isinstance(error, RuntimeError) and "out of memory" in str(error)
+
+class ForwardBatcher(object):
+    """
+    Run a model forward in micro-batches that fit a memory budget.
+
+    The largest safe batch size is probed once per (model, input shape,
+    device, budget) with a forward on one and two samples, and cached for
+    every later image. On CUDA the probe reads the peak allocated memory; on
+    CPU it estimates it from the largest module input + output. A forward
+    that still runs out of memory halves the cached batch size and retries.
+    """
+    batch_sizes = {}    # shared by every engine, kept across images
+
+    def __init__(self,
+                 batch_size = None,
+                 memory_budget = None,
+                 max_batch_size = 512):
+        self.batch_size = batch_size            # fixed micro-batch size, skips the probe
+        self.memory_budget = memory_budget      # bytes, default: 80% of the free memory
+        self.max_batch_size = max_batch_size
+
+    def available_memory(self, device):
+        if device.type == "cuda":
+            free, _ = torch.cuda.mem_get_info(device)
+            return free
+        return os.sysconf("SC_AVPHYS_PAGES") * os.sysconf("SC_PAGE_SIZE")
+
+    def peak_memory(self, model, batch_input_images):
+        """
+        Peak memory (bytes) of one forward
+        """
+        device = batch_input_images.device
+        if device.type == "cuda":
+            torch.cuda.synchronize(device)
+            torch.cuda.reset_peak_memory_stats(device)
+            base = torch.cuda.memory_allocated(device)
+            model(batch_input_images)
+            torch.cuda.synchronize(device)
+            return torch.cuda.max_memory_allocated(device) - base
+
+        peaks = [0]
+        def hook(module, inputs, outputs):
+            tensors = list(inputs) + (list(outputs) if isinstance(outputs, (tuple, list)) else [outputs])
+            peaks.append(sum(t.numel() * t.element_size() for t in tensors if torch.is_tensor(t)))
+        handles = [module.register_forward_hook(hook) for module in model.modules()] if isinstance(model, torch.nn.Module) else []
+        try:
+            model(batch_input_images)
+        finally:
+            for handle in handles:
+                handle.remove()
+        return max(peaks)
+
+    def probe(self, model, batch_input_images):
+        """
+        Largest batch size whose forward fits the memory budget
+        """
+        device = batch_input_images.device
+        budget = self.memory_budget
+        if budget is None:
+            budget = 0.8 * self.available_memory(device)
+
+        sample = batch_input_images[:1]
+        with torch.no_grad():
+            peak_1 = self.peak_memory(model, sample)
+            peak_2 = self.peak_memory(model, torch.cat([sample, sample]))
+        per_sample = max(peak_2 - peak_1, 1)
+        fixed = max(peak_1 - per_sample, 0)
+
+        batch_size = int((budget - fixed) // per_sample)
+        return max(1, min(batch_size, self.max_batch_size))
+
+    def cache_key(self, model, batch_input_images):
+        return (id(model), tuple(batch_input_images.shape[1:]), str(batch_input_images.device), self.memory_budget)
+
+    def batch_size_for(self, model, batch_input_images):
+        if self.batch_size is not None:
+            return self.batch_size
+        key = self.cache_key(model, batch_input_images)
+        if key not in ForwardBatcher.batch_sizes:
+            ForwardBatcher.batch_sizes[key] = self.probe(model, batch_input_images)
+        return ForwardBatcher.batch_sizes[key]
+
+    def __call__(self, model, batch_input_images):
+        """
+        model(batch_input_images), computed micro-batch by micro-batch
+        """
+        batch_size = self.batch_size_for(model, batch_input_images)
+
+        outputs = []
+        start = 0
+        while start < len(batch_input_images):
+            try:
+                outputs.append(model(batch_input_images[start : start + batch_size]))
+            except RuntimeError as error:
+                if not is_out_of_memory(error) or batch_size == 1:
+                    raise
+                if batch_input_images.is_cuda:
+                    torch.cuda.empty_cache()
+                # remember the smaller size for the next images
+                batch_size = max(1, batch_size // 2)
+                if self.batch_size is not None:
+                    self.batch_size = batch_size
+                else:
+                    ForwardBatcher.batch_sizes[self.cache_key(model, batch_input_images)] = batch_size
+                continue
+            start += batch_size
+        return outputs[0] if len(outputs) == 1 else torch.cat(outputs)
@@ -0,0 +1,75 @@
+import hashlib
+import json
+import os
+import shutil
+import uuid
+
+import numpy as np
+
+from .element_set import ElementSet
+
+# SamAutomaticMaskGenerator setting of SAM_mask_generate.py / SAM_mask_generate.py中的SAM设置
+SAM_PARAMS = {"model_type": "vit_h", "stability_score_thresh": 0.8}
+
+class PartitionCache(object):
+    """
+    On-disk, content addressed cache of image partitions.
+
+    An entry is keyed by the hash of the image and the partition method
+    with all its parameters (e.g. "slico", region_size, ruler, iterations,
+    or "sam" and the mask generator settings), and holds the label map in
+    the smallest integer dtype that fits plus the number of elements. The
+    label map is memory-mapped on load and the ElementSet keeps it in that
+    dtype. The image is not stored, the caller has it. Like
+    ElementFeatureCache, an entry is written to a temporary directory and
+    renamed into place, so worker processes can share one cache directory.
+    """
+    def __init__(self,
+                 root):
+        self.root = root
+        self.hits = 0
+        self.misses = 0
+
+    def key(self, image, method, **params):
+        digest = hashlib.sha1()
+        digest.update(json.dumps([method, params], sort_keys=True).encode())
+        image = np.ascontiguousarray(image)
+        digest.update("{}{}".format(image.dtype, image.shape).encode())
+        digest.update(image.tobytes())
+        return digest.hexdigest()
+
+    def path(self, key):
+        return os.path.join(self.root, key[:2], key)
+
+    def load(self, image, method, **params):
+        """
+        Cached ElementSet of an image, None if absent
+        """
+        path = self.path(self.key(image, method, **params))
+        if not os.path.isdir(path):
+            self.misses += 1
+            return None
+        self.hits += 1
+        labels = np.load(os.path.join(path, "labels.npy"), mmap_mode="r")
+        num_elements = int(np.load(os.path.join(path, "num_elements.npy")))
+        return ElementSet(image, labels, num_elements=num_elements)
+
+    def save(self, image, method, element_set, **params):
+        path = self.path(self.key(image, method, **params))
+        if os.path.isdir(path):
+            return
+        labels = element_set.labels
+        for dtype in [np.int8, np.int16, np.int32]:
+            if len(element_set) <= np.iinfo(dtype).max:
+                labels = labels.astype(dtype)
+                break
+
+        tmp_path = "{}.tmp-{}".format(path, uuid.uuid4().hex)
+        os.makedirs(tmp_path)
+        np.save(os.path.join(tmp_path, "labels.npy"), labels)
+        np.save(os.path.join(tmp_path, "num_elements.npy"), np.asarray(len(element_set)))
+        try:
+            os.rename(tmp_path, path)
+        except OSError:
+            # another worker stored the same entry first
+            shutil.rmtree(tmp_path, ignore_errors=True)
@@ -0,0 +1,80 @@
+import os
+import multiprocessing
+import numpy as np
+
+from concurrent.futures import ProcessPoolExecutor
+
+import torch
+
+# explainer of this worker process / 本工作进程的解释器
+worker_engine = None
+
+def init_worker(engine_factory, devices):
+    global worker_engine
+    device = devices.get()
+    if device is not None:
+        # set before the first CUDA call of the worker / 在工作进程第一次调用CUDA之前设置
+        os.environ["CUDA_VISIBLE_DEVICES"] = str(device)
+    worker_engine = engine_factory()
+
+def search_partition(state, partition):
+    """
+    Load the per-image state of the parent explainer, run the greedy on one partition
+    """
+    for key, value in state.items():
+        if torch.is_tensor(value):
+            value = value.to(worker_engine.device)
+        setattr(worker_engine, key, value)
+    with torch.no_grad():
+        return np.asarray(worker_engine.search_partition(partition), dtype=int)
+
+class PartitionPool(object):
+    """
+    Worker processes running the partition phase of the distributed greedy
+    (GreeDi): every partition is searched by its own worker, the parent
+    runs the final greedy over the union of the selections.
+
+    Each worker builds one explainer replica with `engine_factory()` (a
+    picklable callable, e.g. a functools.partial of the explainer class)
+    and keeps it for every image. `devices` gives the CUDA_VISIBLE_DEVICES
+    of each worker, dealt round robin (e.g. ["0", "1"], or ["0,1", "2,3"]
+    for explainers that use two GPUs), None keeps the parent's devices.
+    """
+    def __init__(self,
+                 engine_factory,
+                 workers = 2,
+                 devices = None):
+        # CUDA can not be used in forked processes / CUDA不能在fork的进程中使用
+        context = multiprocessing.get_context("spawn")
+        device_queue = context.Queue()
+        for i in range(workers):
+            device_queue.put(None if devices is None else devices[i % len(devices)])
+
+        self.workers = workers
+        self.executor = ProcessPoolExecutor(
+            max_workers=workers, mp_context=context,
+            initializer=init_worker, initargs=(engine_factory, device_queue))
+
+    def map(self, engine, partitions):
+        """
+        Selected indexes of every partition, searched concurrently with the
+        `partition_state_keys` attributes of `engine`
+        """
+        state = {}
+        for key in engine.partition_state_keys:
+            value = getattr(engine, key)
+            if torch.is_tensor(value):
+                value = value.detach().cpu()
+            state[key] = value
+
+        futures = [self.executor.submit(search_partition, state, partition) for partition in partitions]
+        return [future.result() for future in futures]
+
+    def close(self):
+        self.executor.shutdown()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
@@ -0,0 +1,118 @@
+import time
+import threading
+
+from concurrent.futures import Future, ThreadPoolExecutor
+
+import torch
+
+class PendingBatch(object):
+    """
+    Preprocessed batch still being produced by the pipeline workers: its
+    chunks in order, each a Future of an on-device tensor (or a tensor)
+    """
+    def __init__(self, chunks, sizes):
+        self.chunks = chunks
+        self.sizes = sizes
+
+    def __len__(self):
+        return sum(self.sizes)
+
+def concat_batches(batches):
+    """
+    torch.cat of image batches, pending ones stay pending
+    """
+    if not any(isinstance(batch, PendingBatch) for batch in batches):
+        return torch.cat(batches)
+
+    chunks = []
+    sizes = []
+    for batch in batches:
+        if isinstance(batch, PendingBatch):
+            chunks += batch.chunks
+            sizes += batch.sizes
+        else:
+            chunks.append(batch)
+            sizes.append(len(batch))
+    return PendingBatch(chunks, sizes)
+
+class PipelinedExecutor(object):
+    """
+    Producer/consumer scoring path.
+
+    `submit` hands the requests of a batch to a thread pool in chunks of
+    `chunk_size`: each worker composes and preprocesses its chunk on the
+    CPU and copies it to the device (pinned buffer, non-blocking transfer),
+    the chunks are produced concurrently. `consume` waits for the chunks
+    and runs one forward over the whole batch, so the forward is still
+    fused by the ForwardBatcher up to its memory budget.
+
+    Per-stage timing, seconds:
+        "compose": producer time, summed over the workers
+        "forward": consumer forward time (synchronized on CUDA)
+        "wait": consumer time spent waiting for the chunks
+        "overlap": producer time hidden by the concurrent workers, compose - wait
+    """
+    def __init__(self,
+                 workers = 2,
+                 chunk_size = 16,
+                 device = "cuda"):
+        self.workers = workers
+        self.chunk_size = chunk_size
+        self.device = torch.device(device)
+        self.pool = ThreadPoolExecutor(max_workers=workers)
+
+        # the composers keep a running-sum cache, they are not thread safe
+        self.compose_lock = threading.Lock()
+        self.timing_lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        self.stages = {"compose": 0.0, "forward": 0.0, "wait": 0.0}
+
+    def add(self, stage, seconds):
+        with self.timing_lock:
+            self.stages[stage] += seconds
+
+    def timing(self):
+        timing = dict(self.stages)
+        timing["overlap"] = max(timing["compose"] - timing["wait"], 0.0)
+        return timing
+
+    def produce(self, preprocess, requests):
+        start = time.perf_counter()
+        batch = preprocess(requests)
+        if self.device.type == "cuda":
+            batch = batch.pin_memory().to(self.device, non_blocking=True)
+        else:
+            batch = batch.to(self.device)
+        self.add("compose", time.perf_counter() - start)
+        return batch
+
+    def submit(self, preprocess, requests):
+        """
+        PendingBatch of `preprocess(requests)`, produced chunk by chunk in the background
+        """
+        chunks = []
+        sizes = []
+        for start in range(0, len(requests), self.chunk_size):
+            chunk = requests[start : start + self.chunk_size]
+            chunks.append(self.pool.submit(self.produce, preprocess, chunk))
+            sizes.append(len(chunk))
+        return PendingBatch(chunks, sizes)
+
+    def consume(self, batch, forward):
+        """
+        forward(batch) on the concatenated chunks of a PendingBatch
+        """
+        chunks = []
+        start = time.perf_counter()
+        for chunk in batch.chunks:
+            chunks.append(chunk.result() if isinstance(chunk, Future) else chunk)
+        self.add("wait", time.perf_counter() - start)
+
+        start = time.perf_counter()
+        outputs = forward(torch.cat(chunks))
+        if self.device.type == "cuda":
+            torch.cuda.synchronize(self.device)
+        self.add("forward", time.perf_counter() - start)
+        return outputs
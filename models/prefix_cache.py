@@ -0,0 +1,43 @@
+from collections import OrderedDict
+
+class PrefixCache(object):
+    """
+    Running state of the recently used base sets of a greedy search.
+
+    The search only ever asks for `base_set + [candidate]`, and the base set
+    grows by one element per step. The state of each recent base set is
+    kept in a small LRU, and a base set that extends a cached one by a
+    single element is updated with `extend` instead of rebuilt with `union`.
+    Subclasses define both.
+    """
+    def __init__(self,
+                 cache_size = 4):
+        self.cache_size = cache_size
+        self.running_sums = OrderedDict()
+
+    def running_sum(self, base_set):
+        """
+        Running state of the base set, reused across steps
+        """
+        key = tuple(int(i) for i in base_set)
+        if key in self.running_sums:
+            self.running_sums.move_to_end(key)
+            return self.running_sums[key]
+
+        if len(key) > 0 and key[:-1] in self.running_sums:
+            running = self.extend(self.running_sums[key[:-1]], key[-1])
+            # the shorter prefix is no longer needed once the set has grown
+            del self.running_sums[key[:-1]]
+        else:
+            running = self.union(key)
+
+        self.running_sums[key] = running
+        while len(self.running_sums) > self.cache_size:
+            self.running_sums.popitem(last=False)
+        return running
+
+    def extend(self, running, index):
+        raise NotImplementedError
+
+    def union(self, index_set):
+        raise NotImplementedError
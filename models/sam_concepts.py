@@ -0,0 +1,65 @@
+import numpy as np
+
+def sam_label_map(segmentations, shape, min_area = 0.0005):
+    """
+    Label map of SAM masks made disjoint, then the residual background.
+
+    Same result as the original pairwise rule of SAM_mask_generate.py: the pairs
+    (i, j), i < j, are visited in order and the mask with the smaller
+    current area keeps their intersection (mask j on ties). Masks whose
+    final area is at most `min_area` of the image are dropped, the kept
+    ones are numbered in order and every other pixel is the last element.
+
+    Only pixels covered by two masks or more can change owner, so the pairs
+    are resolved on those pixels only, within the raster span shared by the
+    two masks, and only the pairs that intersect at all are visited.
+        :param segmentations: list of boolean [H,W] masks
+        :param shape: (H, W), for an empty list
+        :return: int32 label map [H,W], number of elements
+    """
+    num = len(segmentations)
+    H, W = shape[:2]
+    masks = [np.asarray(mask, dtype=bool).reshape(-1) for mask in segmentations]
+
+    coverage = np.zeros(H * W, dtype=np.int32)
+    for mask in masks:
+        coverage += mask
+    overlap = np.flatnonzero(coverage > 1)
+    single = coverage == 1
+
+    # current areas and membership of the overlap pixels / 当前面积与重叠像素的归属
+    areas = np.array([mask.sum() for mask in masks], dtype=np.int64)
+    members = np.zeros((num, len(overlap)), dtype=bool)                     # num x |overlap|
+    for i, mask in enumerate(masks):
+        members[i] = mask[overlap]
+    # raster order span of every mask in the overlap columns / 每个掩码在重叠列中的光栅范围
+    spans = [(0, 0) if not member.any() else (member.argmax(), len(member) - member[::-1].argmax()) for member in members]
+
+    # masks only shrink, pairs disjoint at the start stay disjoint
+    intersecting = (members.astype(np.float32) @ members.T.astype(np.float32)) > 0
+    for i in range(num - 1):
+        for j in np.flatnonzero(intersecting[i, i + 1:]) + i + 1:
+            begin, end = max(spans[i][0], spans[j][0]), min(spans[i][1], spans[j][1])
+            candidates = begin + np.flatnonzero(members[i, begin:end] & members[j, begin:end])
+            if len(candidates) == 0:
+                continue
+            intersection = len(candidates)
+            if intersection / areas[i] > intersection / areas[j]:
+                loser = j
+            else:
+                loser = i
+            members[loser, candidates] = False
+            areas[loser] -= intersection
+
+    # owner of every pixel, -1 where no mask / 每个像素的归属
+    owner = np.full(H * W, -1, dtype=np.int64)
+    for i, mask in enumerate(masks):
+        owner[mask & single] = i
+    if num > 0:
+        owner[overlap] = members.argmax(0)
+
+    kept = areas / (H * W) > min_area
+    number = int(kept.sum())
+    lookup = np.full(num + 1, number, dtype=np.int32)    # owner -1 reads the trailing background
+    lookup[np.flatnonzero(kept)] = np.arange(number, dtype=np.int32)
+    return lookup[owner].reshape(H, W), number + 1
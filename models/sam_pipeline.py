@@ -0,0 +1,271 @@
+import json
+import os
+import time
+import uuid
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import cv2
+import numpy as np
+import torch
+
+from .element_set import ElementSet
+from .sam_concepts import sam_label_map
+from .superpixel_service import superpixel_labels
+
+def rle_encode(labels):
+    """
+    Raster order run-length encoding of a label map: run values, run lengths
+    """
+    flat = np.asarray(labels).reshape(-1)
+    starts = np.flatnonzero(np.concatenate([[True], flat[1:] != flat[:-1]]))
+    lengths = np.diff(np.append(starts, len(flat)))
+    return flat[starts].astype(np.int32), lengths.astype(np.int32)
+
+def rle_decode(values, lengths, shape):
+    return np.repeat(values, lengths).reshape(shape)
+
+def describe(error):
+    return "{}: {}".format(type(error).__name__, error)
+
+class MaskManifest(object):
+    """
+    Append-only json lines record of every image handled by the pipeline,
+    the last record of an image wins (a retried failure becomes "ok")
+    """
+    def __init__(self, path):
+        self.path = path
+        self.records = {}
+        if os.path.exists(path):
+            with open(path, "r") as f:
+                for line in f:
+                    if line.strip() != "":
+                        record = json.loads(line)
+                        self.records[record["image"]] = record
+
+    def write(self, records):
+        with open(self.path, "a") as f:
+            for record in records:
+                f.write(json.dumps(record, ensure_ascii=False) + "\n")
+                self.records[record["image"]] = record
+
+    def done(self, name):
+        return self.records.get(name, {}).get("status") == "ok"
+
+    def failures(self):
+        return [record for record in self.records.values() if record["status"] == "failed"]
+
+class SamMaskStore(object):
+    """
+    Sharded store of the pipeline: the label map of every image is run-length
+    encoded, `shard_size` images per compressed `.npz` shard, and
+    `manifest.jsonl` maps each image to its shard (or to its failure). A
+    shard is written before its manifest records, so an interrupted run
+    resumes from the last complete shard. The images are not stored.
+    """
+    def __init__(self,
+                 root,
+                 shard_size = 256):
+        self.root = root
+        self.shard_size = shard_size
+        os.makedirs(root, exist_ok=True)
+        self.manifest = MaskManifest(os.path.join(root, "manifest.jsonl"))
+        self.pending = []
+        self.opened = (None, None)      # last loaded shard / 最近读取的分片
+
+    def done(self, name):
+        return self.manifest.done(name)
+
+    def add(self, name, element_set, **info):
+        values, lengths = rle_encode(element_set.labels)
+        self.pending.append((name, values, lengths, element_set.labels.shape, len(element_set), info))
+        if len(self.pending) >= self.shard_size:
+            self.flush()
+
+    def fail(self, name, stage, error):
+        self.manifest.write([{"image": name, "status": "failed", "stage": stage, "error": error}])
+
+    def flush(self):
+        if len(self.pending) == 0:
+            return
+        shard = "shard-{}.npz".format(uuid.uuid4().hex[:12])
+        runs = np.cumsum([0] + [len(values) for _, values, _, _, _, _ in self.pending])
+        tmp_path = os.path.join(self.root, shard + ".tmp.npz")
+        np.savez_compressed(
+            tmp_path,
+            values=np.concatenate([values for _, values, _, _, _, _ in self.pending]),
+            lengths=np.concatenate([lengths for _, _, lengths, _, _, _ in self.pending]),
+            runs=runs)
+        os.rename(tmp_path, os.path.join(self.root, shard))
+
+        records = []
+        for index, (name, _, _, shape, num_elements, info) in enumerate(self.pending):
+            record = {"image": name, "status": "ok", "shard": shard, "index": index,
+                      "shape": list(shape), "num_elements": num_elements}
+            record.update(info)
+            records.append(record)
+        self.manifest.write(records)
+        self.pending = []
+
+    def load(self, name, image):
+        """
+        ElementSet of a stored image, None if absent or failed
+        """
+        record = self.manifest.records.get(name)
+        if record is None or record["status"] != "ok":
+            return None
+        if self.opened[0] != record["shard"]:
+            with np.load(os.path.join(self.root, record["shard"])) as data:
+                self.opened = (record["shard"], {key: data[key] for key in data.files})
+        data = self.opened[1]
+        begin, end = data["runs"][record["index"]], data["runs"][record["index"] + 1]
+        labels = rle_decode(data["values"][begin:end], data["lengths"][begin:end], record["shape"])
+        return ElementSet(image, labels, num_elements=record["num_elements"])
+
+    def close(self):
+        self.flush()
+
+class MaskFileWriter(object):
+    """
+    Per-image `.npz` ElementSets (the layout read by `load_element_set`),
+    with the same manifest as SamMaskStore
+    """
+    def __init__(self,
+                 root):
+        self.root = root
+        os.makedirs(root, exist_ok=True)
+        self.manifest = MaskManifest(os.path.join(root, "manifest.jsonl"))
+
+    def path(self, name):
+        return os.path.join(self.root, os.path.splitext(name)[0] + ".npz")
+
+    def done(self, name):
+        return os.path.exists(self.path(name)) or os.path.exists(os.path.splitext(self.path(name))[0] + ".npy")
+
+    def add(self, name, element_set, **info):
+        os.makedirs(os.path.dirname(self.path(name)), exist_ok=True)
+        element_set.save(self.path(name))
+        record = {"image": name, "status": "ok", "num_elements": len(element_set)}
+        record.update(info)
+        self.manifest.write([record])
+
+    def fail(self, name, stage, error):
+        self.manifest.write([{"image": name, "status": "failed", "stage": stage, "error": error}])
+
+    def close(self):
+        pass
+
+class SuperpixelMaskGenerator(object):
+    """
+    Lightweight stand-in of SamAutomaticMaskGenerator: SLIC superpixels as
+    SAM-style mask records, to run the pipeline without a SAM checkpoint
+    """
+    def __init__(self,
+                 region_size = 30,
+                 ruler = 20.0):
+        self.region_size = region_size
+        self.ruler = ruler
+
+    def generate(self, image):
+        labels, number = superpixel_labels(image, "slico", self.region_size, self.ruler)
+        masks = []
+        for i in range(number):
+            segmentation = labels == i
+            masks.append({"segmentation": segmentation, "area": int(segmentation.sum())})
+        return masks
+
+def run_mask_pipeline(mask_generator, names, read_image, writer,
+                      prefetch = 4, partition_cache = None, cache_params = None):
+    """
+    Masks of every image not yet done by `writer`.
+
+    Three stages overlap: a thread pool reads the next `prefetch` images,
+    the generator runs on the current one (`mask_generator.generate(rgb)`,
+    SamAutomaticMaskGenerator or any backend with the same interface), and
+    one thread resolves the overlaps of the previous one (`sam_label_map`)
+    and writes it. Failures are recorded per image with their stage and
+    error, the run goes on.
+        :param read_image: name -> BGR image, None if unreadable
+        :param partition_cache: PartitionCache, looked up before generating,
+                                entries keyed by "sam" and `cache_params`
+        :return: number of images written, failed and already done
+    """
+    cache_params = cache_params or {}
+    todo = [name for name in names if not writer.done(name)]
+    counts = {"ok": 0, "failed": 0, "skipped": len(names) - len(todo)}
+
+    def fail(name, stage, error):
+        counts["failed"] += 1
+        writer.fail(name, stage, error)
+        print("Image {} failed at {}: {}".format(name, stage, error))
+
+    def write(name, element_set, **info):
+        try:
+            writer.add(name, element_set, **info)
+            counts["ok"] += 1
+        except Exception as error:
+            fail(name, "write", describe(error))
+
+    def finish(name, image, masks, seconds):
+        try:
+            labels, num_elements = sam_label_map([mask["segmentation"] for mask in masks], image.shape)
+            element_set = ElementSet(image, labels, num_elements=num_elements)
+            if partition_cache is not None:
+                partition_cache.save(image, "sam", element_set, **cache_params)
+        except Exception as error:
+            fail(name, "resolve", describe(error))
+            return
+        write(name, element_set, masks=len(masks), seconds=round(seconds, 3))
+
+    reader = ThreadPoolExecutor(max_workers=max(prefetch, 1))
+    # writer calls all run on this thread / 写入都在这个线程上执行
+    finisher = ThreadPoolExecutor(max_workers=1)
+    finishing = deque()
+
+    try:
+        reads = deque()
+        todo = iter(todo)
+        for name in todo:
+            reads.append((name, reader.submit(read_image, name)))
+            if len(reads) >= prefetch:
+                break
+
+        while len(reads) > 0:
+            name, future = reads.popleft()
+            for next_name in todo:
+                reads.append((next_name, reader.submit(read_image, next_name)))
+                break
+
+            try:
+                image = future.result()
+            except Exception as error:
+                finisher.submit(fail, name, "read", describe(error))
+                continue
+            if image is None:
+                finisher.submit(fail, name, "read", "unreadable image")
+                continue
+
+            if partition_cache is not None:
+                element_set = partition_cache.load(image, "sam", **cache_params)
+                if element_set is not None:
+                    finisher.submit(write, name, element_set, cached=True)
+                    continue
+
+            start = time.perf_counter()
+            try:
+                masks = mask_generator.generate(cv2.cvtColor(image, cv2.COLOR_BGR2RGB))
+            except Exception as error:
+                if isinstance(error, torch.cuda.OutOfMemoryError):
+                    torch.cuda.empty_cache()
+                finisher.submit(fail, name, "generate", "{} (image {}x{})".format(describe(error), image.shape[1], image.shape[0]))
+                continue
+            finishing.append(finisher.submit(finish, name, image, masks, time.perf_counter() - start))
+            # bounded backlog of unresolved masks / 限制待处理掩码的积压
+            while len(finishing) > 2:
+                finishing.popleft().result()
+    finally:
+        # the finished images are written and the pending shard flushed, even on an error
+        reader.shutdown(cancel_futures=True)
+        finisher.shutdown()
+        writer.close()
+    return counts
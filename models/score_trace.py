@@ -0,0 +1,80 @@
+import torch
+
+class ScoreTrace(object):
+    """
+    Selection trace kept in preallocated device tensors.
+
+    `append` writes a score into the next slot of its buffer with a device
+    side copy, so recording a greedy step does not synchronize with the
+    host. `to_dict` moves every buffer to the host with a single transfer
+    and returns plain float lists, the `saved_json_file` schema.
+    """
+    def __init__(self,
+                 keys,
+                 capacity = 64,
+                 device = "cuda"):
+        self.keys = list(keys)
+        self.device = device
+        self.buffers = {key: torch.zeros(max(int(capacity), 1), device=device) for key in self.keys}
+        self.lengths = {key: 0 for key in self.keys}
+
+    def __len__(self):
+        return max(self.lengths.values()) if self.lengths else 0
+
+    def append(self, key, value):
+        """
+        Record one score (a 0-d tensor or a number) under `key`
+        """
+        buffer = self.buffers[key]
+        length = self.lengths[key]
+        if length == len(buffer):
+            # grow by doubling, the old slots stay on the device
+            buffer = torch.cat([buffer, torch.zeros_like(buffer)])
+            self.buffers[key] = buffer
+        buffer[length] = value
+        self.lengths[key] = length + 1
+
+    def record(self, scores, index):
+        """
+        Record `scores[key][index]` for every key of a score dict
+        """
+        for key, value in scores.items():
+            self.append(key, value[index])
+
+    def last(self, keys):
+        """
+        Latest score of each key as floats, transferred to the host at once
+        """
+        return torch.stack([self.buffers[key][self.lengths[key] - 1] for key in keys]).cpu().tolist()
+
+    def since(self, lengths):
+        """
+        Scores recorded after the `lengths` snapshot, as float lists
+        """
+        keys = [key for key in self.keys if self.lengths[key] > lengths.get(key, 0)]
+        if len(keys) == 0:
+            return {}
+        values = torch.cat([self.buffers[key][lengths.get(key, 0):self.lengths[key]] for key in keys]).cpu().tolist()
+
+        scores = {}
+        start = 0
+        for key in keys:
+            size = self.lengths[key] - lengths.get(key, 0)
+            scores[key] = values[start : start + size]
+            start += size
+        return scores
+
+    def to_dict(self):
+        """
+        Trace as float lists, transferred to the host at once
+        """
+        if len(self.keys) == 0:
+            return {}
+        values = torch.cat([self.buffers[key][:self.lengths[key]] for key in self.keys]).cpu().tolist()
+
+        trace = {}
+        start = 0
+        for key in self.keys:
+            trace[key] = values[start : start + self.lengths[key]]
+            start += self.lengths[key]
+        return trace
@@ -0,0 +1,87 @@
+class SelectionStep(object):
+    """
+    Event yielded by a `get_merge_set_steps` search once a greedy step is done.
+    `subset` is the insertion side selection so far, `decrease_subset` the
+    deletion side one of the bidirectional searches.
+    """
+    def __init__(self,
+                 subset,
+                 decrease_subset = None):
+        self.subset = subset
+        self.decrease_subset = decrease_subset
+
+def run_search(steps, compute_predicted_scores = None):
+    """
+    Drive a search generator to its end: image batches are scored with
+    `compute_predicted_scores`, greedy step events are skipped
+    """
+    try:
+        request = next(steps)
+        while True:
+            if isinstance(request, SelectionStep):
+                request = steps.send(None)
+            else:
+                request = steps.send(compute_predicted_scores(request))
+    except StopIteration as stop:
+        return stop.value
+
+def skip_selection_steps(steps):
+    """
+    Generator: pass the image batches of a nested search through, drop its
+    greedy step events, returns the search result
+    """
+    try:
+        request = next(steps)
+        while True:
+            if isinstance(request, SelectionStep):
+                request = steps.send(None)
+            else:
+                request = steps.send((yield request))
+    except StopIteration as stop:
+        return stop.value
+
+def stream_search(steps, trace, compute_predicted_scores = None, curve_key = "consistency_score"):
+    """
+    Generator: drive a search generator and yield one dict per greedy step
+    as soon as it is done, returns the search result. The step scores are
+    read from the trace, one host transfer per step.
+        "step": greedy step, from 0
+        "index": element added to the insertion side
+        "decrease_index": element added to the deletion side at this step
+                          (bidirectional searches, else None)
+        "subset": insertion side selection so far
+        "scores": the scores recorded at this step, by trace key
+        "insertion_curve": `curve_key` scores of the selections so far
+    """
+    insertion_curve = []
+    lengths = dict(trace.lengths)
+    decrease_length = 0
+    step = 0
+    try:
+        request = next(steps)
+        while True:
+            if not isinstance(request, SelectionStep):
+                request = steps.send(compute_predicted_scores(request))
+                continue
+
+            scores = trace.since(lengths)
+            lengths = dict(trace.lengths)
+            insertion_curve += scores.get(curve_key, [])
+
+            # the deletion side stops growing before the insertion side / 删除侧可能先停止增长
+            decrease_index = None
+            if request.decrease_subset is not None and len(request.decrease_subset) > decrease_length:
+                decrease_index = int(request.decrease_subset[-1])
+                decrease_length = len(request.decrease_subset)
+            yield {
+                "step": step,
+                "index": int(request.subset[-1]),
+                "decrease_index": decrease_index,
+                "subset": request.subset.astype(int),
+                "scores": {key: value[-1] for key, value in scores.items() if len(value) > 0},
+                "insertion_curve": list(insertion_curve),
+            }
+            step += 1
+            request = steps.send(None)
+    except StopIteration as stop:
+        return stop.value
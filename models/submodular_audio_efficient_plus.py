@@ -10,8 +10,13 @@ import torch
 import torch.nn.functional as F
 
 from .submodular_vit_torch import MultiModalSubModularExplanation
+from .composition import build_composer
+from .streaming import SelectionStep
 
 class AudioSubModularExplanationEfficientPlus(MultiModalSubModularExplanation):
+    # trace key of the insertion curve streamed by `explain_steps`
+    insertion_curve_key = "consistency_score_increase"
+    
     def __init__(self, 
                  model,
                  semantic_feature,
@@ -70,8 +75,8 @@ class AudioSubModularExplanationEfficientPlus(MultiModalSubModularExplanation):
         # merge images / 组合图像
         sub_images = torch.stack([
             self.preproccessing_function(
-                self.merge_image(sub_index_set, partition_image_set)
-            ) for sub_index_set in sub_index_sets])
+                self.composer.compose(main_set, candidate_)
+            ) for candidate_ in candidate_set])
         
         batch_input_images = sub_images.to(self.device)
         
@@ -89,8 +94,8 @@ class AudioSubModularExplanationEfficientPlus(MultiModalSubModularExplanation):
             # 4. Collaboration Score
             sub_images_reverse = torch.stack([
                 self.preproccessing_function(
-                    self.org_img - self.merge_image(sub_index_set, partition_image_set)
-                ) for sub_index_set in sub_index_sets])
+                    self.composer.compose_reverse(main_set, candidate_)
+                ) for candidate_ in candidate_set])
         
             batch_input_images_reverse = sub_images_reverse.to(self.device)
             
@@ -99,14 +104,14 @@ class AudioSubModularExplanationEfficientPlus(MultiModalSubModularExplanation):
             # submodular score
             # smdl_score = self.lambda1 * score_confidence + self.lambda2 * score_effectiveness +  self.lambda3 * score_consistency + self.lambda4 * score_collaboration
             smdl_score = self.lambda1 * score_confidence + self.lambda2 * score_effectiveness + self.lambda3 * score_consistency + self.lambda4 * score_collaboration
-            arg_max_index = smdl_score.argmax().cpu().item()
+            arg_max_index = smdl_score.argmax().item()
             
             # if self.lambda1 != 0:
-            self.saved_json_file["confidence_score_increase"].append(score_confidence[arg_max_index].cpu().item())
-            self.saved_json_file["effectiveness_score_increase"].append(score_effectiveness[arg_max_index].cpu().item())
-            self.saved_json_file["consistency_score_increase"].append(score_consistency[arg_max_index].cpu().item())
-            self.saved_json_file["collaboration_score_increase"].append(score_collaboration[arg_max_index].cpu().item())
-            self.saved_json_file["smdl_score"].append(smdl_score[arg_max_index].cpu().item())
+            self.trace.append("confidence_score_increase", score_confidence[arg_max_index])
+            self.trace.append("effectiveness_score_increase", score_effectiveness[arg_max_index])
+            self.trace.append("consistency_score_increase", score_consistency[arg_max_index])
+            self.trace.append("collaboration_score_increase", score_collaboration[arg_max_index])
+            self.trace.append("smdl_score", smdl_score[arg_max_index])
 
             if len(candidate_set) > self.pending_samples:
                 smdl_score_decrease = self.lambda1 * score_confidence + self.lambda2 * score_effectiveness_decrease + self.lambda3 * score_consistency + self.lambda4 * score_collaboration
@@ -124,12 +129,12 @@ class AudioSubModularExplanationEfficientPlus(MultiModalSubModularExplanation):
                 # merge images / 组合图像
                 sub_images_decrease = torch.stack([
                     self.preproccessing_function(
-                        self.merge_image(sub_index_set, partition_image_set)
+                        self.composer.merge(sub_index_set)
                     ) for sub_index_set in sub_index_negtive_sets])
                 
                 sub_images_decrease_reverse = torch.stack([
                     self.preproccessing_function(
-                        self.org_img - self.merge_image(sub_index_set, partition_image_set)
+                        self.org_img - self.composer.merge(sub_index_set)
                     ) for sub_index_set in sub_index_negtive_sets])
                 
                 # 2. Effectiveness Score
@@ -145,14 +150,14 @@ class AudioSubModularExplanationEfficientPlus(MultiModalSubModularExplanation):
                 score_collaboration_decrease = 1 - self.proccess_compute_consistency_score(sub_images_decrease_reverse.to(self.device))
                 
                 smdl_score_decrease = self.lambda1 * score_confidence_decrease + self.lambda2 * score_effectiveness_decrease_ + self.lambda3 * score_consistency_decrease + self.lambda4 * score_collaboration_decrease
-                arg_min_index = smdl_score_decrease.argmin().cpu().item()
+                arg_min_index = smdl_score_decrease.argmin().item()
                 
                 decrease_set = sub_index_negtive_sets[arg_min_index]
 
-                self.saved_json_file["confidence_score_decrease"].append(score_confidence_decrease[arg_min_index].cpu().item())
-                self.saved_json_file["effectiveness_score_decrease"].append(score_effectiveness_decrease_[arg_min_index].cpu().item())
-                self.saved_json_file["consistency_score_decrease"].append(1-score_collaboration_decrease[arg_min_index].cpu().item())
-                self.saved_json_file["collaboration_score_decrease"].append(1-score_consistency_decrease[arg_min_index].cpu().item())
+                self.trace.append("confidence_score_decrease", score_confidence_decrease[arg_min_index])
+                self.trace.append("effectiveness_score_decrease", score_effectiveness_decrease_[arg_min_index])
+                self.trace.append("consistency_score_decrease", 1 - score_collaboration_decrease[arg_min_index])
+                self.trace.append("collaboration_score_decrease", 1 - score_consistency_decrease[arg_min_index])
 
         return sub_index_sets[arg_max_index], decrease_set
     
@@ -180,15 +185,19 @@ class AudioSubModularExplanationEfficientPlus(MultiModalSubModularExplanation):
         self.saved_json_file["lambda2"] = self.lambda2
         self.saved_json_file["lambda3"] = self.lambda3
         self.saved_json_file["lambda4"] = self.lambda4
+        self.trace_init()
         
-    def get_merge_set(self, partition):
+    def get_merge_set_steps(self, partition):
         """
+        Generator version of `get_merge_set`, yields a SelectionStep after each greedy step
         """
         Subset = np.array([])
         Subset_decrease = np.array([])
         
         indexes = np.arange(len(partition))
         
+        self.composer = build_composer(partition, org_img = self.org_img, dtype = None)
+        
         # First calculate the similarity of each element to facilitate calculation of effectiveness score.
         self.calculate_distance_of_each_element(partition)
         
@@ -204,6 +213,8 @@ class AudioSubModularExplanationEfficientPlus(MultiModalSubModularExplanation):
                 break
             
             Subset, Subset_decrease = self.evaluation_maximun_sample(Subset, Subset_decrease, sub_candidate_indexes, partition)
+            
+            yield SelectionStep(Subset, Subset_decrease)
         
         sub_images = torch.stack([
             self.preproccessing_function(
@@ -215,38 +226,44 @@ class AudioSubModularExplanationEfficientPlus(MultiModalSubModularExplanation):
         ])
         scores = self.proccess_compute_consistency_score(sub_images.to(self.device))
         
-        self.saved_json_file["org_score"] = scores[0].cpu().item()
-        self.saved_json_file["baseline_score"] = scores[1].cpu().item()
+        # the trace reaches the host once, here / 分数一次性传回主机
+        self.trace_flush()
+        scores = scores.cpu().tolist()
         
-        self.saved_json_file["consistency_score"] = self.saved_json_file["consistency_score_increase"] + self.saved_json_file["consistency_score_decrease"][::-1] + [scores[0].cpu().item()]
-        self.saved_json_file["collaboration_score"] = self.saved_json_file["collaboration_score_increase"] + self.saved_json_file["collaboration_score_decrease"][::-1] + [1-scores[1].cpu().item()]
+        self.saved_json_file["org_score"] = scores[0]
+        self.saved_json_file["baseline_score"] = scores[1]
+        
+        self.saved_json_file["consistency_score"] = self.saved_json_file["consistency_score_increase"] + self.saved_json_file["consistency_score_decrease"][::-1] + [scores[0]]
+        self.saved_json_file["collaboration_score"] = self.saved_json_file["collaboration_score_increase"] + self.saved_json_file["collaboration_score_decrease"][::-1] + [1-scores[1]]
         
         Subset = np.concatenate((Subset, Subset_decrease[::-1]))
         
         return Subset.astype(int)
     
-    def __call__(self, image_set, id = None):
+    def prepare_explanation(self, image_set, id = None):
         """
-        Compute Source Face Submodular Score
-            @image_set: [mask_image 1, ..., mask_image m] (cv2 format)
+        Reset the per-image state, return the element set
         """
         # V_partition = self.partition_collection(image_set)  # [ [image1, image2, ...], [image1, image2, ...], ...  ]
     
         self.save_file_init()
         
-        self.org_img = np.array(image_set).sum(0)
+        image_set = np.array(image_set)
+        self.org_img = image_set.sum(0)
         source_image = self.preproccessing_function(self.org_img)
 
         self.source_feature = self.model(source_image.unsqueeze(0).to(self.device))
         self.target_label = id
-        
-        Subset_merge = np.array(image_set)
-        Submodular_Subset = self.get_merge_set(Subset_merge)  # array([17, 42, 49, ...])
-            
+        return image_set
+    
+    def finish_explanation(self, Subset_merge, Submodular_Subset):
+        """
+        Build the outputs from the selected order
+        """
         submodular_image_set = Subset_merge[Submodular_Subset]  # sub_k x (112, 112, 3)
         
         submodular_image = submodular_image_set.sum(0)
         self.saved_json_file["smdl_score_max"] = max(self.saved_json_file["smdl_score"])
         self.saved_json_file["smdl_score_max_index"] = self.saved_json_file["smdl_score"].index(self.saved_json_file["smdl_score_max"])
 
-        return submodular_image, submodular_image_set, self.saved_json_file
\ No newline at end of file
+        return submodular_image, submodular_image_set, self.saved_json_file
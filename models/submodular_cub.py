@@ -23,12 +23,17 @@ from itertools import combinations
 from collections import OrderedDict
 
 from .evidential import relu_evidence, exp_evidence
+from .composition import build_composer
+from .element_set import ElementSet
 
 import tensorflow_addons as tfa
 from keras.models import load_model
 from insight_face_models import *
 
 class CubSubModularExplanation(object):
+    # per-image state shipped to the partition pool workers
+    partition_state_keys = ("org_img", "source_feature", "target_label", "k", "lambda1", "lambda2", "lambda3", "lambda4")
+    
     def __init__(self, 
                  cfg_path="configs/cub/submodular_cfg_cub_tf.json",
                  n = 2,
@@ -36,7 +41,8 @@ class CubSubModularExplanation(object):
                  lambda1 = 1.0,
                  lambda2 = 1.0,
                  lambda3 = 1.0,
-                 lambda4 = 1.0):
+                 lambda4 = 1.0,
+                 partition_pool = None):
         super(CubSubModularExplanation, self).__init__()
         
         # Load face model configuration / 导入人脸识别模型的配置文件
@@ -62,6 +68,8 @@ class CubSubModularExplanation(object):
         # Parameters of the submodular / submodular的超参数
         self.n = n  # the number of the partitions / 图像元素集被划分的数量
         self.k = k
+        # Partitions are searched by the workers of a PartitionPool if given, else one after another
+        self.partition_pool = partition_pool
         
         # Parameter of the LtLG algorithm / LtLG贪婪算法的参数
         self.ltl_log_ep = 5
@@ -278,12 +286,16 @@ class CubSubModularExplanation(object):
         for candidate_ in candidate_set:
             sub_index_sets.append(
                 np.concatenate((main_set, np.array([candidate_]))).astype(int))
+
+        # merge each candidate image once / 每个候选图像只组合一次
+        merged_images = [
+            self.composer.compose(main_set, candidate_) for candidate_ in candidate_set]
         
         # merge images / 组合图像
         sub_images = np.array([
             self.convert_prepare_image(
-                self.merge_image(sub_index_set, partition_image_set), moda="Torch"  # Uncertainty model is pytorch version
-            ) for sub_index_set in sub_index_sets])
+                merged_image, moda="Torch"  # Uncertainty model is pytorch version
+            ) for merged_image in merged_images])
         batch_input_images = torch.from_numpy(sub_images).type(torch.float32).to("cuda:1")
 
         with torch.no_grad():
@@ -318,13 +330,13 @@ class CubSubModularExplanation(object):
             elif self.moda == "TF":
                 batch_input_images = np.array([
                     self.convert_prepare_image(
-                        self.merge_image(sub_index_set, partition_image_set), moda=self.moda  # Uncertainty model is pytorch version
-                    ) for sub_index_set in sub_index_sets])
+                        merged_image, moda=self.moda  # Uncertainty model is pytorch version
+                    ) for merged_image in merged_images])
                 
                 batch_input_images_reverse = np.array([
                     self.convert_prepare_image(
-                        self.org_img - self.merge_image(sub_index_set, partition_image_set), moda=self.moda  # Uncertainty model is pytorch version
-                    ) for sub_index_set in sub_index_sets])
+                        self.org_img - merged_image, moda=self.moda  # Uncertainty model is pytorch version
+                    ) for merged_image in merged_images])
                 
                 recognition_score = self.model_base(batch_input_images)[:, self.target_label].numpy().tolist()
                 recognition_score_reverse = (1 - self.model_base(batch_input_images_reverse))[:, self.target_label].numpy().tolist()
@@ -369,6 +381,8 @@ class CubSubModularExplanation(object):
         
         indexes = np.arange(len(partition))
         
+        self.composer = build_composer(partition, org_img = self.org_img)
+        
         self.smdl_score_best = 0
         
         for j in range(self.k):
@@ -381,11 +395,29 @@ class CubSubModularExplanation(object):
             
         return Subset
     
+    def search_partition(self, partition):
+        """
+        Greedy selection inside one partition
+        """
+        return self.get_merge_set(partition)
+    
+    def partition_greedy(self, V_partition):
+        """
+        Selected indexes of every partition, searched concurrently by the
+        partition pool workers if any
+        """
+        if self.partition_pool is not None:
+            return self.partition_pool.map(self, V_partition)
+        return [self.search_partition(partition) for partition in V_partition]
+    
     def __call__(self, image_set, id = None):
         """
         Compute Source Face Submodular Score
-            @image_set: [mask_image 1, ..., mask_image m] (cv2 format)
+            @image_set: [mask_image 1, ..., mask_image m] (cv2 format), or an ElementSet
         """
+        if not isinstance(image_set, ElementSet):
+            image_set = np.array(image_set)
+        
         V_partition = self.partition_collection(image_set)  # [ [image1, image2, ...], [image1, image2, ...], ...  ]
         
         self.saved_json_file = {}
@@ -402,7 +434,7 @@ class CubSubModularExplanation(object):
         self.saved_json_file["lambda3"] = self.lambda3
         self.saved_json_file["lambda4"] = self.lambda4
         
-        self.org_img = np.array(image_set).sum(0).astype(np.uint8)
+        self.org_img = image_set.sum(0).astype(np.uint8)
         source_image = self.convert_prepare_image(
                 self.org_img, moda = self.moda)
         
@@ -426,14 +458,13 @@ class CubSubModularExplanation(object):
 
         if self.n != 1:
             Subset_merge = []
-            for partition in V_partition:
-                Subset = self.get_merge_set(partition)  # array([17, 42, 49, ...])
+            for partition, Subset in zip(V_partition, self.partition_greedy(V_partition)):  # array([17, 42, 49, ...])
                 Subset_merge.append(np.array(partition)[Subset])
             
             Subset_merge = np.concatenate(Subset_merge) # np.shape: (60, 112, 112, 3)
         
         else:
-            Subset_merge = np.array(image_set)
+            Subset_merge = image_set
         # print(Subset_merge.shape)
         # cv2.imwrite("Subset_merge.jpg", Subset_merge.sum(0))
         Submodular_Subset = self.get_merge_set(     # array([30, 31,  1, ...])
@@ -27,6 +27,8 @@ import time
 
 import torchvision.transforms as transforms
 from .evidential import relu_evidence, exp_evidence
+from .composition import build_composer
+from .element_set import ElementSet
 
 from tqdm import tqdm
 
@@ -240,13 +242,17 @@ class CubSubModularExplanationV2(object):
             sub_index_sets.append(
                 np.concatenate((main_set, np.array([candidate_]))).astype(int))
 
+        # merge each candidate image once / 每个候选图像只组合一次
+        merged_images = [
+            self.composer.compose(main_set, candidate_) for candidate_ in candidate_set]
+
         # Compute uncertainty / 计算不确定性
         start = time.time()
         # merge images / 组合图像
         batch_input_images_u = np.array([
             self.preprocess_image_uncertainty(
-                self.merge_image(sub_index_set, partition_image_set)  # Uncertainty model is ONNX version
-            ) for sub_index_set in sub_index_sets])
+                merged_image  # Uncertainty model is ONNX version
+            ) for merged_image in merged_images])
         
         u = self.compute_uncertainty(
             batch_input_images_u
@@ -276,8 +282,8 @@ class CubSubModularExplanationV2(object):
         start = time.time()
         batch_input_images = np.array([
             self.convert_prepare_image(
-                self.merge_image(sub_index_set, partition_image_set)
-            ) for sub_index_set in sub_index_sets])
+                merged_image
+            ) for merged_image in merged_images])
         _, score_consistency = self.recognition_model(batch_input_images)
         score_consistency = score_consistency.numpy()[:, self.target_label]
         end = time.time()
@@ -287,8 +293,8 @@ class CubSubModularExplanationV2(object):
         start = time.time()
         batch_input_images_reverse = np.array([
             self.convert_prepare_image(
-                self.org_img - self.merge_image(sub_index_set, partition_image_set)
-            ) for sub_index_set in sub_index_sets])
+                self.org_img - merged_image
+            ) for merged_image in merged_images])
         _, score_collaboration = self.recognition_model(batch_input_images_reverse)
         score_collaboration = 1 - score_collaboration.numpy()[:, self.target_label]
         end = time.time()
@@ -314,6 +320,8 @@ class CubSubModularExplanationV2(object):
         
         indexes = np.arange(len(partition))
         
+        self.composer = build_composer(partition, org_img = self.org_img)
+        
         self.smdl_score_best = 0
         
         for j in tqdm(range(self.k)):
@@ -329,8 +337,11 @@ class CubSubModularExplanationV2(object):
     def __call__(self, image_set, id = None):
         """
         Compute Source Face Submodular Score
-            @image_set: [mask_image 1, ..., mask_image m] (cv2 format)
+            @image_set: [mask_image 1, ..., mask_image m] (cv2 format), or an ElementSet
         """
+        if not isinstance(image_set, ElementSet):
+            image_set = np.array(image_set)
+        
         self.saved_json_file = {}
         self.saved_json_file["sub-k"] = self.k
         self.saved_json_file["confidence_score"] = []
@@ -343,7 +354,7 @@ class CubSubModularExplanationV2(object):
         self.saved_json_file["lambda3"] = self.lambda3
         self.saved_json_file["lambda4"] = self.lambda4
         
-        self.org_img = np.array(image_set).sum(0).astype(np.uint8)
+        self.org_img = image_set.sum(0).astype(np.uint8)
         source_image = self.convert_prepare_image(
                 self.org_img)
         
@@ -354,7 +365,7 @@ class CubSubModularExplanationV2(object):
         else:
             self.target_label = id
 
-        Subset_merge = np.array(image_set)
+        Subset_merge = image_set
         # print(Subset_merge.shape)
         # cv2.imwrite("Subset_merge.jpg", Subset_merge.sum(0))
         Submodular_Subset = self.get_merge_set(     # array([30, 31,  1, ...])
@@ -24,12 +24,18 @@ from collections import OrderedDict
 from .iresnet import iresnet50
 from .iresnet_edl import iresnet100
 from .evidential import relu_evidence, exp_evidence
+from .composition import build_composer
+from .effectiveness import EffectivenessScorer
+from .element_set import ElementSet
 
 import tensorflow_addons as tfa
 from keras.models import load_model
 from insight_face_models import *
 
 class FaceSubModularExplanation(object):
+    # per-image state shipped to the partition pool workers
+    partition_state_keys = ("org_img", "source_feature", "target_label", "k", "lambda1", "lambda2", "lambda3", "lambda4")
+    
     def __init__(self, 
                  cfg_path="configs/celeba/submodular_cfg_celeba_tf.json",
                  n = 2,
@@ -37,7 +43,8 @@ class FaceSubModularExplanation(object):
                  lambda1 = 1.0,
                  lambda2 = 1.0,
                  lambda3 = 1.0,
-                 lambda4 = 1.0):
+                 lambda4 = 1.0,
+                 partition_pool = None):
         super(FaceSubModularExplanation, self).__init__()
         
         # Load face model configuration / 导入人脸识别模型的配置文件
@@ -63,6 +70,8 @@ class FaceSubModularExplanation(object):
         # Parameters of the submodular / submodular的超参数
         self.n = n  # the number of the partitions / 图像元素集被划分的数量
         self.k = k
+        # Partitions are searched by the workers of a PartitionPool if given, else one after another
+        self.partition_pool = partition_pool
         
         # Parameter of the LtLG algorithm / LtLG贪婪算法的参数
         self.ltl_log_ep = 5
@@ -184,18 +193,8 @@ class FaceSubModularExplanation(object):
         """
         Compute each S's effectiveness score
         """
-        e_scores = []
-        
-        for sub_index in sub_index_sets:
-            cosine_dist = tf.gather(self.effectiveness_dist, sub_index, axis=1)  # [len(element), len(main_set)]
-            cosine_dist = tf.gather(cosine_dist, sub_index, axis=0)
-            
-            eye = tf.eye(cosine_dist.shape[0])
-            adjusted_cosine_dist = cosine_dist + eye
-            e_score = tf.reduce_sum(tf.reduce_min(adjusted_cosine_dist, axis=1))
-            e_scores.append(e_score)
-        
-        return tf.stack(e_scores).numpy()
+        # sub_index_sets share one base set, scored incrementally / 增量计算
+        return self.effectiveness_scorer.score_sets(sub_index_sets)
     
     def compute_mean_closeness_score(self, face_features, source_face_feature=None):
         """
@@ -256,12 +255,16 @@ class FaceSubModularExplanation(object):
         for candidate_ in candidate_set:
             sub_index_sets.append(
                 np.concatenate((main_set, np.array([candidate_]))).astype(int))
+
+        # merge each candidate image once / 每个候选图像只组合一次
+        merged_images = [
+            self.composer.compose(main_set, candidate_) for candidate_ in candidate_set]
         
         # merge images / 组合图像
         sub_images = np.array([
             self.convert_prepare_image(
-                self.merge_image(sub_index_set, partition_image_set), moda="Torch"  # Uncertainty model is pytorch version
-            ) for sub_index_set in sub_index_sets])
+                merged_image, moda="Torch"  # Uncertainty model is pytorch version
+            ) for merged_image in merged_images])
         
         batch_input_images = torch.from_numpy(sub_images).type(torch.float32).to(self.device)
         
@@ -283,13 +286,13 @@ class FaceSubModularExplanation(object):
             # Compute mean closeness score / 计算与原始人脸的相似度 (越相似越好吧)
             batch_input_images = np.array([
                 self.convert_prepare_image(
-                    self.merge_image(sub_index_set, partition_image_set), moda=self.moda  # Uncertainty model is pytorch version
-                ) for sub_index_set in sub_index_sets])
+                    merged_image, moda=self.moda  # Uncertainty model is pytorch version
+                ) for merged_image in merged_images])
             
             batch_input_images_reverse = np.array([
                 self.convert_prepare_image(
-                    self.org_img - self.merge_image(sub_index_set, partition_image_set), moda=self.moda  # Uncertainty model is pytorch version
-                ) for sub_index_set in sub_index_sets])
+                    self.org_img - merged_image, moda=self.moda  # Uncertainty model is pytorch version
+                ) for merged_image in merged_images])
             
             consistency_score = self.model_base(batch_input_images)[:, self.target_label].numpy()
             score_collaboration = 1 - self.model_base(batch_input_images_reverse)[:, self.target_label].numpy()
@@ -330,6 +333,7 @@ class FaceSubModularExplanation(object):
         cosine_similarity = tf.clip_by_value(cosine_similarity, -1, 1)
         # Normlize 0-1
         self.effectiveness_dist = tf.acos(cosine_similarity) / math.pi
+        self.effectiveness_scorer = EffectivenessScorer(self.effectiveness_dist.numpy())
     
     def get_merge_set(self, partition, monotonically_increasing = False):
         """
@@ -338,6 +342,8 @@ class FaceSubModularExplanation(object):
         
         indexes = np.arange(len(partition))
         
+        self.composer = build_composer(partition, org_img = self.org_img)
+        
         self.calculate_distance_of_each_element(partition)
         
         self.smdl_score_best = 0
@@ -353,11 +359,29 @@ class FaceSubModularExplanation(object):
             
         return Subset
     
+    def search_partition(self, partition):
+        """
+        Greedy selection inside one partition
+        """
+        return self.get_merge_set(partition)
+    
+    def partition_greedy(self, V_partition):
+        """
+        Selected indexes of every partition, searched concurrently by the
+        partition pool workers if any
+        """
+        if self.partition_pool is not None:
+            return self.partition_pool.map(self, V_partition)
+        return [self.search_partition(partition) for partition in V_partition]
+    
     def __call__(self, image_set, target_label=None):
         """
         Compute Source Face Submodular Score
-            @image_set: [mask_image 1, ..., mask_image m] (cv2 format)
+            @image_set: [mask_image 1, ..., mask_image m] (cv2 format), or an ElementSet
         """
+        if not isinstance(image_set, ElementSet):
+            image_set = np.array(image_set)
+        
         V_partition = self.partition_collection(image_set)  # [ [image1, image2, ...], [image1, image2, ...], ...  ]
         
         self.saved_json_file = {}
@@ -374,9 +398,9 @@ class FaceSubModularExplanation(object):
         self.saved_json_file["lambda3"] = self.lambda3
         self.saved_json_file["lambda4"] = self.lambda4
         
-        self.org_img = np.array(image_set).sum(0).astype(np.uint8)
+        self.org_img = image_set.sum(0).astype(np.uint8)
         source_image = self.convert_prepare_image(
-                np.array(image_set).sum(0).astype(np.uint8), moda = self.moda)
+                self.org_img, moda = self.moda)
         
         if self.moda == "Torch":
             self.source_feature = self.face_recognition_model(
@@ -398,14 +422,13 @@ class FaceSubModularExplanation(object):
                 self.target_label = target_label
         if self.n != 1:
             Subset_merge = []
-            for partition in V_partition:
-                Subset = self.get_merge_set(partition)  # array([17, 42, 49, ...])
+            for partition, Subset in zip(V_partition, self.partition_greedy(V_partition)):  # array([17, 42, 49, ...])
                 Subset_merge.append(np.array(partition)[Subset])
             
             Subset_merge = np.concatenate(Subset_merge) # np.shape: (60, 112, 112, 3)
         
         else:
-            Subset_merge = np.array(image_set)
+            Subset_merge = image_set
         # print(Subset_merge.shape)
         # cv2.imwrite("Subset_merge.jpg", Subset_merge.sum(0))
         Submodular_Subset = self.get_merge_set(     # array([30, 31,  1, ...])
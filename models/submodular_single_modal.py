@@ -9,7 +9,19 @@ from PIL import Image
 import torch
 import torch.nn.functional as F
 
+from itertools import groupby
+
+from .composition import build_composer
+from .element_set import ElementSet
+from .lazy_greedy import LazyGreedy
+from .score_trace import ScoreTrace
+from .subset_cache import SubsetCache, is_element_sum
+from .streaming import SelectionStep, run_search, stream_search
+
 class BlackBoxSingleModalSubModularExplanation(object):
+    # trace key of the insertion curve streamed by `explain_steps`
+    insertion_curve_key = "consistency_score"
+    
     def __init__(self, 
                  model,
                  preproccessing_function,
@@ -17,7 +29,11 @@ class BlackBoxSingleModalSubModularExplanation(object):
                  lambda1 = 20.0,    # consistency
                  lambda2 = 5.0,     # colla.
                  lambda3 = 0.01,    # confidence
-                 device = "cuda"):
+                 device = "cuda",
+                 lazy_greedy = False,
+                 lazy_batch_size = 8,
+                 lazy_tolerance = 0.0,
+                 subset_cache_memory = None):
         self.k = k
         
         self.model = model
@@ -28,6 +44,15 @@ class BlackBoxSingleModalSubModularExplanation(object):
         self.lambda3 = lambda3
         
         self.device = device
+        
+        # Lazy greedy: re-score only the top stale candidates in batches of `lazy_batch_size`
+        self.lazy_greedy = lazy_greedy
+        self.lazy_batch_size = lazy_batch_size
+        self.lazy_tolerance = lazy_tolerance
+        
+        # Predicted scores of already seen subsets are reused, LRU under `subset_cache_memory` bytes (None: off)
+        self.subset_cache_memory = subset_cache_memory
+        self.subset_cache = None
     
     def merge_image(self, sub_index_set, partition_image_set):
         """
@@ -57,54 +82,142 @@ class BlackBoxSingleModalSubModularExplanation(object):
             consistency_scores = self.predicted_scores[:, self.target_label]
         return consistency_scores
     
-    def evaluation_maximun_sample(self, 
-                                  main_set, 
-                                  candidate_set, 
-                                  partition_image_set):
+    def compose_subsets(self, sub_index_sets, reverse = False):
         """
-        Given a subset, return a best sample index
+        Preprocessed batch of the given subsets (or their complements), on device
+        """
+        sub_images = []
+        for sub_index_set in sub_index_sets:
+            sub_image = self.composer.merge(sub_index_set)
+            if reverse:
+                sub_image = self.org_img - sub_image
+            sub_images.append(self.preproccessing_function(sub_image))
+        return torch.stack(sub_images).to(self.device)
+    
+    def compose_requests(self, requests):
+        """
+        Preprocessed batch of `(sub_index_set, reverse)` requests, on device
+        """
+        batches = []
+        for reverse, group in groupby(requests, key = lambda request: request[1]):
+            batches.append(self.compose_subsets([sub_index_set for sub_index_set, _ in group], reverse = reverse))
+        return torch.cat(batches)
+    
+    def proccess_compute_subset_consistency_score(self, sub_index_sets, reverse = False):
+        """
+        Consistency score of the given subsets (or their complements),
+        subsets already scored for this image are served by the subset cache
+        """
+        requests = [(sub_index_set, reverse) for sub_index_set in sub_index_sets]
+        if self.subset_cache is None:
+            return self.proccess_compute_consistency_score(self.compose_requests(requests))
+        
+        with torch.no_grad():
+            self.predicted_scores = self.subset_cache.fetch(
+                requests, self.compose_requests, lambda batch_input_images: torch.softmax(self.model(batch_input_images), dim=-1))
+        return self.predicted_scores[:, self.target_label]
+    
+    @property
+    def score_plan(self):
+        """
+        Forward batches that contribute under the current lambdas
+        """
+        return {
+            # confidence reuses the predicted scores of the consistency forward
+            "consistency": self.lambda1 != 0 or self.lambda3 != 0,
+            "collaboration": self.lambda2 != 0,
+        }
+    
+    def score_candidates(self, main_set, candidate_set):
+        """
+        Score terms of `main_set + [candidate]` for each candidate
         """
         sub_index_sets = []
         for candidate_ in candidate_set:
             sub_index_sets.append(
                 np.concatenate((main_set, np.array([candidate_]))).astype(int))
-       
-        # merge images / 组合图像
-        sub_images = torch.stack([
-            self.preproccessing_function(
-                self.merge_image(sub_index_set, partition_image_set)
-            ) for sub_index_set in sub_index_sets])
         
-        batch_input_images = sub_images.to(self.device)
+        score_plan = self.score_plan
+        zeros = torch.zeros(len(candidate_set), device=self.device)
         
         with torch.no_grad():
-            # 1. Consistency Score
-            score_consistency = self.proccess_compute_consistency_score(batch_input_images)
-            
-            # 3. Confidence Score
-            score_confidence = self.proccess_compute_confidence_score()
+            # Forwards of disabled terms are skipped, their scores are zeros
+            score_consistency = zeros
+            score_confidence = zeros
+            if score_plan["consistency"]:
+                # 1. Consistency Score
+                # merge images / 组合图像
+                score_consistency = self.proccess_compute_subset_consistency_score(sub_index_sets)
+                
+                # 3. Confidence Score
+                score_confidence = self.proccess_compute_confidence_score()
             
             # 2. Collaboration Score
-            sub_images_reverse = torch.stack([
-                self.preproccessing_function(
-                    self.org_img - self.merge_image(sub_index_set, partition_image_set)
-                ) for sub_index_set in sub_index_sets])
-        
-            batch_input_images_reverse = sub_images_reverse.to(self.device)
-            
-            score_collaboration = 1 - self.proccess_compute_consistency_score(batch_input_images_reverse)
+            score_collaboration = zeros
+            if score_plan["collaboration"]:
+                score_collaboration = 1 - self.proccess_compute_subset_consistency_score(sub_index_sets, reverse = True)
             
             # submodular score
             smdl_score = self.lambda1 * score_consistency + self.lambda2 * score_collaboration +  self.lambda3 * score_confidence
-            arg_max_index = smdl_score.argmax().cpu().item()
-            
-            # if self.lambda1 != 0:
-            self.saved_json_file["confidence_score"].append(score_confidence[arg_max_index].cpu().item())
-            self.saved_json_file["consistency_score"].append(score_consistency[arg_max_index].cpu().item())
-            self.saved_json_file["collaboration_score"].append(score_collaboration[arg_max_index].cpu().item())
-            self.saved_json_file["smdl_score"].append(smdl_score[arg_max_index].cpu().item())
         
-        return sub_index_sets[arg_max_index]
+        return {
+            "confidence_score": score_confidence,
+            "consistency_score": score_consistency,
+            "collaboration_score": score_collaboration,
+            "smdl_score": smdl_score,
+        }
+    
+    def selected_scores(self, sub_index_set, scores):
+        """
+        The score terms of one selected subset, with the terms skipped by the
+        score plan filled in. The saved insertion / deletion curves are built
+        from them, so they are forwarded for the selected subset only.
+        """
+        score_plan = self.score_plan
+        scores = dict(scores)
+        with torch.no_grad():
+            if not score_plan["consistency"]:
+                scores["consistency_score"] = self.proccess_compute_subset_consistency_score([sub_index_set])[0]
+                scores["confidence_score"] = self.proccess_compute_confidence_score()[0]
+            if not score_plan["collaboration"]:
+                scores["collaboration_score"] = 1 - self.proccess_compute_subset_consistency_score([sub_index_set], reverse = True)[0]
+        return scores
+    
+    def evaluation_maximun_sample(self, 
+                                  main_set, 
+                                  candidate_set, 
+                                  partition_image_set):
+        """
+        Given a subset, return a best sample index
+        """
+        scores = self.score_candidates(main_set, candidate_set)
+        # only the selected index crosses to the host / 只有索引回到主机
+        arg_max_index = scores["smdl_score"].argmax().item()
+        sub_index_set = np.concatenate((main_set, np.array([candidate_set[arg_max_index]]))).astype(int)
+        
+        scores = {key: value[arg_max_index] for key, value in scores.items()}
+        for key, value in self.selected_scores(sub_index_set, scores).items():
+            self.trace.append(key, value)
+        
+        return sub_index_set
+    
+    def evaluation_lazy_sample(self, 
+                               main_set, 
+                               candidate_set):
+        """
+        Lazy greedy version of `evaluation_maximun_sample`, only re-scores the top stale candidates
+        """
+        def evaluate(candidates):
+            scores = self.score_candidates(main_set, candidates)
+            return {key: value.cpu().numpy() for key, value in scores.items()}
+        
+        candidate_, scores = self.lazy_greedy_selector.select(candidate_set, evaluate)
+        sub_index_set = np.concatenate((main_set, np.array([candidate_]))).astype(int)
+        
+        for key, value in self.selected_scores(sub_index_set, scores).items():
+            self.trace.append(key, float(value))
+        
+        return sub_index_set
     
     def save_file_init(self):
         self.saved_json_file = {}
@@ -116,43 +229,105 @@ class BlackBoxSingleModalSubModularExplanation(object):
         self.saved_json_file["lambda1"] = self.lambda1
         self.saved_json_file["lambda2"] = self.lambda2
         self.saved_json_file["lambda3"] = self.lambda3
+        self.trace_init()
+    
+    def trace_init(self):
+        """
+        The score lists of `saved_json_file` are recorded on the device / 分数记录在设备上
+        """
+        self.trace = ScoreTrace(
+            [key for key, value in self.saved_json_file.items() if isinstance(value, list)],
+            capacity = self.k,
+            device = self.device)
+    
+    def trace_flush(self):
+        """
+        Move the recorded scores into `saved_json_file`, one host transfer
+        """
+        self.saved_json_file.update(self.trace.to_dict())
+    
+    def subset_cache_init(self, partition):
+        """
+        Fresh subset cache for a new element set, keys are only valid within one image
+        """
+        self.subset_cache = None
+        if self.subset_cache_memory:
+            self.subset_cache = SubsetCache(
+                len(partition), memory_budget = self.subset_cache_memory,
+                complement_alias = is_element_sum(self.org_img, partition))
+    
+    def subset_cache_record(self):
+        if self.subset_cache is not None:
+            self.saved_json_file["subset_cache_hits"] = self.subset_cache.hits
+            self.saved_json_file["subset_cache_misses"] = self.subset_cache.misses
 
+    def run_steps(self, steps):
+        """
+        Drive a search generator, its greedy step events are skipped
+        """
+        return run_search(steps)
+    
     def get_merge_set(self, partition):
         """
         """
+        return self.run_steps(self.get_merge_set_steps(partition))
+    
+    def get_merge_set_steps(self, partition):
+        """
+        Generator version of `get_merge_set`, yields a SelectionStep after each greedy step
+        """
         Subset = np.array([])
         
         indexes = np.arange(len(partition))
         
-        # First calculate the similarity of each element to facilitate calculation of effectiveness score.
-        self.calculate_distance_of_each_element(partition)
+        self.composer = build_composer(partition, org_img = self.org_img)
+        self.subset_cache_init(partition)
         
         self.smdl_score_best = 0
         
+        if self.lazy_greedy:
+            self.lazy_greedy_selector = LazyGreedy(
+                batch_size = self.lazy_batch_size, 
+                tolerance = self.lazy_tolerance, 
+                forward_passes_per_candidate = sum(self.score_plan.values()))
+        
         for j in tqdm(range(self.k)):
             diff = np.setdiff1d(indexes, np.array(Subset))  # in indexes but not in Subset
             
             sub_candidate_indexes = diff
             
-            Subset = self.evaluation_maximun_sample(Subset, sub_candidate_indexes, partition)
+            if self.lazy_greedy:
+                Subset = self.evaluation_lazy_sample(Subset, sub_candidate_indexes)
+            else:
+                Subset = self.evaluation_maximun_sample(Subset, sub_candidate_indexes, partition)
+            
+            yield SelectionStep(Subset)
+        
+        if self.lazy_greedy:
+            self.saved_json_file["forward_passes"] = self.lazy_greedy_selector.forward_passes
+            self.saved_json_file["forward_passes_saved"] = self.lazy_greedy_selector.forward_passes_saved
+        self.subset_cache_record()
+        self.trace_flush()
         
         return Subset
     
-    def __call__(self, image_set, id = None):
+    def prepare_explanation(self, image_set, id = None):
         """
-        Compute Source Face Submodular Score
-            @image_set: [mask_image 1, ..., mask_image m] (cv2 format)
+        Reset the per-image state, return the element set
         """
+        if not isinstance(image_set, ElementSet):
+            image_set = np.array(image_set)
+        
         self.save_file_init()
         
-        self.org_img = np.array(image_set).sum(0).astype(np.uint8)      
-        source_image = self.preproccessing_function(self.org_img)
-
+        self.org_img = image_set.sum(0).astype(np.uint8)      
         self.target_label = id
-        
-        Subset_merge = np.array(image_set)
-        Submodular_Subset = self.get_merge_set(Subset_merge)  # array([17, 42, 49, ...])
-            
+        return image_set
+    
+    def finish_explanation(self, Subset_merge, Submodular_Subset):
+        """
+        Build the outputs from the selected order
+        """
         submodular_image_set = Subset_merge[Submodular_Subset]  # sub_k x (112, 112, 3)
         
         submodular_image = submodular_image_set.sum(0).astype(np.uint8)
@@ -160,8 +335,37 @@ class BlackBoxSingleModalSubModularExplanation(object):
         self.saved_json_file["smdl_score_max_index"] = self.saved_json_file["smdl_score"].index(self.saved_json_file["smdl_score_max"])
         
         return submodular_image, submodular_image_set, self.saved_json_file
+    
+    def __call__(self, image_set, id = None):
+        """
+        Compute Source Face Submodular Score
+            @image_set: [mask_image 1, ..., mask_image m] (cv2 format), or an ElementSet
+        """
+        Subset_merge = self.prepare_explanation(image_set, id)
+        
+        Submodular_Subset = self.get_merge_set(Subset_merge)  # array([17, 42, 49, ...])
+        
+        return self.finish_explanation(Subset_merge, Submodular_Subset)
+    
+    def explain_steps(self, image_set, id = None):
+        """
+        Generator version of `__call__`: yields a dict per greedy step as soon
+        as it is done (selected index, score breakdown, running insertion
+        curve, see `stream_search`) and returns the `__call__` outputs.
+        Stop iterating to end the search early.
+        """
+        Subset_merge = self.prepare_explanation(image_set, id)
+        
+        Submodular_Subset = yield from stream_search(
+            self.get_merge_set_steps(Subset_merge), self.trace,
+            curve_key = self.insertion_curve_key)
+        
+        return self.finish_explanation(Subset_merge, Submodular_Subset)
 
 class BlackBoxSingleModalSubModularExplanationEfficient(BlackBoxSingleModalSubModularExplanation):
+    # trace key of the insertion curve streamed by `explain_steps`
+    insertion_curve_key = "consistency_score_increase"
+    
     def __init__(self, 
                  model,
                  preproccessing_function,
@@ -170,7 +374,8 @@ class BlackBoxSingleModalSubModularExplanationEfficient(BlackBoxSingleModalSubMo
                  lambda2 = 5.0,     # colla.
                  lambda3 = 0.01,    # confidence
                  device = "cuda",
-                 pending_samples = 8):
+                 pending_samples = 8,
+                 subset_cache_memory = None):
         super(BlackBoxSingleModalSubModularExplanationEfficient, self).__init__(
             k = k,
             model = model,
@@ -178,7 +383,8 @@ class BlackBoxSingleModalSubModularExplanationEfficient(BlackBoxSingleModalSubMo
             lambda1 = lambda1,
             lambda2 = lambda2,
             lambda3 = lambda3,
-            device = device)
+            device = device,
+            subset_cache_memory = subset_cache_memory)
         
         # Parameters of the submodular
         self.pending_samples = pending_samples
@@ -202,38 +408,25 @@ class BlackBoxSingleModalSubModularExplanationEfficient(BlackBoxSingleModalSubMo
             sub_index_sets_decrease.append(
                 np.concatenate((decrease_set, np.array([candidate_]))).astype(int))
 
-        # merge images / 组合图像
-        sub_images = torch.stack([
-            self.preproccessing_function(
-                self.merge_image(sub_index_set, partition_image_set)
-            ) for sub_index_set in sub_index_sets])
-        
-        batch_input_images = sub_images.to(self.device)
         with torch.no_grad():
-            # 1. Consistency Score
-            score_consistency = self.proccess_compute_consistency_score(batch_input_images)
-            
-            # 3. Confidence Score
-            score_confidence = self.proccess_compute_confidence_score()
-            
-            # 2. Collaboration Score
-            sub_images_reverse = torch.stack([
-                self.preproccessing_function(
-                    self.org_img - self.merge_image(sub_index_set, partition_image_set)
-                ) for sub_index_set in sub_index_sets])
-        
-            batch_input_images_reverse = sub_images_reverse.to(self.device)
-            
-            score_collaboration = 1 - self.proccess_compute_consistency_score(batch_input_images_reverse)
+            # 1. Consistency Score, 2. Collaboration Score and 3. Confidence Score
+            scores = self.score_candidates(main_set, candidate_set)
+            score_consistency = scores["consistency_score"]
+            score_collaboration = scores["collaboration_score"]
+            score_confidence = scores["confidence_score"]
             
             # submodular score
-            smdl_score = self.lambda1 * score_consistency + self.lambda2 * score_collaboration +  self.lambda3 * score_confidence
-            arg_max_index = smdl_score.argmax().cpu().item()
+            smdl_score = scores["smdl_score"]
+            arg_max_index = smdl_score.argmax().item()
+            
+            # terms skipped by the score plan are forwarded for the selected subset only
+            selected = self.selected_scores(sub_index_sets[arg_max_index], {
+                key: value[arg_max_index] for key, value in scores.items()})
             
-            self.saved_json_file["confidence_score_increase"].append(score_confidence[arg_max_index].cpu().item())
-            self.saved_json_file["consistency_score_increase"].append(score_consistency[arg_max_index].cpu().item())
-            self.saved_json_file["collaboration_score_increase"].append(score_collaboration[arg_max_index].cpu().item())
-            self.saved_json_file["smdl_score"].append(smdl_score[arg_max_index].cpu().item())
+            self.trace.append("confidence_score_increase", selected["confidence_score"])
+            self.trace.append("consistency_score_increase", selected["consistency_score"])
+            self.trace.append("collaboration_score_increase", selected["collaboration_score"])
+            self.trace.append("smdl_score", smdl_score[arg_max_index])
 
             if len(candidate_set) > self.pending_samples:
                 smdl_score_decrease = smdl_score
@@ -248,35 +441,25 @@ class BlackBoxSingleModalSubModularExplanationEfficient(BlackBoxSingleModalSubMo
                 
                 sub_index_negtive_sets = np.array(sub_index_sets_decrease)[negtive_sampels_indexes]
                 
-                # merge images / 组合图像
-                sub_images_decrease = torch.stack([
-                    self.preproccessing_function(
-                        self.merge_image(sub_index_set, partition_image_set)
-                    ) for sub_index_set in sub_index_negtive_sets])
-                
-                sub_images_decrease_reverse = torch.stack([
-                    self.preproccessing_function(
-                        self.org_img - self.merge_image(sub_index_set, partition_image_set)
-                    ) for sub_index_set in sub_index_negtive_sets])
-                
                 # 1. Consistency Score
-                score_consistency_decrease = self.proccess_compute_consistency_score(sub_images_decrease.to(self.device))
+                # merge images / 组合图像
+                score_consistency_decrease = self.proccess_compute_subset_consistency_score(sub_index_negtive_sets)
                 
                 # 3. Confidence Score
                 score_confidence_decrease = self.proccess_compute_confidence_score()
                 
                 # 2. Collaboration Score
-                score_collaboration_decrease = 1 - self.proccess_compute_consistency_score(sub_images_decrease_reverse.to(self.device))
+                score_collaboration_decrease = 1 - self.proccess_compute_subset_consistency_score(sub_index_negtive_sets, reverse = True)
                 
                 smdl_score_decrease = self.lambda1 * score_consistency_decrease + self.lambda2 * score_collaboration_decrease + self.lambda3 * score_confidence_decrease
                 
-                arg_min_index = smdl_score_decrease.argmin().cpu().item()
+                arg_min_index = smdl_score_decrease.argmin().item()
                 
                 decrease_set = sub_index_negtive_sets[arg_min_index]
 
-                self.saved_json_file["confidence_score_decrease"].append(score_confidence_decrease[arg_min_index].cpu().item())
-                self.saved_json_file["consistency_score_decrease"].append(1-score_collaboration_decrease[arg_min_index].cpu().item())
-                self.saved_json_file["collaboration_score_decrease"].append(1-score_consistency_decrease[arg_min_index].cpu().item())
+                self.trace.append("confidence_score_decrease", score_confidence_decrease[arg_min_index])
+                self.trace.append("consistency_score_decrease", 1 - score_collaboration_decrease[arg_min_index])
+                self.trace.append("collaboration_score_decrease", 1 - score_consistency_decrease[arg_min_index])
 
         return sub_index_sets[arg_max_index], decrease_set
     
@@ -300,70 +483,110 @@ class BlackBoxSingleModalSubModularExplanationEfficient(BlackBoxSingleModalSubMo
         self.saved_json_file["lambda1"] = self.lambda1
         self.saved_json_file["lambda2"] = self.lambda2
         self.saved_json_file["lambda3"] = self.lambda3
+        self.trace_init()
     
-    def get_merge_set(self, partition):
+    def sample_candidates(self, candidate_set):
         """
+        Candidates scored at this step, all of them for the full greedy
+        """
+        return candidate_set
+    
+    def get_merge_set_steps(self, partition):
+        """
+        Generator version of `get_merge_set`, yields a SelectionStep after each greedy step
         """
         Subset = np.array([])
         Subset_decrease = np.array([])
         
         indexes = np.arange(len(partition))
         
+        self.composer = build_composer(partition, org_img = self.org_img)
+        self.subset_cache_init(partition)
+        
         self.smdl_score_best = 0
         
         loop_times = int((self.k-self.pending_samples)/2) + self.pending_samples
         for j in tqdm(range(loop_times)):
             diff = np.setdiff1d(indexes, np.concatenate((Subset, Subset_decrease)))  # in indexes but not in Subset
             
-            sub_candidate_indexes = diff
+            sub_candidate_indexes = self.sample_candidates(diff)
             if len(diff) == 1:
                 Subset = np.concatenate((Subset, np.array(diff)))
                 break
             
             Subset, Subset_decrease = self.evaluation_maximun_sample(Subset, Subset_decrease, sub_candidate_indexes, partition)
+            
+            yield SelectionStep(Subset, Subset_decrease)
+        
+        # the full and the empty image / 原图和空图
+        scores = self.proccess_compute_subset_consistency_score([indexes, []])
         
-        sub_images = torch.stack([
-            self.preproccessing_function(
-                self.org_img
-            ),
-            self.preproccessing_function(
-                self.org_img - self.org_img
-            ),
-        ])
-        scores = self.proccess_compute_consistency_score(sub_images.to(self.device))
+        # the trace reaches the host once, here / 分数一次性传回主机
+        self.trace_flush()
+        scores = scores.cpu().tolist()
         
-        self.saved_json_file["org_score"] = scores[0].cpu().item()
-        self.saved_json_file["baseline_score"] = scores[1].cpu().item()
+        self.saved_json_file["org_score"] = scores[0]
+        self.saved_json_file["baseline_score"] = scores[1]
         
-        self.saved_json_file["consistency_score"] = self.saved_json_file["consistency_score_increase"] + self.saved_json_file["consistency_score_decrease"][::-1] + [scores[0].cpu().item()]
-        self.saved_json_file["collaboration_score"] = self.saved_json_file["collaboration_score_increase"] + self.saved_json_file["collaboration_score_decrease"][::-1] + [1-scores[1].cpu().item()]
+        self.saved_json_file["consistency_score"] = self.saved_json_file["consistency_score_increase"] + self.saved_json_file["consistency_score_decrease"][::-1] + [scores[0]]
+        self.saved_json_file["collaboration_score"] = self.saved_json_file["collaboration_score_increase"] + self.saved_json_file["collaboration_score_decrease"][::-1] + [1-scores[1]]
         
         Subset = np.concatenate((Subset, Subset_decrease[::-1]))
         
+        self.subset_cache_record()
+        
         return Subset.astype(int)
+
+class BlackBoxSingleModalSubModularExplanationStochasticGreedy(BlackBoxSingleModalSubModularExplanationEfficient):
+    """
+    Stochastic greedy: each step scores a random sample of size
+    (N/k)·log(1/epsilon) of the remaining candidates instead of all of them.
+    """
+    def __init__(self, 
+                 model,
+                 preproccessing_function,
+                 k = 40,
+                 lambda1 = 20.0,    # consistency
+                 lambda2 = 5.0,     # colla.
+                 lambda3 = 0.01,    # confidence
+                 device = "cuda",
+                 pending_samples = 8,
+                 subset_cache_memory = None,
+                 epsilon = 0.01,
+                 seed = 0):
+        super(BlackBoxSingleModalSubModularExplanationStochasticGreedy, self).__init__(
+            k = k,
+            model = model,
+            preproccessing_function = preproccessing_function,
+            lambda1 = lambda1,
+            lambda2 = lambda2,
+            lambda3 = lambda3,
+            device = device,
+            pending_samples = pending_samples,
+            subset_cache_memory = subset_cache_memory)
+        
+        self.epsilon = epsilon
+        self.seed = seed
     
-    def __call__(self, image_set, id = None):
+    def sample_candidates(self, candidate_set):
         """
-        Compute Source Face Submodular Score
-            @image_set: [mask_image 1, ..., mask_image m] (cv2 format)
+        Random sample of the remaining candidates
         """
-        # V_partition = self.partition_collection(image_set)  # [ [image1, image2, ...], [image1, image2, ...], ...  ]
+        if len(candidate_set) <= self.sample_size:
+            return candidate_set
+        return np.sort(self.random_state.choice(candidate_set, self.sample_size, replace=False))
     
-        self.save_file_init()
-        
-        self.org_img = np.array(image_set).sum(0).astype(np.uint8)      
-        source_image = self.preproccessing_function(self.org_img)
-
-        self.target_label = id
-        
-        Subset_merge = np.array(image_set)
-        Submodular_Subset = self.get_merge_set(Subset_merge)  # array([17, 42, 49, ...])
-            
-        submodular_image_set = Subset_merge[Submodular_Subset]  # sub_k x (112, 112, 3)
+    def get_merge_set_steps(self, partition):
+        """
+        """
+        # keep enough candidates for the pending (decrease) samples
+        self.sample_size = max(
+            int(math.ceil(len(partition) / self.k * math.log(1 / self.epsilon))),
+            self.pending_samples + 1)
+        # same seed for every image, so results are reproducible
+        self.random_state = np.random.RandomState(self.seed)
         
+        Subset = yield from super(BlackBoxSingleModalSubModularExplanationStochasticGreedy, self).get_merge_set_steps(partition)
         
-        submodular_image = submodular_image_set.sum(0).astype(np.uint8)
-        self.saved_json_file["smdl_score_max"] = max(self.saved_json_file["smdl_score"])
-        self.saved_json_file["smdl_score_max_index"] = self.saved_json_file["smdl_score"].index(self.saved_json_file["smdl_score_max"])
-
-        return submodular_image, submodular_image_set, self.saved_json_file
\ No newline at end of file
+        self.saved_json_file["stochastic_sample_size"] = self.sample_size
+        return Subset
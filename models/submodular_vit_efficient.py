@@ -1,3 +1,4 @@
+import copy
 import math
 import random
 import numpy as np
@@ -10,8 +11,15 @@ import torch
 import torch.nn.functional as F
 
 from .submodular_vit_torch import MultiModalSubModularExplanation
+from .composition import build_composer, LinearComposer
+from .element_set import ElementSet
+from .streaming import SelectionStep, skip_selection_steps
+from .pipeline import concat_batches
 
 class MultiModalSubModularExplanationEfficientV1(MultiModalSubModularExplanation):
+    # trace key of the insertion curve streamed by `explain_steps`
+    insertion_curve_key = "consistency_score_increase"
+    
     def __init__(self, 
                  model,
                  semantic_feature,
@@ -21,7 +29,20 @@ class MultiModalSubModularExplanationEfficientV1(MultiModalSubModularExplanation
                  lambda2 = 1.0,
                  lambda3 = 1.0,
                  lambda4 = 1.0,
-                 device = "cuda"):
+                 device = "cuda",
+                 linear_composition = False,
+                 forward_batch_size = None,
+                 forward_memory_budget = None,
+                 subset_cache_memory = None,
+                 feature_cache = None,
+                 early_stop_epsilon = None,
+                 early_stop_min_gain = None,
+                 early_stop_patience = 3,
+                 n = 1,
+                 partition_k = None,
+                 partition_pool = None,
+                 pipeline_workers = 0,
+                 pipeline_chunk_size = 16):
         super(MultiModalSubModularExplanationEfficientV1, self).__init__(
             k = k,
             model = model,
@@ -33,7 +54,20 @@ class MultiModalSubModularExplanationEfficientV1(MultiModalSubModularExplanation
             lambda3 = lambda3,
             lambda4 = lambda4,
             
-            device = device)
+            device = device,
+            linear_composition = linear_composition,
+            forward_batch_size = forward_batch_size,
+            forward_memory_budget = forward_memory_budget,
+            subset_cache_memory = subset_cache_memory,
+            feature_cache = feature_cache,
+            early_stop_epsilon = early_stop_epsilon,
+            early_stop_min_gain = early_stop_min_gain,
+            early_stop_patience = early_stop_patience,
+            n = n,
+            partition_k = partition_k,
+            partition_pool = partition_pool,
+            pipeline_workers = pipeline_workers,
+            pipeline_chunk_size = pipeline_chunk_size)
         
         # Parameters of the submodular
         
@@ -56,31 +90,14 @@ class MultiModalSubModularExplanationEfficientV1(MultiModalSubModularExplanation
             sub_index_sets_decrease.append(
                 np.concatenate((decrease_set, np.array([candidate_]))).astype(int))
 
-        # merge images / 组合图像
-        sub_images = torch.stack([
-            self.preproccessing_function(
-                self.merge_image(sub_index_set, partition_image_set)
-            ) for sub_index_set in sub_index_sets])
-        
-        batch_input_images = sub_images.to(self.device)
-        
         with torch.no_grad():
             # 2. Effectiveness Score
             score_effectiveness = self.proccess_compute_effectiveness_score(sub_index_sets)
             score_effectiveness_decrease = self.proccess_compute_effectiveness_score(sub_index_sets_decrease)
             
-            # 3. Consistency Score
-            score_consistency = self.proccess_compute_consistency_score(batch_input_images)
-            
-            # 4. Collaboration Score
-            sub_images_reverse = torch.stack([
-                self.preproccessing_function(
-                    self.org_img - self.merge_image(sub_index_set, partition_image_set)
-                ) for sub_index_set in sub_index_sets])
-        
-            batch_input_images_reverse = sub_images_reverse.to(self.device)
-            
-            score_collaboration = 1 - self.proccess_compute_consistency_score(batch_input_images_reverse)
+            # 3. Consistency Score and 4. Collaboration Score
+            # merge images / 组合图像
+            score_consistency, score_collaboration, _ = self.proccess_compute_forward_scores(sub_index_sets)
             
             # 1. Confidence Score
             # score_confidence = self.proccess_compute_confidence_score()
@@ -89,30 +106,33 @@ class MultiModalSubModularExplanationEfficientV1(MultiModalSubModularExplanation
             # smdl_score = self.lambda1 * score_confidence + self.lambda2 * score_effectiveness +  self.lambda3 * score_consistency + self.lambda4 * score_collaboration
             smdl_score = self.lambda2 * score_effectiveness + self.lambda3 * score_consistency + self.lambda4 * score_collaboration
             smdl_score_decrease = self.lambda2 * score_effectiveness_decrease + self.lambda3 * score_consistency + self.lambda4 * score_collaboration
-            arg_max_index = smdl_score.argmax().cpu().item()
-            arg_min_index = smdl_score_decrease.argmin().cpu().item()
+            if len(main_set) == 0:
+                self.early_stopping_singletons(candidate_set, smdl_score)
+            arg_max_index = smdl_score.argmax().item()
+            arg_min_index = smdl_score_decrease.argmin().item()
             
             if len(candidate_set) != 1:
-                sub_images_decrease = torch.stack([
-                    self.preproccessing_function(
-                        self.org_img - self.merge_image(sub_index_sets_decrease[arg_min_index], partition_image_set)
-                    ),
-                    self.preproccessing_function(
-                        self.merge_image(sub_index_sets_decrease[arg_min_index], partition_image_set)
-                    ),
-                ])
-                scores_decrease = self.proccess_compute_consistency_score(sub_images_decrease.to(self.device))
+                scores_decrease = self.run_steps(self.predicted_scores_steps([
+                    (sub_index_sets_decrease[arg_min_index], True),
+                    (sub_index_sets_decrease[arg_min_index], False),
+                ]))[:, self.target_label]
+            
+            # terms skipped by the score plan are forwarded for the selected subset only
+            selected = self.run_steps(self.selected_scores_steps(sub_index_sets[arg_max_index], {
+                "consistency_score": score_consistency[arg_max_index],
+                "collaboration_score": score_collaboration[arg_max_index],
+            }))
             
             # if self.lambda1 != 0:
             #     self.saved_json_file["confidence_score"].append(score_confidence[arg_max_index].cpu().item())
-            self.saved_json_file["effectiveness_score_increase"].append(score_effectiveness[arg_max_index].cpu().item())
-            self.saved_json_file["consistency_score_increase"].append(score_consistency[arg_max_index].cpu().item())
-            self.saved_json_file["collaboration_score_increase"].append(score_collaboration[arg_max_index].cpu().item())
-            self.saved_json_file["smdl_score"].append(smdl_score[arg_max_index].cpu().item())
+            self.trace.append("effectiveness_score_increase", score_effectiveness[arg_max_index])
+            self.trace.append("consistency_score_increase", selected["consistency_score"])
+            self.trace.append("collaboration_score_increase", selected["collaboration_score"])
+            self.trace.append("smdl_score", smdl_score[arg_max_index])
             
             if len(candidate_set) != 1:
-                self.saved_json_file["consistency_score_decrease"].append(scores_decrease[0].cpu().item())
-                self.saved_json_file["collaboration_score_decrease"].append(1-scores_decrease[1].cpu().item())
+                self.trace.append("consistency_score_decrease", scores_decrease[0])
+                self.trace.append("collaboration_score_decrease", 1 - scores_decrease[1])
         
                 return sub_index_sets[arg_max_index], sub_index_sets_decrease[arg_min_index]
             
@@ -143,15 +163,24 @@ class MultiModalSubModularExplanationEfficientV1(MultiModalSubModularExplanation
         self.saved_json_file["lambda2"] = self.lambda2
         self.saved_json_file["lambda3"] = self.lambda3
         self.saved_json_file["lambda4"] = self.lambda4
+        self.trace_init()
     
-    def get_merge_set(self, partition):
+    def get_merge_set_steps(self, partition):
         """
+        Generator version of `get_merge_set`, yields a SelectionStep after each greedy step
         """
         Subset = np.array([])
         Subset_decrease = np.array([])
         
         indexes = np.arange(len(partition))
         
+        self.composer = build_composer(partition, org_img = self.org_img)
+        if self.linear_composition:
+            self.linear_composer = LinearComposer(partition, self.preproccessing_function, device = self.device)
+        
+        self.subset_cache_init(partition)
+        self.early_stopping_init(partition)
+        
         # First calculate the similarity of each element to facilitate calculation of effectiveness score.
         self.calculate_distance_of_each_element(partition)
         
@@ -166,54 +195,48 @@ class MultiModalSubModularExplanationEfficientV1(MultiModalSubModularExplanation
                 break
             
             Subset, Subset_decrease = self.evaluation_maximun_sample(Subset, Subset_decrease, sub_candidate_indexes, partition)
+            
+            yield SelectionStep(Subset, Subset_decrease)
+            
+            if self.early_stopping_update(j):
+                # the rest is ordered by the singleton scores / 其余按单元素分数排序
+                diff = np.setdiff1d(indexes, np.concatenate((Subset, Subset_decrease)))
+                stop = len(Subset)
+                Subset = np.concatenate((Subset, self.early_stopping_tail(diff, self.k - len(Subset) - len(Subset_decrease))))
+                scores = self.run_steps(self.prefix_scores_steps(Subset.astype(int), start = stop))
+                # this engine leaves confidence out of the objective / 该引擎的目标不含置信度
+                scores["smdl_score"] = self.lambda2 * scores["effectiveness_score"] + self.lambda3 * scores["consistency_score"] + self.lambda4 * scores["collaboration_score"]
+                self.early_stopping_trace(scores, {
+                    "effectiveness_score": "effectiveness_score_increase",
+                    "consistency_score": "consistency_score_increase",
+                    "collaboration_score": "collaboration_score_increase",
+                    "smdl_score": "smdl_score"})
+                break
         
-        sub_images = torch.stack([
-            self.preproccessing_function(
-                self.org_img
-            ),
-            self.preproccessing_function(
-                self.org_img - self.org_img
-            ),
-        ])
-        scores = self.proccess_compute_consistency_score(sub_images.to(self.device))
+        # the full and the empty image / 原图和空图
+        if self.baseline_features is not None:
+            scores = self.compute_predicted_scores_from_features(self.baseline_features)[:, self.target_label]
+        else:
+            scores = self.compute_predicted_scores(self.baseline_batch())[:, self.target_label]
         
+        # the trace reaches the host once, here / 分数一次性传回主机
+        self.trace_flush()
+        scores = scores.cpu().tolist()
         
-        self.saved_json_file["consistency_score"] = self.saved_json_file["consistency_score_increase"] + self.saved_json_file["consistency_score_decrease"][:-1][::-1] + [scores[0].cpu().item()]
-        self.saved_json_file["collaboration_score"] = self.saved_json_file["collaboration_score_increase"] + self.saved_json_file["collaboration_score_decrease"][:-1][::-1] + [scores[1].cpu().item()]
+        self.saved_json_file["consistency_score"] = self.saved_json_file["consistency_score_increase"] + self.saved_json_file["consistency_score_decrease"][:-1][::-1] + [scores[0]]
+        self.saved_json_file["collaboration_score"] = self.saved_json_file["collaboration_score_increase"] + self.saved_json_file["collaboration_score_decrease"][:-1][::-1] + [scores[1]]
         
         Subset = np.concatenate((Subset, Subset_decrease[::-1]))
         
-        return Subset.astype(int)
-    
-    def __call__(self, image_set, id = None):
-        """
-        Compute Source Face Submodular Score
-            @image_set: [mask_image 1, ..., mask_image m] (cv2 format)
-        """
-        # V_partition = self.partition_collection(image_set)  # [ [image1, image2, ...], [image1, image2, ...], ...  ]
-    
-        self.save_file_init()
-        
-        self.org_img = np.array(image_set).sum(0).astype(np.uint8)      
-        source_image = self.preproccessing_function(self.org_img)
-
-        self.source_feature = self.model(source_image.unsqueeze(0).to(self.device))
-        self.target_label = id
-        
-        Subset_merge = np.array(image_set)
-        Submodular_Subset = self.get_merge_set(Subset_merge)  # array([17, 42, 49, ...])
-            
-        submodular_image_set = Subset_merge[Submodular_Subset]  # sub_k x (112, 112, 3)
-        
+        self.subset_cache_record()
         
-        submodular_image = submodular_image_set.sum(0).astype(np.uint8)
-        self.saved_json_file["smdl_score_max"] = max(self.saved_json_file["smdl_score"])
-        self.saved_json_file["smdl_score_max_index"] = self.saved_json_file["smdl_score"].index(self.saved_json_file["smdl_score_max"])
-        
-        return submodular_image, submodular_image_set, self.saved_json_file
+        return Subset.astype(int)
     
 
 class MultiModalSubModularExplanationEfficientV2(MultiModalSubModularExplanation):
+    # trace key of the insertion curve streamed by `explain_steps`
+    insertion_curve_key = "consistency_score_increase"
+    
     def __init__(self, 
                  model,
                  semantic_feature,
@@ -224,7 +247,20 @@ class MultiModalSubModularExplanationEfficientV2(MultiModalSubModularExplanation
                  lambda3 = 1.0,
                  lambda4 = 1.0,
                  device = "cuda",
-                 pending_samples = 8):
+                 pending_samples = 8,
+                 linear_composition = False,
+                 forward_batch_size = None,
+                 forward_memory_budget = None,
+                 subset_cache_memory = None,
+                 feature_cache = None,
+                 early_stop_epsilon = None,
+                 early_stop_min_gain = None,
+                 early_stop_patience = 3,
+                 n = 1,
+                 partition_k = None,
+                 partition_pool = None,
+                 pipeline_workers = 0,
+                 pipeline_chunk_size = 16):
         super(MultiModalSubModularExplanationEfficientV2, self).__init__(
             k = k,
             model = model,
@@ -236,7 +272,20 @@ class MultiModalSubModularExplanationEfficientV2(MultiModalSubModularExplanation
             lambda3 = lambda3,
             lambda4 = lambda4,
             
-            device = device)
+            device = device,
+            linear_composition = linear_composition,
+            forward_batch_size = forward_batch_size,
+            forward_memory_budget = forward_memory_budget,
+            subset_cache_memory = subset_cache_memory,
+            feature_cache = feature_cache,
+            early_stop_epsilon = early_stop_epsilon,
+            early_stop_min_gain = early_stop_min_gain,
+            early_stop_patience = early_stop_patience,
+            n = n,
+            partition_k = partition_k,
+            partition_pool = partition_pool,
+            pipeline_workers = pipeline_workers,
+            pipeline_chunk_size = pipeline_chunk_size)
         
         # Parameters of the submodular
         self.pending_samples = pending_samples
@@ -249,6 +298,16 @@ class MultiModalSubModularExplanationEfficientV2(MultiModalSubModularExplanation
         """
         Given a subset, return a best sample index
         """
+        return self.run_steps(
+            self.evaluation_maximun_sample_steps(main_set, decrease_set, candidate_set))
+    
+    def evaluation_maximun_sample_steps(self, 
+                                        main_set, 
+                                        decrease_set,
+                                        candidate_set):
+        """
+        Generator version of `evaluation_maximun_sample`, yields each image batch to score
+        """
         sub_index_sets = []
         for candidate_ in candidate_set:
             sub_index_sets.append(
@@ -259,46 +318,35 @@ class MultiModalSubModularExplanationEfficientV2(MultiModalSubModularExplanation
             sub_index_sets_decrease.append(
                 np.concatenate((decrease_set, np.array([candidate_]))).astype(int))
 
-        # merge images / 组合图像
-        sub_images = torch.stack([
-            self.preproccessing_function(
-                self.merge_image(sub_index_set, partition_image_set)
-            ) for sub_index_set in sub_index_sets])
-        
-        batch_input_images = sub_images.to(self.device)
-        
         with torch.no_grad():
             # 2. Effectiveness Score
             score_effectiveness = self.proccess_compute_effectiveness_score(sub_index_sets)
             score_effectiveness_decrease = self.proccess_compute_effectiveness_score(sub_index_sets_decrease)
             
-            # 3. Consistency Score
-            score_consistency = self.proccess_compute_consistency_score(batch_input_images)
-            
-            # 1. Confidence Score
-            score_confidence = self.proccess_compute_confidence_score()
-            
-            # 4. Collaboration Score
-            sub_images_reverse = torch.stack([
-                self.preproccessing_function(
-                    self.org_img - self.merge_image(sub_index_set, partition_image_set)
-                ) for sub_index_set in sub_index_sets])
-        
-            batch_input_images_reverse = sub_images_reverse.to(self.device)
-            
-            score_collaboration = 1 - self.proccess_compute_consistency_score(batch_input_images_reverse)
+            # 3. Consistency Score, 4. Collaboration Score and 1. Confidence Score, one fused stream
+            # merge images / 组合图像
+            score_consistency, score_collaboration, score_confidence = yield from self.forward_scores_steps(sub_index_sets)
             
             # submodular score
             # smdl_score = self.lambda1 * score_confidence + self.lambda2 * score_effectiveness +  self.lambda3 * score_consistency + self.lambda4 * score_collaboration
             smdl_score = self.lambda1 * score_confidence + self.lambda2 * score_effectiveness + self.lambda3 * score_consistency + self.lambda4 * score_collaboration
-            arg_max_index = smdl_score.argmax().cpu().item()
+            if len(main_set) == 0:
+                self.early_stopping_singletons(candidate_set, smdl_score)
+            arg_max_index = smdl_score.argmax().item()
+            
+            # terms skipped by the score plan are forwarded for the selected subset only
+            selected = yield from self.selected_scores_steps(sub_index_sets[arg_max_index], {
+                "confidence_score": score_confidence[arg_max_index],
+                "consistency_score": score_consistency[arg_max_index],
+                "collaboration_score": score_collaboration[arg_max_index],
+            })
             
             # if self.lambda1 != 0:
-            self.saved_json_file["confidence_score_increase"].append(score_confidence[arg_max_index].cpu().item())
-            self.saved_json_file["effectiveness_score_increase"].append(score_effectiveness[arg_max_index].cpu().item())
-            self.saved_json_file["consistency_score_increase"].append(score_consistency[arg_max_index].cpu().item())
-            self.saved_json_file["collaboration_score_increase"].append(score_collaboration[arg_max_index].cpu().item())
-            self.saved_json_file["smdl_score"].append(smdl_score[arg_max_index].cpu().item())
+            self.trace.append("confidence_score_increase", selected["confidence_score"])
+            self.trace.append("effectiveness_score_increase", score_effectiveness[arg_max_index])
+            self.trace.append("consistency_score_increase", selected["consistency_score"])
+            self.trace.append("collaboration_score_increase", selected["collaboration_score"])
+            self.trace.append("smdl_score", smdl_score[arg_max_index])
 
             if len(candidate_set) > self.pending_samples:
                 smdl_score_decrease = self.lambda1 * score_confidence + self.lambda2 * score_effectiveness_decrease + self.lambda3 * score_consistency + self.lambda4 * score_collaboration
@@ -313,38 +361,29 @@ class MultiModalSubModularExplanationEfficientV2(MultiModalSubModularExplanation
                 
                 sub_index_negtive_sets = np.array(sub_index_sets_decrease)[negtive_sampels_indexes]
                 
-                # merge images / 组合图像
-                sub_images_decrease = torch.stack([
-                    self.preproccessing_function(
-                        self.merge_image(sub_index_set, partition_image_set)
-                    ) for sub_index_set in sub_index_negtive_sets])
-                
-                sub_images_decrease_reverse = torch.stack([
-                    self.preproccessing_function(
-                        self.org_img - self.merge_image(sub_index_set, partition_image_set)
-                    ) for sub_index_set in sub_index_negtive_sets])
-                
                 # 2. Effectiveness Score
                 score_effectiveness_decrease_ = score_effectiveness_decrease[negtive_sampels_indexes]
                 
-                # 3. Consistency Score
-                score_consistency_decrease = self.proccess_compute_consistency_score(sub_images_decrease.to(self.device))
-                
-                # 1. Confidence Score
-                score_confidence_decrease = self.proccess_compute_confidence_score()
-                
-                # 4. Collaboration Score
-                score_collaboration_decrease = 1 - self.proccess_compute_consistency_score(sub_images_decrease_reverse.to(self.device))
+                # 3. Consistency Score, 4. Collaboration Score and 1. Confidence Score, one fused stream
+                # merge images / 组合图像
+                score_consistency_decrease, score_collaboration_decrease, score_confidence_decrease = yield from self.forward_scores_steps(sub_index_negtive_sets)
                 
                 smdl_score_decrease = self.lambda1 * score_confidence_decrease + self.lambda2 * score_effectiveness_decrease_ + self.lambda3 * score_consistency_decrease + self.lambda4 * score_collaboration_decrease
-                arg_min_index = smdl_score_decrease.argmin().cpu().item()
+                arg_min_index = smdl_score_decrease.argmin().item()
                 
                 decrease_set = sub_index_negtive_sets[arg_min_index]
+                
+                # the saved deletion trace needs both forwards of the removed set
+                selected = yield from self.selected_scores_steps(decrease_set, {
+                    "confidence_score": score_confidence_decrease[arg_min_index],
+                    "consistency_score": score_consistency_decrease[arg_min_index],
+                    "collaboration_score": score_collaboration_decrease[arg_min_index],
+                })
 
-                self.saved_json_file["confidence_score_decrease"].append(score_confidence_decrease[arg_min_index].cpu().item())
-                self.saved_json_file["effectiveness_score_decrease"].append(score_effectiveness_decrease_[arg_min_index].cpu().item())
-                self.saved_json_file["consistency_score_decrease"].append(1-score_collaboration_decrease[arg_min_index].cpu().item())
-                self.saved_json_file["collaboration_score_decrease"].append(1-score_consistency_decrease[arg_min_index].cpu().item())
+                self.trace.append("confidence_score_decrease", selected["confidence_score"])
+                self.trace.append("effectiveness_score_decrease", score_effectiveness_decrease_[arg_min_index])
+                self.trace.append("consistency_score_decrease", 1 - selected["collaboration_score"])
+                self.trace.append("collaboration_score_decrease", 1 - selected["consistency_score"])
 
             return sub_index_sets[arg_max_index], decrease_set
     
@@ -372,15 +411,31 @@ class MultiModalSubModularExplanationEfficientV2(MultiModalSubModularExplanation
         self.saved_json_file["lambda2"] = self.lambda2
         self.saved_json_file["lambda3"] = self.lambda3
         self.saved_json_file["lambda4"] = self.lambda4
+        self.trace_init()
+    
+    def sample_candidates(self, candidate_set):
+        """
+        Candidates scored at this step, all of them for the full greedy
+        """
+        return candidate_set
     
-    def get_merge_set(self, partition):
+    def get_merge_set_steps(self, partition):
         """
+        Generator version of `get_merge_set`, yields each image batch to score
+        and a SelectionStep after each greedy step
         """
         Subset = np.array([])
         Subset_decrease = np.array([])
         
         indexes = np.arange(len(partition))
         
+        self.composer = build_composer(partition, org_img = self.org_img)
+        if self.linear_composition:
+            self.linear_composer = LinearComposer(partition, self.preproccessing_function, device = self.device)
+        
+        self.subset_cache_init(partition)
+        self.early_stopping_init(partition)
+        
         # First calculate the similarity of each element to facilitate calculation of effectiveness score.
         self.calculate_distance_of_each_element(partition)
         
@@ -390,53 +445,333 @@ class MultiModalSubModularExplanationEfficientV2(MultiModalSubModularExplanation
         for j in tqdm(range(loop_times)):
             diff = np.setdiff1d(indexes, np.concatenate((Subset, Subset_decrease)))  # in indexes but not in Subset
             
-            sub_candidate_indexes = diff
+            sub_candidate_indexes = self.sample_candidates(diff)
             if len(diff) == 1:
                 Subset = np.concatenate((Subset, np.array(diff)))
                 break
             
-            Subset, Subset_decrease = self.evaluation_maximun_sample(Subset, Subset_decrease, sub_candidate_indexes, partition)
+            Subset, Subset_decrease = yield from self.evaluation_maximun_sample_steps(Subset, Subset_decrease, sub_candidate_indexes)
+            
+            yield SelectionStep(Subset, Subset_decrease)
+            
+            if self.early_stopping_update(j):
+                # the rest is ordered by the singleton scores / 其余按单元素分数排序
+                diff = np.setdiff1d(indexes, np.concatenate((Subset, Subset_decrease)))
+                stop = len(Subset)
+                Subset = np.concatenate((Subset, self.early_stopping_tail(diff, self.k - len(Subset) - len(Subset_decrease))))
+                # like the last greedy step, the last insertion is left to the deletion curve / 最后一次插入由删除曲线覆盖
+                scores = yield from self.prefix_scores_steps(Subset[:-1].astype(int), start = stop)
+                self.early_stopping_trace(scores, {
+                    "confidence_score": "confidence_score_increase",
+                    "effectiveness_score": "effectiveness_score_increase",
+                    "consistency_score": "consistency_score_increase",
+                    "collaboration_score": "collaboration_score_increase",
+                    "smdl_score": "smdl_score"})
+                break
+        
+        # the full and the empty image / 原图和空图
+        if self.baseline_features is not None:
+            scores = self.compute_predicted_scores_from_features(self.baseline_features)[:, self.target_label]
+        else:
+            scores = (yield self.baseline_batch())[:, self.target_label]
         
-        sub_images = torch.stack([
-            self.preproccessing_function(
-                self.org_img
-            ),
-            self.preproccessing_function(
-                self.org_img - self.org_img
-            ),
-        ])
-        scores = self.proccess_compute_consistency_score(sub_images.to(self.device))
+        # the trace reaches the host once, here / 分数一次性传回主机
+        self.trace_flush()
+        scores = scores.cpu().tolist()
         
-        self.saved_json_file["consistency_score"] = self.saved_json_file["consistency_score_increase"] + self.saved_json_file["consistency_score_decrease"][::-1] + [scores[0].cpu().item()]
-        self.saved_json_file["collaboration_score"] = self.saved_json_file["collaboration_score_increase"] + self.saved_json_file["collaboration_score_decrease"][::-1] + [1-scores[1].cpu().item()]
+        self.saved_json_file["consistency_score"] = self.saved_json_file["consistency_score_increase"] + self.saved_json_file["consistency_score_decrease"][::-1] + [scores[0]]
+        self.saved_json_file["collaboration_score"] = self.saved_json_file["collaboration_score_increase"] + self.saved_json_file["collaboration_score_decrease"][::-1] + [1-scores[1]]
         
         Subset = np.concatenate((Subset, Subset_decrease[::-1]))
         
+        self.subset_cache_record()
+        
         return Subset.astype(int)
     
-    def __call__(self, image_set, id = None):
+    def explain_batch(self, image_sets, ids, ks = None):
         """
-        Compute Source Face Submodular Score
-            @image_set: [mask_image 1, ..., mask_image m] (cv2 format)
+        Explain several images in lockstep. At every round, the image batches
+        of all unfinished searches are packed into one shared forward stream
+        (split into memory-bounded micro-batches) and the predicted scores
+        are scattered back.
+            @image_sets: list of element sets
+            @ids: target label of each image
+            @ks: optional k of each image, `self.k` by default
         """
-        # V_partition = self.partition_collection(image_set)  # [ [image1, image2, ...], [image1, image2, ...], ...  ]
+        with torch.no_grad():
+            return self.run_batch(image_sets, ids, ks)
     
-        self.save_file_init()
-        
-        self.org_img = np.array(image_set).sum(0).astype(np.uint8)      
-        source_image = self.preproccessing_function(self.org_img)
+    def run_batch(self, image_sets, ids, ks):
+        engines = []
+        searches = []
+        partitions = []
+        for i, (image_set, id) in enumerate(zip(image_sets, ids)):
+            # each image keeps its own state, the model is shared
+            engine = copy.copy(self)
+            if ks is not None:
+                engine.k = ks[i]
+            partitions.append(engine.prepare_explanation(image_set, id))
+            engines.append(engine)
+            searches.append(engine.get_merge_set_steps(partitions[-1]))
+        
+        def advance(i, predicted_scores = None):
+            # greedy step events are not needed here, skip to the next image batch
+            request = searches[i].send(predicted_scores)
+            while isinstance(request, SelectionStep):
+                request = searches[i].send(None)
+            return request
+        
+        selected = [None] * len(engines)
+        pending = {}
+        for i in range(len(searches)):
+            try:
+                pending[i] = advance(i)
+            except StopIteration as stop:
+                selected[i] = stop.value
+        
+        while len(pending) > 0:
+            order = list(pending.keys())
+            batch_input_images = concat_batches([pending[i] for i in order])
+            predicted_scores = self.compute_predicted_scores(batch_input_images)
+            
+            start = 0
+            for i in order:
+                end = start + len(pending[i])
+                try:
+                    pending[i] = advance(i, predicted_scores[start : end])
+                except StopIteration as stop:
+                    selected[i] = stop.value
+                    del pending[i]
+                start = end
+        
+        return [engine.finish_explanation(partition, Submodular_Subset)
+                for engine, partition, Submodular_Subset in zip(engines, partitions, selected)]
 
-        self.source_feature = self.model(source_image.unsqueeze(0).to(self.device))
-        self.target_label = id
-        
-        Subset_merge = np.array(image_set)
-        Submodular_Subset = self.get_merge_set(Subset_merge)  # array([17, 42, 49, ...])
+class MultiModalSubModularExplanationStochasticGreedy(MultiModalSubModularExplanationEfficientV2):
+    """
+    Stochastic greedy: each step scores a random sample of size
+    (N/k)·log(1/epsilon) of the remaining candidates instead of all of them.
+    """
+    def __init__(self, 
+                 model,
+                 semantic_feature,
+                 preproccessing_function,
+                 k = 40,
+                 lambda1 = 1.0,
+                 lambda2 = 1.0,
+                 lambda3 = 1.0,
+                 lambda4 = 1.0,
+                 device = "cuda",
+                 pending_samples = 8,
+                 linear_composition = False,
+                 forward_batch_size = None,
+                 forward_memory_budget = None,
+                 subset_cache_memory = None,
+                 feature_cache = None,
+                 early_stop_epsilon = None,
+                 early_stop_min_gain = None,
+                 early_stop_patience = 3,
+                 n = 1,
+                 partition_k = None,
+                 partition_pool = None,
+                 pipeline_workers = 0,
+                 pipeline_chunk_size = 16,
+                 epsilon = 0.01,
+                 seed = 0):
+        super(MultiModalSubModularExplanationStochasticGreedy, self).__init__(
+            k = k,
+            model = model,
+            semantic_feature = semantic_feature,
+            preproccessing_function = preproccessing_function,
+            
+            lambda1 = lambda1,
+            lambda2 = lambda2,
+            lambda3 = lambda3,
+            lambda4 = lambda4,
             
-        submodular_image_set = Subset_merge[Submodular_Subset]  # sub_k x (112, 112, 3)
+            device = device,
+            pending_samples = pending_samples,
+            linear_composition = linear_composition,
+            forward_batch_size = forward_batch_size,
+            forward_memory_budget = forward_memory_budget,
+            subset_cache_memory = subset_cache_memory,
+            feature_cache = feature_cache,
+            early_stop_epsilon = early_stop_epsilon,
+            early_stop_min_gain = early_stop_min_gain,
+            early_stop_patience = early_stop_patience,
+            n = n,
+            partition_k = partition_k,
+            partition_pool = partition_pool,
+            pipeline_workers = pipeline_workers,
+            pipeline_chunk_size = pipeline_chunk_size)
+        
+        self.epsilon = epsilon
+        self.seed = seed
+    
+    def sample_candidates(self, candidate_set):
+        """
+        Random sample of the remaining candidates
+        """
+        if len(candidate_set) <= self.sample_size:
+            return candidate_set
+        return np.sort(self.random_state.choice(candidate_set, self.sample_size, replace=False))
+    
+    def get_merge_set_steps(self, partition):
+        """
+        """
+        # keep enough candidates for the pending (decrease) samples
+        self.sample_size = max(
+            int(math.ceil(len(partition) / self.k * math.log(1 / self.epsilon))),
+            self.pending_samples + 1)
+        # same seed for every image, so results are reproducible
+        self.random_state = np.random.RandomState(self.seed)
         
+        Subset = yield from super(MultiModalSubModularExplanationStochasticGreedy, self).get_merge_set_steps(partition)
         
-        submodular_image = submodular_image_set.sum(0).astype(np.uint8)
-        self.saved_json_file["smdl_score_max"] = max(self.saved_json_file["smdl_score"])
-        self.saved_json_file["smdl_score_max_index"] = self.saved_json_file["smdl_score"].index(self.saved_json_file["smdl_score_max"])
+        self.saved_json_file["stochastic_sample_size"] = self.sample_size
+        return Subset
 
-        return submodular_image, submodular_image_set, self.saved_json_file
\ No newline at end of file
+class MultiModalSubModularExplanationHierarchical(MultiModalSubModularExplanationEfficientV2):
+    """
+    Coarse-to-fine search: the fine elements are grouped under a coarse
+    partition, the greedy search (EfficientV2) first orders the coarse
+    groups, then re-orders the elements inside each of the `top_groups`
+    best groups. The other groups keep their element order. The output is
+    one fine-grained ordering, its score terms are computed on the prefixes
+    of that ordering, as in the other engines' json.
+    Cost is O(Nc^2 + sum nf^2) forwards instead of O(N^2).
+    """
+    def __init__(self, 
+                 model,
+                 semantic_feature,
+                 preproccessing_function,
+                 k = 40,
+                 lambda1 = 1.0,
+                 lambda2 = 1.0,
+                 lambda3 = 1.0,
+                 lambda4 = 1.0,
+                 device = "cuda",
+                 pending_samples = 8,
+                 linear_composition = False,
+                 forward_batch_size = None,
+                 forward_memory_budget = None,
+                 subset_cache_memory = None,
+                 feature_cache = None,
+                 early_stop_epsilon = None,
+                 early_stop_min_gain = None,
+                 early_stop_patience = 3,
+                 n = 1,
+                 partition_k = None,
+                 partition_pool = None,
+                 pipeline_workers = 0,
+                 pipeline_chunk_size = 16,
+                 coarse_division = None,
+                 top_groups = 4,
+                 curve_batch_size = 64):
+        super(MultiModalSubModularExplanationHierarchical, self).__init__(
+            k = k,
+            model = model,
+            semantic_feature = semantic_feature,
+            preproccessing_function = preproccessing_function,
+            
+            lambda1 = lambda1,
+            lambda2 = lambda2,
+            lambda3 = lambda3,
+            lambda4 = lambda4,
+            
+            device = device,
+            pending_samples = pending_samples,
+            linear_composition = linear_composition,
+            forward_batch_size = forward_batch_size,
+            forward_memory_budget = forward_memory_budget,
+            subset_cache_memory = subset_cache_memory,
+            feature_cache = feature_cache,
+            early_stop_epsilon = early_stop_epsilon,
+            early_stop_min_gain = early_stop_min_gain,
+            early_stop_patience = early_stop_patience,
+            n = n,
+            partition_k = partition_k,
+            partition_pool = partition_pool,
+            pipeline_workers = pipeline_workers,
+            pipeline_chunk_size = pipeline_chunk_size)
+        
+        # org_img -> coarse ElementSet or label map, e.g. a large `region_size` SubRegionDivision
+        assert coarse_division is not None, "the hierarchical search needs a coarse_division"
+        self.coarse_division = coarse_division
+        # coarse groups re-ordered at the fine level, in coarse order
+        self.top_groups = top_groups
+        # prefixes of the final ordering scored per forward stream
+        self.curve_batch_size = curve_batch_size
+    
+    def search_steps(self, partition, org_img, source_feature = None):
+        """
+        Generator: EfficientV2 order of an element set on a copy of the
+        engine, its trace is kept apart from the final one
+        """
+        engine = copy.copy(self)
+        engine.k = len(partition)
+        # subset keys are only valid within one element set
+        engine.shared_subset_cache = None
+        engine.org_img = org_img
+        if source_feature is None:
+            with torch.no_grad():
+                source_feature = self.model(self.preproccessing_function(org_img).unsqueeze(0).to(self.device))
+        engine.source_feature = source_feature
+        engine.save_file_init()
+        
+        Subset = yield from skip_selection_steps(
+            super(MultiModalSubModularExplanationHierarchical, engine).get_merge_set_steps(partition))
+        return engine, Subset
+    
+    def get_merge_set_steps(self, partition):
+        """
+        Generator version of `get_merge_set`, yields each image batch to score
+        and a SelectionStep after each coarse group is placed
+        """
+        if not isinstance(partition, ElementSet):
+            partition = ElementSet.from_dense(partition)
+        
+        # 1. coarse groups of the fine elements / 粗粒度分组
+        coarse_partition = self.coarse_division(self.org_img)
+        coarse_labels = coarse_partition.labels if isinstance(coarse_partition, ElementSet) else coarse_partition
+        coarse_set, groups = partition.group(coarse_labels)
+        
+        _, coarse_order = yield from self.search_steps(coarse_set, self.org_img, self.source_feature)
+        
+        # 2. fine order inside the top groups, in coarse order / 组内细粒度搜索
+        order = []
+        refined_groups = []
+        for rank, group in enumerate(coarse_order):
+            members = np.flatnonzero(groups == group)
+            if rank < self.top_groups and len(members) > 1:
+                group_set = partition.reorder(members)
+                _, group_order = yield from self.search_steps(group_set, group_set.sum(0).astype(np.uint8))
+                members = members[group_order]
+                refined_groups.append(int(group))
+            order += members.tolist()
+            
+            yield SelectionStep(np.array(order))
+        order = np.array(order[:self.k], dtype=int)
+        
+        # 3. score terms of the final fine ordering / 最终顺序的分数
+        self.composer = build_composer(partition, org_img = self.org_img)
+        if self.linear_composition:
+            self.linear_composer = LinearComposer(partition, self.preproccessing_function, device = self.device)
+        
+        self.subset_cache_init(partition)
+        self.calculate_distance_of_each_element(partition)
+        
+        scores = yield from self.prefix_scores_steps(order)
+        # one host transfer / 一次传回主机
+        keys = list(scores.keys())
+        values = torch.stack([scores[key] for key in keys]).cpu().tolist()
+        for key, value in zip(keys, values):
+            self.saved_json_file[key] = value
+        
+        self.saved_json_file["coarse_groups"] = len(coarse_set)
+        self.saved_json_file["coarse_order"] = [int(group) for group in coarse_order]
+        self.saved_json_file["refined_groups"] = refined_groups
+        
+        self.subset_cache_record()
+        
+        return order
@@ -1,3 +1,4 @@
+import copy
 import math
 import random
 import numpy as np
@@ -10,10 +11,31 @@ import torch
 import torch.nn.functional as F
 # import torchvision.transforms as transforms
 
-from itertools import combinations
+from itertools import combinations, groupby
 from collections import OrderedDict
 
+from .composition import build_composer, LinearComposer
+from .effectiveness import TorchEffectivenessScorer
+from .lazy_greedy import LazyGreedy
+from .early_stop import EarlyStopping
+from .micro_batch import ForwardBatcher
+from .score_trace import ScoreTrace
+from .subset_cache import SubsetCache, is_element_sum
+from .feature_cache import ElementFeatureCache
+from .element_set import ElementSet
+from .streaming import SelectionStep, run_search, stream_search
+from .pipeline import PipelinedExecutor, PendingBatch
+
 class MultiModalSubModularExplanation(object):
+    # trace key of the insertion curve streamed by `explain_steps`
+    insertion_curve_key = "consistency_score"
+    # subset cache budget (bytes) of `explain_lambda_grid` when `subset_cache_memory` is unset
+    lambda_grid_cache_memory = 256 * 2**20
+    # prefixes scored per forward stream by `prefix_scores_steps`
+    curve_batch_size = 64
+    # per-image state shipped to the partition pool workers
+    partition_state_keys = ("org_img", "source_feature", "target_label", "k", "n", "partition_k", "lambda1", "lambda2", "lambda3", "lambda4")
+    
     def __init__(self, 
                  model,
                  semantic_feature,
@@ -23,12 +45,34 @@ class MultiModalSubModularExplanation(object):
                  lambda2 = 1.0,
                  lambda3 = 1.0,
                  lambda4 = 1.0,
-                 device = "cuda"):
+                 device = "cuda",
+                 linear_composition = False,
+                 lazy_greedy = False,
+                 lazy_batch_size = 8,
+                 lazy_tolerance = 0.0,
+                 forward_batch_size = None,
+                 forward_memory_budget = None,
+                 subset_cache_memory = None,
+                 feature_cache = None,
+                 early_stop_epsilon = None,
+                 early_stop_min_gain = None,
+                 early_stop_patience = 3,
+                 n = 1,
+                 partition_k = None,
+                 partition_pool = None,
+                 pipeline_workers = 0,
+                 pipeline_chunk_size = 16):
         super(MultiModalSubModularExplanation, self).__init__()
         
         # Parameters of the submodular
         self.k = k
         
+        # Distributed greedy: the elements are split into n random partitions, each keeps
+        # `partition_k` (default ceil(k / n)) elements, searched by the workers of a PartitionPool if given
+        self.n = n
+        self.partition_k = partition_k
+        self.partition_pool = partition_pool
+        
         self.model = model
         self.semantic_feature = semantic_feature
         self.preproccessing_function = preproccessing_function
@@ -40,23 +84,95 @@ class MultiModalSubModularExplanation(object):
         
         self.device = device
         
+        # Build candidate batches as indicator @ preprocessed elements (approximate)
+        self.linear_composition = linear_composition
+        
+        # Lazy greedy: re-score only the top stale candidates in batches of `lazy_batch_size`
+        self.lazy_greedy = lazy_greedy
+        self.lazy_batch_size = lazy_batch_size
+        self.lazy_tolerance = lazy_tolerance
+        
+        # Scoring forwards are split into micro-batches under a memory budget (bytes)
+        self.forward_batcher = ForwardBatcher(batch_size = forward_batch_size, memory_budget = forward_memory_budget)
+        
+        # Predicted scores of already seen subsets are reused, LRU under `subset_cache_memory` bytes (None: off)
+        self.subset_cache_memory = subset_cache_memory
+        self.subset_cache = None
+        self.shared_subset_cache = None     # set by `explain_lambda_grid`, kept across runs on one image
+        self.shared_source_feature = None   # idem
+        
+        # Element embeddings, effectiveness_dist and the full / empty image embeddings
+        # are kept on disk across runs (ElementFeatureCache, None: off)
+        self.feature_cache = feature_cache
+        self.baseline_features = None
+        
+        # Exact search stops once the selected subset scores within `early_stop_epsilon` of the
+        # full image, or gains less than `early_stop_min_gain` for `early_stop_patience` steps (None: off)
+        self.early_stop_epsilon = early_stop_epsilon
+        self.early_stop_min_gain = early_stop_min_gain
+        self.early_stop_patience = early_stop_patience
+        self.early_stopping = None
+        
+        # Candidate chunks are composed and copied to the device concurrently by `pipeline_workers`
+        # threads, then forwarded as one batch (0: composed in the calling thread)
+        self.pipeline = None
+        if pipeline_workers > 0:
+            self.pipeline = PipelinedExecutor(workers = pipeline_workers, chunk_size = pipeline_chunk_size, device = device)
+        
     def partition_collection(self, image_set):
         """
-        Divide m image elements into n sets
+        Divide m image elements into n random sets, returns the element indexes of each
         """
-        image_set_size = len(image_set)
-        sample_size_per_partition = image_set_size
+        indexes = list(range(len(image_set)))
+        random.shuffle(indexes)
         
-        image_set_clone = list(image_set)
-        random.shuffle(image_set_clone)
+        return np.array_split(np.array(indexes, dtype=int), self.n)
+    
+    def partition_size(self):
+        """
+        Elements kept by each partition of the distributed greedy
+        """
+        if self.partition_k is not None:
+            return self.partition_k
+        return int(math.ceil(self.k / self.n))
+    
+    def search_partition(self, partition):
+        """
+        Greedy selection inside one partition, on a copy of the explainer
+        """
+        engine = copy.copy(self)
+        engine.k = min(self.partition_size(), len(partition))
+        engine.shared_subset_cache = None
+        engine.save_file_init()
+        # the bidirectional searches order more than k elements / 双向搜索会排序超过k个元素
+        return engine.get_merge_set(partition)[:engine.k]
+    
+    def partition_greedy(self, image_set):
+        """
+        Partition phase of the distributed greedy (GreeDi): every partition is
+        searched, concurrently by the partition pool workers if any. Returns
+        the union of the selections, the element set of the final search
+        (fewer than k elements if the partitions keep fewer, the search is
+        then capped at the union).
+        """
+        V_partition = self.partition_collection(image_set)
+        self.saved_json_file["sub-n"] = self.n
+        if all(self.partition_size() >= len(indexes) for indexes in V_partition):
+            # every partition would keep all of its elements, plain search / 各分区保留全部元素, 直接搜索
+            self.saved_json_file["sub-n"] = 1
+            return image_set
+        partitions = [image_set[indexes] for indexes in V_partition]
         
-        V_partition = [image_set_clone[i: i + sample_size_per_partition] for i in range(0, image_set_size, sample_size_per_partition)]
+        if self.partition_pool is not None:
+            selected = self.partition_pool.map(self, partitions)
+        else:
+            selected = [self.search_partition(partition) for partition in partitions]
         
-        assert len(V_partition[0]) == sample_size_per_partition
+        Subset_merge = np.concatenate([
+            indexes[np.asarray(Subset, dtype=int)] for indexes, Subset in zip(V_partition, selected)])
         
-        self.s_size = sample_size_per_partition
-        # assert image_set_size > sample_size_per_partition * self.k  # 其实就是 self.n > self.k ?
-        return V_partition
+        self.saved_json_file["partition_union"] = Subset_merge.tolist()
+        return image_set[Subset_merge]
     
     def merge_image(self, sub_index_set, partition_image_set):
         """
@@ -67,6 +183,30 @@ class MultiModalSubModularExplanation(object):
 
         return image.astype(np.uint8)
     
+    def compose_subsets(self, sub_index_sets, reverse = False):
+        """
+        Preprocessed batch of the given subsets (or their complements), on device
+        """
+        if self.linear_composition:
+            return self.linear_composer.merge(sub_index_sets, reverse = reverse)
+        
+        sub_images = []
+        for sub_index_set in sub_index_sets:
+            sub_image = self.composer.merge(sub_index_set)
+            if reverse:
+                sub_image = self.org_img - sub_image
+            sub_images.append(self.preproccessing_function(sub_image))
+        return torch.stack(sub_images).to(self.device)
+    
+    def baseline_batch(self):
+        """
+        Preprocessed batch of the full and the empty image, on device
+        """
+        return torch.stack([
+            self.preproccessing_function(self.org_img),
+            self.preproccessing_function(self.org_img - self.org_img),
+        ]).to(self.device)
+    
     # def compute_effectiveness_score(self, features):
     #     """
     #     Computes Eeffectiveness Score: The point should be distant from all the other elements in the subset.
@@ -117,90 +257,259 @@ class MultiModalSubModularExplanation(object):
         """
         Compute each S's effectiveness score
         """
-        e_scores = []
-        
-        for sub_index in sub_index_sets:
-            cosine_dist = self.effectiveness_dist[:, np.array(sub_index)]    # [len(element) , len(main_set)]
-            cosine_dist = cosine_dist[np.array(sub_index), :]
-            
-            eye = torch.eye(cosine_dist.shape[0], device=self.device)
-            adjusted_cosine_dist = cosine_dist + eye
-            e_score = torch.sum(torch.min(adjusted_cosine_dist, dim=1).values)
-            e_scores.append(e_score)
+        if not self.score_plan["effectiveness"]:
+            return torch.zeros(len(sub_index_sets), device=self.device)
         
-        effectiveness_score = torch.stack(e_scores)
+        # sub_index_sets share one base set, scored incrementally / 增量计算
+        effectiveness_score = self.effectiveness_scorer.score_sets(sub_index_sets)
         if len(sub_index_sets[0]) == 1:
             effectiveness_score = effectiveness_score * 0
         return effectiveness_score
     
+    def compute_predicted_scores(self, batch_input_images):
+        """
+        Class probabilities of a batch of preprocessed images
+        """
+        with torch.no_grad():
+            if isinstance(batch_input_images, PendingBatch):
+                # one fused forward once the pipeline has produced every chunk
+                visual_features = self.pipeline.consume(
+                    batch_input_images, lambda chunk: self.forward_batcher(self.model, chunk))
+            else:
+                visual_features = self.forward_batcher(self.model, batch_input_images)
+        return self.compute_predicted_scores_from_features(visual_features)
+    
+    def compute_predicted_scores_from_features(self, visual_features):
+        """
+        Class probabilities of visual embeddings
+        """
+        with torch.no_grad():
+            predicted_scores = torch.softmax(visual_features @ self.semantic_feature.T, dim=-1)
+        return predicted_scores
+    
     def proccess_compute_consistency_score(self, batch_input_images):
         """
         Compute each consistency score
         """
-        with torch.no_grad():
-            visual_features = self.model(batch_input_images)
-            self.predicted_scores = torch.softmax(visual_features @ self.semantic_feature.T, dim=-1)
-            consistency_scores = self.predicted_scores[:, self.target_label]
+        self.predicted_scores = self.compute_predicted_scores(batch_input_images)
+        consistency_scores = self.predicted_scores[:, self.target_label]
 
         return consistency_scores
     
-    def evaluation_maximun_sample(self, 
-                                  main_set, 
-                                  candidate_set, 
-                                  partition_image_set):
+    @property
+    def score_plan(self):
         """
-        Given a subset, return a best sample index
+        Score terms and forward batches that contribute under the current lambdas
+        """
+        return {
+            "effectiveness": self.lambda2 != 0,
+            # confidence reuses the predicted scores of the consistency forward
+            "consistency": self.lambda1 != 0 or self.lambda3 != 0,
+            "collaboration": self.lambda4 != 0,
+        }
+    
+    def compose_requests(self, requests):
+        """
+        Preprocessed batch of `(sub_index_set, reverse)` requests, on device
+        (a PendingBatch still being produced when pipelined)
+        """
+        if self.pipeline is not None and not self.linear_composition:
+            return self.pipeline.submit(self.preprocess_requests, list(requests))
+        
+        batches = []
+        for reverse, group in groupby(requests, key = lambda request: request[1]):
+            batches.append(self.compose_subsets([sub_index_set for sub_index_set, _ in group], reverse = reverse))
+        return torch.cat(batches)
+    
+    def preprocess_requests(self, requests):
+        """
+        Preprocessed batch of `(sub_index_set, reverse)` requests on the host,
+        run by the pipeline workers
+        """
+        sub_images = []
+        for sub_index_set, reverse in requests:
+            with self.pipeline.compose_lock:
+                sub_image = self.composer.merge(sub_index_set)
+            if reverse:
+                sub_image = self.org_img - sub_image
+            sub_images.append(self.preproccessing_function(sub_image))
+        return torch.stack(sub_images)
+    
+    def predicted_scores_steps(self, requests):
+        """
+        Generator: predicted scores of `(sub_index_set, reverse)` requests,
+        subsets already scored for this image are served by the subset cache
+        """
+        if self.subset_cache is None:
+            return (yield self.compose_requests(requests))
+        return (yield from self.subset_cache.fetch_steps(requests, self.compose_requests))
+    
+    def forward_scores_steps(self, sub_index_sets, score_plan = None):
+        """
+        Generator: consistency, collaboration and confidence scores of the given subsets.
+        Only the contributing batches (subsets, complements) are requested,
+        as one fused forward stream, disabled terms are zeros.
+        """
+        if score_plan is None:
+            score_plan = self.score_plan
+        batch_size = len(sub_index_sets)
+        zeros = torch.zeros(batch_size, device=self.device)
+        
+        requests = []
+        if score_plan["consistency"]:
+            requests += [(sub_index_set, False) for sub_index_set in sub_index_sets]
+        if score_plan["collaboration"]:
+            requests += [(sub_index_set, True) for sub_index_set in sub_index_sets]
+        if len(requests) == 0:
+            return zeros, zeros, zeros
+        
+        predicted_scores = yield from self.predicted_scores_steps(requests)
+        
+        score_consistency = zeros
+        score_confidence = zeros
+        if score_plan["consistency"]:
+            self.predicted_scores = predicted_scores[:batch_size]
+            score_consistency = self.predicted_scores[:, self.target_label]
+            score_confidence = self.proccess_compute_confidence_score()
+            predicted_scores = predicted_scores[batch_size:]
+        
+        score_collaboration = zeros
+        if score_plan["collaboration"]:
+            score_collaboration = 1 - predicted_scores[:, self.target_label]
+        
+        return score_consistency, score_collaboration, score_confidence
+    
+    def selected_scores_steps(self, sub_index_set, scores):
+        """
+        Generator: the score terms of one selected subset (a dict of
+        "consistency_score", "collaboration_score", "confidence_score"),
+        with the terms skipped by the score plan filled in. The saved
+        insertion / deletion curves are built from them, so they are
+        forwarded for the selected subset only, not for every candidate.
+        """
+        score_plan = self.score_plan
+        missing = dict(score_plan, consistency = not score_plan["consistency"], collaboration = not score_plan["collaboration"])
+        if not missing["consistency"] and not missing["collaboration"]:
+            return scores
+        
+        score_consistency, score_collaboration, score_confidence = yield from self.forward_scores_steps(
+            [sub_index_set], score_plan = missing)
+        scores = dict(scores)
+        if missing["consistency"]:
+            scores["consistency_score"] = score_consistency[0]
+            scores["confidence_score"] = score_confidence[0]
+        if missing["collaboration"]:
+            scores["collaboration_score"] = score_collaboration[0]
+        return scores
+    
+    def prefix_scores_steps(self, order, start = 0):
+        """
+        Generator: score terms of the prefixes `order[:i + 1]`, i >= start
+        """
+        prefixes = [order[:i + 1] for i in range(start, len(order))]
+        # the insertion and deletion curves need both forwards
+        score_plan = dict(self.score_plan, consistency = True, collaboration = True)
+        
+        scores = {"confidence_score": [], "effectiveness_score": [], "consistency_score": [], "collaboration_score": []}
+        with torch.no_grad():
+            for begin in range(0, len(prefixes), self.curve_batch_size):
+                chunk = prefixes[begin : begin + self.curve_batch_size]
+                score_consistency, score_collaboration, score_confidence = yield from self.forward_scores_steps(
+                    chunk, score_plan = score_plan)
+                
+                scores["confidence_score"].append(score_confidence)
+                scores["effectiveness_score"].append(torch.cat([
+                    self.proccess_compute_effectiveness_score([prefix]) for prefix in chunk]))
+                scores["consistency_score"].append(score_consistency)
+                scores["collaboration_score"].append(score_collaboration)
+        
+        if len(prefixes) == 0:
+            return {key: torch.zeros(0, device=self.device) for key in list(scores.keys()) + ["smdl_score"]}
+        scores = {key: torch.cat(value) for key, value in scores.items()}
+        scores["smdl_score"] = self.lambda1 * scores["confidence_score"] + self.lambda2 * scores["effectiveness_score"] + self.lambda3 * scores["consistency_score"] + self.lambda4 * scores["collaboration_score"]
+        return scores
+    
+    def proccess_compute_forward_scores(self, sub_index_sets):
+        """
+        Compute consistency, collaboration and confidence scores under the score plan
+        """
+        return self.run_steps(self.forward_scores_steps(sub_index_sets))
+    
+    def run_steps(self, steps):
+        """
+        Drive a scoring generator: it yields image batches and receives their predicted scores
+        """
+        return run_search(steps, self.compute_predicted_scores)
+    
+    def score_candidates(self, main_set, candidate_set):
+        """
+        Score terms of `main_set + [candidate]` for each candidate
         """
         sub_index_sets = []
         for candidate_ in candidate_set:
             sub_index_sets.append(
                 np.concatenate((main_set, np.array([candidate_]))).astype(int))
        
-        # merge images / 组合图像
-        sub_images = torch.stack([
-            self.preproccessing_function(
-                self.merge_image(sub_index_set, partition_image_set)
-            ) for sub_index_set in sub_index_sets])
-        
-        batch_input_images = sub_images.to(self.device)
-        
         with torch.no_grad():
             
             # 2. Effectiveness Score
             score_effectiveness = self.proccess_compute_effectiveness_score(sub_index_sets)
         
-            # 3. Consistency Score
-            score_consistency = self.proccess_compute_consistency_score(batch_input_images)
-            
-            # 1. Confidence Score
-            score_confidence = self.proccess_compute_confidence_score()
-            
-            # 4. Collaboration Score
-            sub_images_reverse = torch.stack([
-                self.preproccessing_function(
-                    self.org_img - self.merge_image(sub_index_set, partition_image_set)
-                ) for sub_index_set in sub_index_sets])
-        
-            batch_input_images_reverse = sub_images_reverse.to(self.device)
-            
-            score_collaboration = 1 - self.proccess_compute_consistency_score(batch_input_images_reverse)
-            
-            # 1. Confidence Score
-            # score_confidence = self.proccess_compute_confidence_score()
+            # 3. Consistency Score, 4. Collaboration Score and 1. Confidence Score
+            # merge images / 组合图像
+            score_consistency, score_collaboration, score_confidence = self.proccess_compute_forward_scores(sub_index_sets)
             
             # submodular score
             smdl_score = self.lambda1 * score_confidence + self.lambda2 * score_effectiveness +  self.lambda3 * score_consistency + self.lambda4 * score_collaboration
             # smdl_score = self.lambda2 * score_effectiveness +  self.lambda3 * score_consistency + self.lambda4 * score_collaboration
-            arg_max_index = smdl_score.argmax().cpu().item()
-            
-            # if self.lambda1 != 0:
-            self.saved_json_file["confidence_score"].append(score_confidence[arg_max_index].cpu().item())
-            self.saved_json_file["effectiveness_score"].append(score_effectiveness[arg_max_index].cpu().item())
-            self.saved_json_file["consistency_score"].append(score_consistency[arg_max_index].cpu().item())
-            self.saved_json_file["collaboration_score"].append(score_collaboration[arg_max_index].cpu().item())
-            self.saved_json_file["smdl_score"].append(smdl_score[arg_max_index].cpu().item())
         
-        return sub_index_sets[arg_max_index]
+        return {
+            "confidence_score": score_confidence,
+            "effectiveness_score": score_effectiveness,
+            "consistency_score": score_consistency,
+            "collaboration_score": score_collaboration,
+            "smdl_score": smdl_score,
+        }
+    
+    def evaluation_maximun_sample(self, 
+                                  main_set, 
+                                  candidate_set, 
+                                  partition_image_set):
+        """
+        Given a subset, return a best sample index
+        """
+        scores = self.score_candidates(main_set, candidate_set)
+        if len(main_set) == 0:
+            self.early_stopping_singletons(candidate_set, scores["smdl_score"])
+        # only the selected index crosses to the host / 只有索引回到主机
+        arg_max_index = scores["smdl_score"].argmax().item()
+        sub_index_set = np.concatenate((main_set, np.array([candidate_set[arg_max_index]]))).astype(int)
+        
+        scores = {key: value[arg_max_index] for key, value in scores.items()}
+        for key, value in self.run_steps(self.selected_scores_steps(sub_index_set, scores)).items():
+            self.trace.append(key, value)
+        
+        return sub_index_set
+    
+    def evaluation_lazy_sample(self, 
+                               main_set, 
+                               candidate_set):
+        """
+        Lazy greedy version of `evaluation_maximun_sample`, only re-scores the top stale candidates
+        """
+        def evaluate(candidates):
+            scores = self.score_candidates(main_set, candidates)
+            if len(main_set) == 0:
+                self.early_stopping_singletons(candidates, scores["smdl_score"])
+            return {key: value.cpu().numpy() for key, value in scores.items()}
+        
+        candidate_, scores = self.lazy_greedy_selector.select(candidate_set, evaluate)
+        sub_index_set = np.concatenate((main_set, np.array([candidate_]))).astype(int)
+        
+        for key, value in self.run_steps(self.selected_scores_steps(sub_index_set, scores)).items():
+            self.trace.append(key, float(value))
+        
+        return sub_index_set
     
     def save_file_init(self):
         self.saved_json_file = {}
@@ -214,70 +523,303 @@ class MultiModalSubModularExplanation(object):
         self.saved_json_file["lambda2"] = self.lambda2
         self.saved_json_file["lambda3"] = self.lambda3
         self.saved_json_file["lambda4"] = self.lambda4
+        self.trace_init()
+    
+    def trace_init(self):
+        """
+        The score lists of `saved_json_file` are recorded on the device / 分数记录在设备上
+        """
+        self.trace = ScoreTrace(
+            [key for key, value in self.saved_json_file.items() if isinstance(value, list)],
+            capacity = self.k,
+            device = self.device)
+    
+    def trace_flush(self):
+        """
+        Move the recorded scores into `saved_json_file`, one host transfer
+        """
+        self.saved_json_file.update(self.trace.to_dict())
+    
+    def subset_cache_init(self, partition):
+        """
+        Fresh subset cache for a new element set, keys are only valid within one image
+        """
+        self.subset_cache = self.shared_subset_cache
+        if self.subset_cache is None and self.subset_cache_memory:
+            # the final GreeDi search runs over a part of the image / 分布式搜索的最终阶段只覆盖部分图像
+            self.subset_cache = SubsetCache(
+                len(partition), memory_budget = self.subset_cache_memory,
+                complement_alias = is_element_sum(self.org_img, partition))
+        if self.subset_cache is not None:
+            self.subset_cache_start = (self.subset_cache.hits, self.subset_cache.misses)
+    
+    def subset_cache_record(self):
+        if self.subset_cache is not None:
+            self.saved_json_file["subset_cache_hits"] = self.subset_cache.hits - self.subset_cache_start[0]
+            self.saved_json_file["subset_cache_misses"] = self.subset_cache.misses - self.subset_cache_start[1]
+    
+    def early_stopping_init(self, partition):
+        """
+        Fresh convergence policy for a new element set, None runs every step
+        """
+        self.early_stopping = None
+        if self.early_stop_epsilon is None and self.early_stop_min_gain is None:
+            return
+        
+        with torch.no_grad():
+            full_score = self.compute_predicted_scores_from_features(self.source_feature)[0, self.target_label].item()
+        self.early_stopping = EarlyStopping(
+            full_score,
+            epsilon = self.early_stop_epsilon, 
+            min_gain = self.early_stop_min_gain, 
+            patience = self.early_stop_patience)
+        # f({c}) of the first step, orders the elements left after an early stop
+        self.singleton_scores = np.full(len(partition), -np.inf)
+        self.saved_json_file["early_stop_step"] = None
+    
+    def early_stopping_singletons(self, candidate_set, smdl_score):
+        if self.early_stopping is not None:
+            self.singleton_scores[np.asarray(candidate_set, dtype=int)] = smdl_score.cpu().numpy()
+    
+    def early_stopping_update(self, step):
+        """
+        Check the convergence policy after a greedy step, True once exact search can stop
+        """
+        if self.early_stopping is None:
+            return False
+        consistency_score, smdl_score = self.trace.last([self.insertion_curve_key, "smdl_score"])
+        if not self.early_stopping.update(consistency_score, smdl_score):
+            return False
+        
+        # where the exact search stopped / 精确搜索停止的位置
+        self.saved_json_file["early_stop_step"] = step + 1
+        return True
+    
+    def early_stopping_tail(self, remaining, size):
+        """
+        Order of the elements left after an early stop, by singleton score
+        """
+        return EarlyStopping.order_tail(remaining, self.singleton_scores)[:max(size, 0)]
+    
+    def early_stopping_trace(self, scores, keys):
+        """
+        Record the prefix scores of the tail (see `prefix_scores_steps`), so
+        the saved curves cover the whole ordering after an early stop.
+            :param keys: score term -> trace key
+        """
+        for key, trace_key in keys.items():
+            for value in scores[key]:
+                self.trace.append(trace_key, value)
     
     def calculate_distance_of_each_element(self, partition_image_set):
         """
         Calculate the similarity of each element, obtain a similarity matrix
         """
+        self.baseline_features = None
+        if not self.score_plan["effectiveness"]:
+            # the N-element forward is only needed by the effectiveness score
+            return
+        
+        cached = None
+        if self.feature_cache is not None:
+            cached = self.feature_cache.load(partition_image_set)
+        
         with torch.no_grad():
-            partition_images = torch.stack([
-                self.preproccessing_function(
-                    partition_image
-                ) for partition_image in partition_image_set]).to(self.device)
-            partition_image_features = self.model(partition_images)
-            
-            norm_feature = F.normalize(partition_image_features, p=2, dim=1)
-            # Consine Similarity
-            cosine_similarity = torch.mm(norm_feature, norm_feature.t())
-            cosine_similarity = torch.clamp(cosine_similarity, min=-1, max=1)
+            if cached is not None:
+                self.effectiveness_dist = torch.as_tensor(np.array(cached["effectiveness_dist"]), device=self.device)
+                self.baseline_features = torch.as_tensor(np.array(cached["baseline_features"]), device=self.device)
+            else:
+                if self.linear_composition:
+                    partition_images = self.linear_composer.features
+                else:
+                    partition_images = torch.stack([
+                        self.preproccessing_function(
+                            partition_image
+                        ) for partition_image in partition_image_set]).to(self.device)
+                if self.feature_cache is not None:
+                    # the full and the empty image share the forward, they are cached too
+                    partition_images = torch.cat([partition_images, self.baseline_batch()])
+                partition_image_features = self.forward_batcher(self.model, partition_images)
+                if self.feature_cache is not None:
+                    self.baseline_features = partition_image_features[-2:]
+                    partition_image_features = partition_image_features[:-2]
+                
+                norm_feature = F.normalize(partition_image_features, p=2, dim=1)
+                # Consine Similarity
+                cosine_similarity = torch.mm(norm_feature, norm_feature.t())
+                cosine_similarity = torch.clamp(cosine_similarity, min=-1, max=1)
+                
+                # Normlize 0-1
+                self.effectiveness_dist = torch.arccos(cosine_similarity) / math.pi
+                
+                if self.feature_cache is not None:
+                    self.feature_cache.save(
+                        partition_image_set,
+                        features = partition_image_features.cpu().numpy(),
+                        effectiveness_dist = self.effectiveness_dist.cpu().numpy(),
+                        baseline_features = self.baseline_features.cpu().numpy())
             
-            # Normlize 0-1
-            self.effectiveness_dist = torch.arccos(cosine_similarity) / math.pi
+            self.effectiveness_scorer = TorchEffectivenessScorer(self.effectiveness_dist)
     
     def get_merge_set(self, partition):
         """
         """
+        return self.run_steps(self.get_merge_set_steps(partition))
+    
+    def get_merge_set_steps(self, partition):
+        """
+        Generator version of `get_merge_set`, yields a SelectionStep after each greedy step
+        """
         Subset = np.array([])
         
         indexes = np.arange(len(partition))
         
+        self.composer = build_composer(partition, org_img = self.org_img)
+        if self.linear_composition:
+            self.linear_composer = LinearComposer(partition, self.preproccessing_function, device = self.device)
+        
+        self.subset_cache_init(partition)
+        self.early_stopping_init(partition)
+        
         # First calculate the similarity of each element to facilitate calculation of effectiveness score.
         self.calculate_distance_of_each_element(partition)
         
         self.smdl_score_best = 0
         
-        for j in tqdm(range(self.k)):
+        if self.lazy_greedy:
+            self.lazy_greedy_selector = LazyGreedy(
+                batch_size = self.lazy_batch_size, 
+                tolerance = self.lazy_tolerance, 
+                forward_passes_per_candidate = self.score_plan["consistency"] + self.score_plan["collaboration"])
+        
+        for j in tqdm(range(min(self.k, len(partition)))):
             diff = np.setdiff1d(indexes, np.array(Subset))  # in indexes but not in Subset
             
             sub_candidate_indexes = diff
             
-            Subset = self.evaluation_maximun_sample(Subset, sub_candidate_indexes, partition)
+            if self.lazy_greedy:
+                Subset = self.evaluation_lazy_sample(Subset, sub_candidate_indexes)
+            else:
+                Subset = self.evaluation_maximun_sample(Subset, sub_candidate_indexes, partition)
+            
+            yield SelectionStep(Subset)
+            
+            if self.early_stopping_update(j):
+                # the rest is ordered by the singleton scores / 其余按单元素分数排序
+                diff = np.setdiff1d(indexes, Subset)
+                stop = len(Subset)
+                Subset = np.concatenate((Subset, self.early_stopping_tail(diff, self.k - len(Subset)))).astype(int)
+                self.early_stopping_trace(
+                    self.run_steps(self.prefix_scores_steps(Subset, start = stop)),
+                    {key: key for key in ["confidence_score", "effectiveness_score", "consistency_score", "collaboration_score", "smdl_score"]})
+                break
+        
+        if self.lazy_greedy:
+            self.saved_json_file["forward_passes"] = self.lazy_greedy_selector.forward_passes
+            self.saved_json_file["forward_passes_saved"] = self.lazy_greedy_selector.forward_passes_saved
+        self.subset_cache_record()
+        self.trace_flush()
         
         return Subset
     
-    def __call__(self, image_set, id = None):
+    def prepare_explanation(self, image_set, id = None):
         """
-        Compute Source Face Submodular Score
-            @image_set: [mask_image 1, ..., mask_image m] (cv2 format)
+        Reset the per-image state, return the element set of the search
         """
+        if not isinstance(image_set, ElementSet):
+            image_set = np.array(image_set)
+        
         # V_partition = self.partition_collection(image_set)  # [ [image1, image2, ...], [image1, image2, ...], ...  ]
     
         self.save_file_init()
         
-        self.org_img = np.array(image_set).sum(0).astype(np.uint8)      
-        source_image = self.preproccessing_function(self.org_img)
-
-        self.source_feature = self.model(source_image.unsqueeze(0).to(self.device))
+        self.org_img = image_set.sum(0).astype(np.uint8)      
+        if self.shared_source_feature is not None:
+            self.source_feature = self.shared_source_feature
+        else:
+            source_image = self.preproccessing_function(self.org_img)
+            self.source_feature = self.model(source_image.unsqueeze(0).to(self.device))
         self.target_label = id
         
-        Subset_merge = np.array(image_set)
-        Submodular_Subset = self.get_merge_set(Subset_merge)  # array([17, 42, 49, ...])
-            
-        submodular_image_set = Subset_merge[Submodular_Subset]  # sub_k x (112, 112, 3)
+        if self.pipeline is not None:
+            self.pipeline.reset()
         
+        if self.n != 1:
+            # the final search runs over the union of the partition selections
+            return self.partition_greedy(image_set)
+        return image_set
+    
+    def finish_explanation(self, Subset_merge, Submodular_Subset):
+        """
+        Build the outputs from the selected order
+        """
+        submodular_image_set = Subset_merge[Submodular_Subset]  # sub_k x (112, 112, 3)
         
         submodular_image = submodular_image_set.sum(0).astype(np.uint8)
         self.saved_json_file["smdl_score_max"] = max(self.saved_json_file["smdl_score"])
         self.saved_json_file["smdl_score_max_index"] = self.saved_json_file["smdl_score"].index(self.saved_json_file["smdl_score_max"])
+        if self.pipeline is not None:
+            # stage timing of the forward stream (shared by the images of an `explain_batch`)
+            self.saved_json_file["pipeline_timing"] = self.pipeline.timing()
+        
+        return submodular_image, submodular_image_set, self.saved_json_file
+    
+    def __call__(self, image_set, id = None):
+        """
+        Compute Source Face Submodular Score
+            @image_set: [mask_image 1, ..., mask_image m] (cv2 format), or an ElementSet
+        """
+        Subset_merge = self.prepare_explanation(image_set, id)
+        
+        Submodular_Subset = self.get_merge_set(Subset_merge)  # array([17, 42, 49, ...])
+        
+        return self.finish_explanation(Subset_merge, Submodular_Subset)
+    
+    def explain_steps(self, image_set, id = None):
+        """
+        Generator version of `__call__`: yields a dict per greedy step as soon
+        as it is done (selected index, score breakdown, running insertion
+        curve, see `stream_search`) and returns the `__call__` outputs.
+        Stop iterating to end the search early.
+        """
+        Subset_merge = self.prepare_explanation(image_set, id)
+        
+        Submodular_Subset = yield from stream_search(
+            self.get_merge_set_steps(Subset_merge), self.trace,
+            compute_predicted_scores = self.compute_predicted_scores,
+            curve_key = self.insertion_curve_key)
+        
+        return self.finish_explanation(Subset_merge, Submodular_Subset)
+    
+    def explain_lambda_grid(self, image_set, id, lambda_grid):
+        """
+        Explain one image under several (lambda1, lambda2, lambda3, lambda4)
+        settings. The settings run one after another, they share the source
+        feature, one element feature cache and one subset cache (the score
+        terms of a subset do not depend on the lambdas): a subset requested
+        by several settings is forwarded once. The subset cache is bounded
+        by `subset_cache_memory`, `lambda_grid_cache_memory` if unset.
+        """
+        engine = copy.copy(self)
+        if len(lambda_grid) > 1:
+            image_set = image_set if isinstance(image_set, ElementSet) else np.array(image_set)
+            with torch.no_grad():
+                engine.shared_source_feature = self.model(
+                    self.preproccessing_function(image_set.sum(0).astype(np.uint8)).unsqueeze(0).to(self.device))
+        # partitioned runs search a different union per setting, their subset keys would not match
+        if len(lambda_grid) > 1 and self.n == 1:
+            if engine.feature_cache is None:
+                engine.feature_cache = ElementFeatureCache(None)
+            # org_img is the sum of the whole image set here / 此时org_img即所有元素之和
+            engine.shared_subset_cache = SubsetCache(
+                len(image_set), memory_budget = self.subset_cache_memory or self.lambda_grid_cache_memory,
+                complement_alias = True)
         
-        return submodular_image, submodular_image_set, self.saved_json_file
\ No newline at end of file
+        results = []
+        for lambda1, lambda2, lambda3, lambda4 in lambda_grid:
+            engine.lambda1 = lambda1
+            engine.lambda2 = lambda2
+            engine.lambda3 = lambda3
+            engine.lambda4 = lambda4
+            results.append(engine(image_set, id))
+        return results
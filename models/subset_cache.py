@@ -0,0 +1,114 @@
+import numpy as np
+import torch
+
+from collections import OrderedDict
+
+def is_element_sum(org_img, element_set):
+    """
+    True when `org_img` is the merged image of every element, the condition
+    of the SubsetCache `complement_alias`
+    """
+    return np.array_equal(org_img, np.asarray(element_set.sum(0)).astype(np.asarray(org_img).dtype))
+
+class SubsetCache(object):
+    """
+    LRU cache of per-subset model outputs for one element set.
+
+    The key is the packed bitmask of the subset and whether the request is
+    its complement (`org_img - merge(S)`). With `complement_alias`, which
+    the caller may only set when `org_img` is the sum of the element set,
+    the complement of `S` is keyed as the subset `V - S`, so a subset
+    reached from the increase and the decrease direction is forwarded only
+    once. Entries are evicted least recently used first once `max_entries`
+    or `memory_budget` (bytes) is exceeded.
+    """
+    def __init__(self,
+                 num_elements,
+                 max_entries = None,
+                 memory_budget = None,
+                 complement_alias = False):
+        self.num_elements = num_elements
+        self.max_entries = max_entries
+        self.memory_budget = memory_budget
+        self.complement_alias = complement_alias
+
+        self.entries = OrderedDict()
+        self.memory = 0
+
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    @property
+    def hit_rate(self):
+        requests = self.hits + self.misses
+        return self.hits / requests if requests > 0 else 0.
+
+    def key(self, sub_index_set, reverse = False):
+        """
+        Packed bitmask of the subset and the complement flag, the bitmask of
+        the elements shown to the model under `complement_alias`
+        """
+        mask = np.zeros(self.num_elements, dtype=bool)
+        mask[np.asarray(sub_index_set, dtype=int)] = True
+        if self.complement_alias:
+            if reverse:
+                mask = ~mask
+            return np.packbits(mask).tobytes()
+        return np.packbits(mask).tobytes() + (b"r" if reverse else b"s")
+
+    def get(self, key):
+        if key not in self.entries:
+            return None
+        self.entries.move_to_end(key)
+        return self.entries[key]
+
+    def put(self, key, value):
+        if key in self.entries:
+            self.memory -= self.entries.pop(key).nbytes
+        value = value.detach()
+        self.entries[key] = value
+        self.memory += value.nbytes
+
+        while len(self.entries) > 1 and (
+                (self.max_entries is not None and len(self.entries) > self.max_entries) or
+                (self.memory_budget is not None and self.memory > self.memory_budget)):
+            _, evicted = self.entries.popitem(last=False)
+            self.memory -= evicted.nbytes
+
+    def fetch_steps(self, requests, compose):
+        """
+        Generator: outputs of `(sub_index_set, reverse)` requests. Cached
+        subsets are served directly, the others are composed once each
+        (`compose(missing requests)`) and yielded as one batch.
+        """
+        keys = [self.key(sub_index_set, reverse) for sub_index_set, reverse in requests]
+        rows = [self.get(key) for key in keys]
+
+        missing = OrderedDict()
+        for key, row, request in zip(keys, rows, requests):
+            if row is None and key not in missing:
+                missing[key] = request
+        self.misses += len(missing)
+        self.hits += len(requests) - len(missing)
+
+        if len(missing) > 0:
+            outputs = yield compose(list(missing.values()))
+            fresh = OrderedDict(zip(missing.keys(), outputs))
+            for key, output in fresh.items():
+                self.put(key, output)
+            rows = [fresh[key] if row is None else row for key, row in zip(keys, rows)]
+        return torch.stack(rows)
+
+    def fetch(self, requests, compose, forward):
+        """
+        Same as `fetch_steps`, `forward(batch)` computes the missing outputs
+        """
+        steps = self.fetch_steps(requests, compose)
+        try:
+            batch = next(steps)
+            steps.send(forward(batch))
+        except StopIteration as stop:
+            return stop.value
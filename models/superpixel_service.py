@@ -0,0 +1,144 @@
+import multiprocessing
+import numpy as np
+import cv2
+
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor
+
+from .element_set import ElementSet
+
+def superpixel_params(mode = "slico", region_size = 30, ruler = 20.0):
+    """
+    Every parameter of a SLIC / SEEDS partition, the PartitionCache key
+    """
+    if mode == "slico":
+        return {"region_size": region_size, "ruler": ruler, "iterations": 20}
+    return {"num_superpixels": 50, "num_levels": 3, "iterations": 10}
+
+def superpixel_labels(image, mode = "slico", region_size = 30, ruler = 20.0, cache = None):
+    """
+    Superpixel label map [H,W] of an image and its number of superpixels,
+    every region comes out of one SLIC / SEEDS pass. Read from and stored to
+    `cache` (a PartitionCache) when given, a cached map keeps its narrow dtype
+    """
+    if mode not in ["slico", "seeds"]:
+        return None, 0
+    if cache is not None:
+        element_set = cache.load(image, mode, **superpixel_params(mode, region_size, ruler))
+        if element_set is not None:
+            return element_set.labels, len(element_set)
+
+    if mode == "slico":
+        slic = cv2.ximgproc.createSuperpixelSLIC(image, region_size=region_size, ruler = ruler)
+        slic.iterate(20)     # The number of iterations, the larger the better the effect
+        labels, number = slic.getLabels(), slic.getNumberOfSuperpixels()
+    else:
+        seeds = cv2.ximgproc.createSuperpixelSEEDS(image.shape[1], image.shape[0], image.shape[2], num_superpixels=50, num_levels=3)
+        seeds.iterate(image,10)  # The input image size must be the same as the initialization shape and the number of iterations is 10
+        labels, number = seeds.getLabels(), seeds.getNumberOfSuperpixels()
+
+    if cache is not None:
+        cache.save(image, mode, ElementSet(image, labels, num_elements=number), **superpixel_params(mode, region_size, ruler))
+    return labels, number
+
+def divide(image, mode = "slico", region_size = 30, ruler = 20.0, cache = None):
+    """
+    ElementSet of the superpixels of an image, [] for an unknown mode
+    """
+    labels, number = superpixel_labels(image, mode, region_size, ruler, cache)
+    if labels is None:
+        return []
+    return ElementSet(image, labels, num_elements=number)
+
+class SuperpixelService(object):
+    """
+    Superpixel partitioning off the explanation critical path.
+
+    `workers` processes run SLIC / SEEDS, only the label maps travel back
+    (the image stays with the caller). `divide_batch` partitions a list of
+    images concurrently, `prefetch` keeps the partitions of the next
+    `depth` images in flight while the caller explains the current one.
+    With `workers = 0` everything runs inline, in order. A `cache`
+    (PartitionCache) is looked up before SLIC / SEEDS and filled by the
+    workers.
+    """
+    def __init__(self,
+                 workers = 0,
+                 mode = "slico",
+                 region_size = 30,
+                 ruler = 20.0,
+                 cache = None):
+        self.workers = workers
+        self.mode = mode
+        self.region_size = region_size
+        self.ruler = ruler
+        self.cache = cache
+
+        self.executor = None
+        if workers > 0:
+            # the parent may hold CUDA state and threads / 父进程可能持有CUDA状态与线程
+            self.executor = ProcessPoolExecutor(
+                max_workers=workers, mp_context=multiprocessing.get_context("spawn"))
+
+    def submit(self, image):
+        """
+        Future of the (labels, number of superpixels) of an image
+        """
+        if self.executor is not None:
+            return self.executor.submit(superpixel_labels, image, self.mode, self.region_size, self.ruler, self.cache)
+        future = Future()
+        future.set_result(superpixel_labels(image, self.mode, self.region_size, self.ruler, self.cache))
+        return future
+
+    def element_set(self, image, future):
+        labels, number = future.result()
+        if labels is None:
+            return []
+        return ElementSet(image, labels, num_elements=number)
+
+    def divide(self, image):
+        return self.element_set(image, self.submit(image))
+
+    def divide_batch(self, images):
+        """
+        ElementSets of a list of images, partitioned concurrently
+        """
+        futures = [self.submit(image) for image in images]
+        return [self.element_set(image, future) for image, future in zip(images, futures)]
+
+    def prefetch(self, items, load, depth = 2):
+        """
+        Yield (item, image, element set) in order, the partitions of the next
+        `depth` items are computed while the current one is consumed.
+            :param load: item -> image, None skips the item (e.g. already saved);
+                         called ahead of consumption, in this process
+        """
+        if self.executor is None:
+            depth = 0
+        pending = deque()
+        items = iter(items)
+        exhausted = False
+        while True:
+            while not exhausted and len(pending) <= depth:
+                try:
+                    item = next(items)
+                except StopIteration:
+                    exhausted = True
+                    break
+                image = load(item)
+                if image is not None:
+                    pending.append((item, image, self.submit(image)))
+            if len(pending) == 0:
+                return
+            item, image, future = pending.popleft()
+            yield item, image, self.element_set(image, future)
+
+    def close(self):
+        if self.executor is not None:
+            self.executor.shutdown(cancel_futures=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
@@ -0,0 +1,144 @@
+import time
+import numpy as np
+import torch
+import torch.nn.functional as F
+
+def visible_patches(images, blank, patch_size, tolerance = 1e-4):
+    """
+    Boolean [B,P] map of the patches that differ from the preprocessed black
+    image `blank` [C,H,W] anywhere, row-major like the patch tokens
+    """
+    differs = ((images - blank.to(images.device, images.dtype)).abs() > tolerance).any(1)   # B x H x W
+    B, H, W = differs.shape
+    differs = differs.reshape(B, H // patch_size, patch_size, W // patch_size, patch_size)
+    return differs.any(4).any(2).flatten(1)
+
+def residual_attention_block(block, x, padding):
+    """
+    CLIP ResidualAttentionBlock on batch first tokens, padded keys are ignored
+    """
+    ls_1 = getattr(block, "ls_1", None) or (lambda h: h)
+    ls_2 = getattr(block, "ls_2", None) or (lambda h: h)
+
+    h = block.ln_1(x)
+    if getattr(block.attn, "batch_first", False):
+        h = block.attn(h, h, h, need_weights=False, key_padding_mask=padding)[0]
+    else:
+        h = h.transpose(0, 1)
+        h = block.attn(h, h, h, need_weights=False, key_padding_mask=padding)[0].transpose(0, 1)
+    x = x + ls_1(h)
+    x = x + ls_2(block.mlp(block.ln_2(x)))
+    return x
+
+def encode_visible_tokens(visual, images, keep):
+    """
+    Image embeddings of a CLIP VisionTransformer (OpenAI clip or open_clip)
+    computed from the CLS token and the kept patch tokens only, padded to
+    the largest kept count of the batch
+    """
+    x = visual.conv1(images.type(visual.conv1.weight.dtype))    # B x width x grid x grid
+    x = x.flatten(2).transpose(1, 2)                            # B x P x width
+    positional_embedding = visual.positional_embedding.to(x.dtype)
+    x = x + positional_embedding[1:]
+    cls = (visual.class_embedding.to(x.dtype) + positional_embedding[0]).expand(len(x), 1, -1)
+
+    # kept tokens first, in their original order / 保留的token排在前面
+    counts = keep.sum(1)
+    length = int(counts.max()) if len(counts) else 0
+    order = torch.argsort((~keep).to(torch.int8), dim=1, stable=True)[:, :length]
+    x = torch.gather(x, 1, order.unsqueeze(-1).expand(-1, -1, x.shape[-1]))
+    padding = torch.arange(length, device=x.device).unsqueeze(0) >= counts.unsqueeze(1)
+
+    x = torch.cat([cls, x], dim=1)
+    padding = torch.cat([torch.zeros_like(padding[:, :1]), padding], dim=1)
+
+    x = visual.ln_pre(x)
+    for block in visual.transformer.resblocks:
+        x = residual_attention_block(block, x, padding)
+
+    x = visual.ln_post(x[:, 0])
+    if visual.proj is not None:
+        x = x @ visual.proj
+    return x
+
+class TokenDroppingViT(torch.nn.Module):
+    """
+    Approximate image encoder for masked candidates: a patch that is black
+    everywhere (equal to the preprocessed black image) is dropped before
+    the transformer instead of being encoded as a black token, so the
+    compute of a candidate scales with its revealed area.
+
+    Kept tokens are exact; the approximation is that the CLS token no longer
+    attends to the black patches. `fidelity_report` measures the gap to the
+    pixel masked encoder.
+    """
+    def __init__(self,
+                 visual,
+                 blank,
+                 normalize = False):
+        super().__init__()
+        self.visual = visual
+        self.register_buffer("blank", blank)
+        self.normalize = normalize
+        self.patch_size = visual.conv1.kernel_size[0]
+        self.kept_tokens = 0
+        self.total_tokens = 0
+
+    def forward(self, vision_inputs):
+        """
+        Input:
+            vision_inputs: torch.size([B,C,W,H])
+        Output:
+            embeddings: a d-dimensional vector torch.size([B,d])
+        """
+        with torch.no_grad():
+            keep = visible_patches(vision_inputs, self.blank, self.patch_size)
+            self.kept_tokens += int(keep.sum())
+            self.total_tokens += keep.numel()
+
+            image_features = encode_visible_tokens(self.visual, vision_inputs, keep)
+            if self.normalize:
+                image_features /= image_features.norm(dim=-1, keepdim=True)
+        return image_features
+
+def timed(model, images):
+    if images.is_cuda:
+        torch.cuda.synchronize(images.device)
+    start = time.perf_counter()
+    outputs = model(images)
+    if images.is_cuda:
+        torch.cuda.synchronize(images.device)
+    return outputs, time.perf_counter() - start
+
+def fidelity_report(pixel_model, token_model, semantic_feature, element_set, preproccessing_function, target_label,
+                    fractions = (0.05, 0.1, 0.25, 0.5, 1.0), samples = 8, seed = 0, device = "cuda"):
+    """
+    Token dropping against pixel masking on random element subsets that
+    reveal about each fraction of the elements: embedding cosine, target
+    probability gap and top-1 agreement, plus the share of kept tokens
+    and the forward speedup
+    """
+    rng = np.random.RandomState(seed)
+    report = []
+    for fraction in fractions:
+        size = max(1, int(round(fraction * len(element_set))))
+        images = torch.stack([
+            preproccessing_function(element_set.merge(rng.choice(len(element_set), size, replace=False)).astype(np.uint8))
+            for _ in range(samples)]).to(device)
+
+        with torch.no_grad():
+            pixel_features, pixel_seconds = timed(pixel_model, images)
+            token_model.kept_tokens = token_model.total_tokens = 0
+            token_features, token_seconds = timed(token_model, images)
+            pixel_scores = torch.softmax(pixel_features.float() @ semantic_feature.float().T, dim=-1)
+            token_scores = torch.softmax(token_features.float() @ semantic_feature.float().T, dim=-1)
+
+        report.append({
+            "fraction": fraction,
+            "kept_tokens": token_model.kept_tokens / max(token_model.total_tokens, 1),
+            "cosine": F.cosine_similarity(pixel_features.float(), token_features.float(), dim=-1).mean().item(),
+            "target_score_gap": (pixel_scores[:, target_label] - token_scores[:, target_label]).abs().max().item(),
+            "top1_agreement": (pixel_scores.argmax(-1) == token_scores.argmax(-1)).float().mean().item(),
+            "speedup": pixel_seconds / max(token_seconds, 1e-9),
+        })
+    return report
@@ -0,0 +1,62 @@
+import os
+import argparse
+
+import cv2
+from tqdm import tqdm
+
+from models.partition_cache import PartitionCache
+from models.superpixel_service import SuperpixelService
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Pre-populate the partition cache of an eval list')
+    parser.add_argument('--Datasets',
+                        type=str,
+                        default='datasets/imagenet/ILSVRC2012_img_val',
+                        help='Datasets.')
+    parser.add_argument('--eval-list',
+                        type=str,
+                        default='datasets/imagenet/val_clip_vitl_5k_true.txt',
+                        help='Datasets.')
+    parser.add_argument('--partition-cache-dir',
+                        type=str,
+                        default='./partition_cache',
+                        help='')
+    parser.add_argument('--superpixel-algorithm',
+                        type=str,
+                        default="slico",
+                        choices=["slico", "seeds"],
+                        help="")
+    parser.add_argument('--region-size',
+                        type=int, default=30,
+                        help='Superpixel size, several sizes (e.g. the coarse one of the hierarchical search) take one run each.')
+    parser.add_argument('--ruler',
+                        type=float, default=20.0,
+                        help='')
+    parser.add_argument('--resize',
+                        type=int, default=224,
+                        help='Side the drivers resize the images to before partitioning (0: original size, e.g. CelebA).')
+    parser.add_argument('--workers',
+                        type=int, default=os.cpu_count(),
+                        help='Worker processes.')
+    args = parser.parse_args()
+    return args
+
+def main(args):
+    with open(args.eval_list, "r") as f:
+        infos = [info for info in f.read().split('\n') if info != ""]
+
+    def read_image(info):
+        image = cv2.imread(os.path.join(args.Datasets, info.split(" ")[0]))
+        if image is not None and args.resize > 0:
+            image = cv2.resize(image, (args.resize, args.resize))
+        return image
+
+    partition_cache = PartitionCache(args.partition_cache_dir)
+    with SuperpixelService(workers=args.workers, mode=args.superpixel_algorithm, region_size=args.region_size, ruler=args.ruler, cache=partition_cache) as superpixel_service:
+        # the workers store the entries / 由工作进程写入缓存
+        for _ in tqdm(superpixel_service.prefetch(infos, read_image, depth=4 * args.workers), total=len(infos)):
+            pass
+
+if __name__ == "__main__":
+    args = parse_args()
+    main(args)
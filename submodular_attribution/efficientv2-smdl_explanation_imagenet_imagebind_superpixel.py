@@ -37,7 +37,10 @@ from torchvision import transforms
 
 red_tr = get_alpha_cmap('Reds')
 
-from models.submodular_vit_efficient import MultiModalSubModularExplanationEfficientV2
+from models.submodular_vit_efficient import MultiModalSubModularExplanationEfficientV2, MultiModalSubModularExplanationStochasticGreedy, MultiModalSubModularExplanationHierarchical
+from models.feature_cache import ElementFeatureCache
+from models.superpixel_service import SuperpixelService
+from models.partition_cache import PartitionCache
 
 data_transform = transforms.Compose(
     [
@@ -69,6 +72,15 @@ def parse_args():
                         default="slico",
                         choices=["slico", "seeds"],
                         help="")
+    parser.add_argument('--superpixel-workers',
+                        type=int, default=0,
+                        help='Worker processes computing the superpixels of the next images while the current one is explained (0: inline).')
+    parser.add_argument('--superpixel-prefetch',
+                        type=int, default=2,
+                        help='Images partitioned ahead of the one being explained.')
+    parser.add_argument('--partition-cache-dir',
+                        type=str, default=None,
+                        help='On-disk cache of superpixel label maps keyed by image content and partition parameters, shared across runs (default: off).')
     parser.add_argument('--lambda1', 
                         type=float, default=0.,
                         help='')
@@ -81,10 +93,58 @@ def parse_args():
     parser.add_argument('--lambda4', 
                         type=float, default=10.,
                         help='')
+    parser.add_argument('--lambda-grid',
+                        type=str, default=None,
+                        help="Semicolon separated 'lambda1,lambda2,lambda3,lambda4' settings explained one after another, sharing the forwards of their common subsets, e.g. '1,1,1,1;0,1,1,0', one output directory each (overrides --lambda1..4).")
+    parser.add_argument('--linear-composition',
+                        action='store_true',
+                        help='Build candidate batches as indicator @ preprocessed elements (approximate, faster).')
+    parser.add_argument('--forward-batch-size',
+                        type=int, default=None,
+                        help='Fixed micro-batch size of scoring forwards (probed from the memory budget by default).')
+    parser.add_argument('--forward-memory-budget',
+                        type=float, default=None,
+                        help='Memory budget of scoring forwards in GB (default: 80%% of the free memory).')
+    parser.add_argument('--subset-cache-memory',
+                        type=float, default=None,
+                        help='Reuse the predicted scores of already scored subsets, LRU cache size in GB (default: off).')
+    parser.add_argument('--feature-cache-dir',
+                        type=str, default=None,
+                        help='On-disk cache of element embeddings and effectiveness distances, shared across runs (default: off).')
+    parser.add_argument('--early-stop-epsilon',
+                        type=float, default=None,
+                        help='Stop the exact search once the selected regions score within epsilon of the full image, the rest is ordered by singleton scores (default: off).')
+    parser.add_argument('--early-stop-min-gain',
+                        type=float, default=None,
+                        help='Stop the exact search once the submodular score gains less than this for --early-stop-patience steps (default: off).')
+    parser.add_argument('--early-stop-patience',
+                        type=int, default=3,
+                        help='')
+    parser.add_argument('--pipeline-workers',
+                        type=int, default=0,
+                        help='Threads composing the candidate chunks concurrently, forwarded as one batch (0: off).')
     parser.add_argument('--pending-samples',
                         type=int,
                         default=8,
                         help='')
+    parser.add_argument('--stochastic-greedy',
+                        action='store_true',
+                        help='Score a random sample of (N/k)log(1/epsilon) candidates per step.')
+    parser.add_argument('--epsilon',
+                        type=float, default=0.01,
+                        help='Stochastic greedy approximation parameter.')
+    parser.add_argument('--seed',
+                        type=int, default=0,
+                        help='Stochastic greedy random seed.')
+    parser.add_argument('--coarse-region-size',
+                        type=int, default=None,
+                        help='Coarse-to-fine search: superpixel size of the coarse groups ordered first (default: off).')
+    parser.add_argument('--top-groups',
+                        type=int, default=4,
+                        help='Coarse groups re-ordered at the fine level by the coarse-to-fine search.')
+    parser.add_argument('--image-batch',
+                        type=int, default=1,
+                        help='Number of images explained in lockstep, sharing forward batches.')
     parser.add_argument('--region-size',
                         type=int,
                         default=30,
@@ -133,6 +193,38 @@ def transform_vision_data(image):
     image = data_transform(image)
     return image
 
+def explain_and_save(smdl, batch_infos, lambda_grid, save_roots):
+    """
+    Explain a batch of images (in lockstep when there are several) and save the npy/json results
+    """
+    if len(lambda_grid) > 1:
+        # one image at a time, its lambda settings share the subset evaluations
+        results = [smdl.explain_lambda_grid(element_sets_V, gt_label, lambda_grid)
+                   for _, _, element_sets_V, gt_label in batch_infos]
+    elif len(batch_infos) == 1:
+        results = [[smdl(batch_infos[0][2], batch_infos[0][3])]]
+    else:
+        results = [[result] for result in smdl.explain_batch(
+            [element_sets_V for _, _, element_sets_V, _ in batch_infos],
+            [gt_label for _, _, _, gt_label in batch_infos],
+            ks = [len(element_sets_V) for _, _, element_sets_V, _ in batch_infos])]
+    
+    for (gt_id, image_relative_path, _, _), image_results in zip(batch_infos, results):
+        for (save_npy_root_path, save_json_root_path), (submodular_image, submodular_image_set, saved_json_file) in zip(save_roots, image_results):
+            # Save npy file
+            mkdir(os.path.join(save_npy_root_path, gt_id))
+            save_element_set(
+                os.path.join(
+                    os.path.join(save_npy_root_path, gt_id), image_relative_path.replace(".JPEG", ".npy")),
+                submodular_image_set
+            )
+
+            # Save json file
+            mkdir(os.path.join(save_json_root_path, gt_id))
+            with open(os.path.join(
+                os.path.join(save_json_root_path, gt_id), image_relative_path.replace(".JPEG", ".json")), "w") as f:
+                f.write(json.dumps(saved_json_file, ensure_ascii=False, indent=4, separators=(',', ':')))
+
 def main(args):
     # Model Init
     device = "cuda" if torch.cuda.is_available() else "cpu"
@@ -149,69 +241,114 @@ def main(args):
         semantic_feature = torch.load(semantic_path, map_location="cpu")
         semantic_feature = semantic_feature.to(device)
     
-    smdl = MultiModalSubModularExplanationEfficientV2(
-        vis_model, semantic_feature, transform_vision_data, device=device, 
-        lambda1=args.lambda1, 
-        lambda2=args.lambda2, 
-        lambda3=args.lambda3, 
+    feature_cache = None
+    if args.feature_cache_dir is not None:
+        feature_cache = ElementFeatureCache(args.feature_cache_dir, model_id="imagebind_huge")
+    
+    partition_cache = None
+    if args.partition_cache_dir is not None:
+        partition_cache = PartitionCache(args.partition_cache_dir)
+    
+    # shared by the three engine variants / 三种引擎共用的参数
+    engine_kwargs = dict(
+        device=device,
+        lambda1=args.lambda1,
+        lambda2=args.lambda2,
+        lambda3=args.lambda3,
         lambda4=args.lambda4,
-        pending_samples=args.pending_samples)
+        pending_samples=args.pending_samples,
+        linear_composition=args.linear_composition,
+        forward_batch_size=args.forward_batch_size,
+        forward_memory_budget=None if args.forward_memory_budget is None else int(args.forward_memory_budget * 1024 ** 3),
+        subset_cache_memory=None if args.subset_cache_memory is None else int(args.subset_cache_memory * 1024 ** 3),
+        feature_cache=feature_cache,
+        early_stop_epsilon=args.early_stop_epsilon,
+        early_stop_min_gain=args.early_stop_min_gain,
+        early_stop_patience=args.early_stop_patience,
+        pipeline_workers=args.pipeline_workers)
+
+    if args.coarse_region_size is not None:
+        smdl = MultiModalSubModularExplanationHierarchical(
+            vis_model, semantic_feature, transform_vision_data,
+            coarse_division=lambda image: SubRegionDivision(image, mode=args.superpixel_algorithm, region_size=args.coarse_region_size, cache=partition_cache),
+            top_groups=args.top_groups,
+            **engine_kwargs)
+    elif args.stochastic_greedy:
+        smdl = MultiModalSubModularExplanationStochasticGreedy(
+            vis_model, semantic_feature, transform_vision_data,
+            epsilon=args.epsilon,
+            seed=args.seed,
+            **engine_kwargs)
+    else:
+        smdl = MultiModalSubModularExplanationEfficientV2(
+            vis_model, semantic_feature, transform_vision_data,
+            **engine_kwargs)
     
     with open(args.eval_list, "r") as f:
         infos = f.read().split('\n')
     
+    lambda_grid = [(args.lambda1, args.lambda2, args.lambda3, args.lambda4)]
+    if args.lambda_grid is not None:
+        lambda_grid = parse_lambda_grid(args.lambda_grid)
+    
     mkdir(args.save_dir)
-    save_dir = os.path.join(args.save_dir, "{}-{}-{}-{}-{}-pending-samples-{}".format(args.superpixel_algorithm, args.lambda1, args.lambda2, args.lambda3, args.lambda4, args.pending_samples))  
+    save_roots = []     # (npy, json) root of each lambda setting
+    for lambda1, lambda2, lambda3, lambda4 in lambda_grid:
+        save_dir = os.path.join(args.save_dir, "{}-{}-{}-{}-{}-pending-samples-{}".format(args.superpixel_algorithm, lambda1, lambda2, lambda3, lambda4, args.pending_samples))  
+        if args.coarse_region_size is not None:
+            save_dir = save_dir + "-hierarchical-{}-top-{}".format(args.coarse_region_size, args.top_groups)
+        elif args.stochastic_greedy:
+            save_dir = save_dir + "-stochastic-{}-seed-{}".format(args.epsilon, args.seed)
+        if args.early_stop_epsilon is not None or args.early_stop_min_gain is not None:
+            save_dir = save_dir + "-early-stop-{}-{}-{}".format(args.early_stop_epsilon, args.early_stop_min_gain, args.early_stop_patience)
     
-    mkdir(save_dir)
+        mkdir(save_dir)
     
-    save_npy_root_path = os.path.join(save_dir, "npy")
-    mkdir(save_npy_root_path)
+        save_npy_root_path = os.path.join(save_dir, "npy")
+        mkdir(save_npy_root_path)
     
-    save_json_root_path = os.path.join(save_dir, "json")
-    mkdir(save_json_root_path)
+        save_json_root_path = os.path.join(save_dir, "json")
+        mkdir(save_json_root_path)
+        save_roots.append((save_npy_root_path, save_json_root_path))
     
-    select_infos = infos[args.begin : args.end]
-    for info in tqdm(select_infos):
+    def read_image(info):
         gt_id = info.split(" ")[1]
         
         image_relative_path = info.split(" ")[0]
         
-        if os.path.exists(
+        if all(os.path.exists(
             os.path.join(
             os.path.join(save_json_root_path, gt_id), image_relative_path.replace(".JPEG", ".json"))
-        ):
-            continue
-        
-        # Ground Truth Label
-        gt_label = int(gt_id)
+        ) for _, save_json_root_path in save_roots):
+            return None
         
         # Read original image
         image_path = os.path.join(args.Datasets, image_relative_path)
         image = cv2.imread(image_path)
         image = cv2.resize(image, (224, 224))
+        return image
+    
+    # superpixels of the next images are computed while this one is explained / 预取后续图像的超像素
+    superpixel_service = SuperpixelService(workers=args.superpixel_workers, mode=args.superpixel_algorithm, region_size=args.region_size, cache=partition_cache)
+    
+    select_infos = infos[args.begin : args.end]
+    batch_infos = []
+    for info, image, element_sets_V in tqdm(superpixel_service.prefetch(select_infos, read_image, depth=args.superpixel_prefetch), total=len(select_infos)):
+        gt_id = info.split(" ")[1]
+        
+        image_relative_path = info.split(" ")[0]
+        
+        # Ground Truth Label
+        gt_label = int(gt_id)
         
-        element_sets_V = SubRegionDivision(image, mode=args.superpixel_algorithm, region_size = args.region_size)
         smdl.k = len(element_sets_V)
-
-        # start = time.time()
-        submodular_image, submodular_image_set, saved_json_file = smdl(element_sets_V, gt_label)
-        # end = time.time()
-        # print('程序执行时间: ',end - start)
-
-        # Save npy file
-        mkdir(os.path.join(save_npy_root_path, gt_id))
-        np.save(
-            os.path.join(
-                os.path.join(save_npy_root_path, gt_id), image_relative_path.replace(".JPEG", ".npy")),
-            np.array(submodular_image_set)
-        )
-
-        # Save json file
-        mkdir(os.path.join(save_json_root_path, gt_id))
-        with open(os.path.join(
-            os.path.join(save_json_root_path, gt_id), image_relative_path.replace(".JPEG", ".json")), "w") as f:
-            f.write(json.dumps(saved_json_file, ensure_ascii=False, indent=4, separators=(',', ':')))
+        
+        batch_infos.append((gt_id, image_relative_path, element_sets_V, gt_label))
+        if len(batch_infos) < args.image_batch:
+            continue
+        
+        explain_and_save(smdl, batch_infos, lambda_grid, save_roots)
+        batch_infos = []
 
     #     # Save GIF
     #     save_gif_root_path = os.path.join(save_dir, "gif")
@@ -228,6 +365,11 @@ def main(args):
 
         # imageio.mimsave(os.path.join(save_gif_root_path, image_relative_path.replace(".jpg", ".gif")), 
         #                       frames, 'GIF', duration=0.0085)  
+    
+    if len(batch_infos) > 0:
+        explain_and_save(smdl, batch_infos, lambda_grid, save_roots)
+    
+    superpixel_service.close()
 
 
 if __name__ == "__main__":
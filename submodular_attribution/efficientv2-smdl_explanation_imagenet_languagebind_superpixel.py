@@ -36,7 +36,10 @@ from torchvision import transforms
 
 red_tr = get_alpha_cmap('Reds')
 
-from models.submodular_vit_efficient import MultiModalSubModularExplanationEfficientV2
+from models.submodular_vit_efficient import MultiModalSubModularExplanationEfficientV2, MultiModalSubModularExplanationStochasticGreedy, MultiModalSubModularExplanationHierarchical
+from models.feature_cache import ElementFeatureCache
+from models.superpixel_service import SuperpixelService
+from models.partition_cache import PartitionCache
 
 def parse_args():
     parser = argparse.ArgumentParser(description='Submodular Explanation for ImageBind Model')
@@ -54,6 +57,15 @@ def parse_args():
                         default="slico",
                         choices=["slico", "seeds"],
                         help="")
+    parser.add_argument('--superpixel-workers',
+                        type=int, default=0,
+                        help='Worker processes computing the superpixels of the next images while the current one is explained (0: inline).')
+    parser.add_argument('--superpixel-prefetch',
+                        type=int, default=2,
+                        help='Images partitioned ahead of the one being explained.')
+    parser.add_argument('--partition-cache-dir',
+                        type=str, default=None,
+                        help='On-disk cache of superpixel label maps keyed by image content and partition parameters, shared across runs (default: off).')
     parser.add_argument('--lambda1', 
                         type=float, default=1.,
                         help='')
@@ -66,10 +78,61 @@ def parse_args():
     parser.add_argument('--lambda4', 
                         type=float, default=1.,
                         help='')
+    parser.add_argument('--lambda-grid',
+                        type=str, default=None,
+                        help="Semicolon separated 'lambda1,lambda2,lambda3,lambda4' settings explained in one pass, e.g. '1,1,1,1;0,1,1,0', one output directory each (overrides --lambda1..4).")
+    parser.add_argument('--linear-composition',
+                        action='store_true',
+                        help='Build candidate batches as indicator @ preprocessed elements (approximate, faster).')
+    parser.add_argument('--forward-batch-size',
+                        type=int, default=None,
+                        help='Fixed micro-batch size of scoring forwards (probed from the memory budget by default).')
+    parser.add_argument('--forward-memory-budget',
+                        type=float, default=None,
+                        help='Memory budget of scoring forwards in GB (default: 80%% of the free memory).')
+    parser.add_argument('--subset-cache-memory',
+                        type=float, default=None,
+                        help='Reuse the predicted scores of already scored subsets, LRU cache size in GB (default: off).')
+    parser.add_argument('--feature-cache-dir',
+                        type=str, default=None,
+                        help='On-disk cache of element embeddings and effectiveness distances, shared across runs (default: off).')
+    parser.add_argument('--early-stop-epsilon',
+                        type=float, default=None,
+                        help='Stop the exact search once the selected regions score within epsilon of the full image, the rest is ordered by singleton scores (default: off).')
+    parser.add_argument('--early-stop-min-gain',
+                        type=float, default=None,
+                        help='Stop the exact search once the submodular score gains less than this for --early-stop-patience steps (default: off).')
+    parser.add_argument('--early-stop-patience',
+                        type=int, default=3,
+                        help='')
+    parser.add_argument('--pipeline-workers',
+                        type=int, default=0,
+                        help='Threads composing the candidate chunks concurrently, forwarded as one batch (0: off).')
     parser.add_argument('--pending-samples',
                         type=int,
                         default=8,
                         help='')
+    parser.add_argument('--stochastic-greedy',
+                        action='store_true',
+                        help='Score a random sample of (N/k)log(1/epsilon) candidates per step.')
+    parser.add_argument('--epsilon',
+                        type=float, default=0.01,
+                        help='Stochastic greedy approximation parameter.')
+    parser.add_argument('--seed',
+                        type=int, default=0,
+                        help='Stochastic greedy random seed.')
+    parser.add_argument('--coarse-region-size',
+                        type=int, default=None,
+                        help='Coarse-to-fine search: superpixel size of the coarse groups ordered first (default: off).')
+    parser.add_argument('--top-groups',
+                        type=int, default=4,
+                        help='Coarse groups re-ordered at the fine level by the coarse-to-fine search.')
+    parser.add_argument('--image-batch',
+                        type=int, default=1,
+                        help='Number of images explained in lockstep, sharing forward batches.')
+    parser.add_argument('--single-frame',
+                        action='store_true',
+                        help='Encode each candidate as one video frame instead of 8 identical ones (approximate, see evals/benchmark_languagebind_single_frame.py).')
     parser.add_argument('--begin', 
                         type=int, default=0,
                         help='')
@@ -83,17 +146,28 @@ def parse_args():
     return args
 
 class LanguageBindModel_Super(torch.nn.Module):
-    def __init__(self, base_model):
+    def __init__(self, base_model, num_frames = 8, single_frame = False):
         super().__init__()
         self.base_model = base_model
+        # static images are fed to the video tower as `num_frames` identical frames,
+        # or as one frame with `single_frame` (approximate, the temporal embedding differs)
+        self.num_frames = num_frames
+        self.single_frame = single_frame
         
     def forward(self, vision_inputs):
         """
         Input:
             vision_inputs: torch.size([B,C,T,W,H]) # video
+                or torch.size([B,C,W,H]) # static image
         Output:
             embeddings: a d-dimensional vector torch.size([B,d])
         """
+        if vision_inputs.dim() == 4:
+            vision_inputs = vision_inputs.unsqueeze(2)
+            if not self.single_frame:
+                # frames are a view of the image, not copies
+                vision_inputs = vision_inputs.expand(-1, -1, self.num_frames, -1, -1)
+        
         inputs = {
             "video": {'pixel_values': vision_inputs},
         }
@@ -108,7 +182,8 @@ def transform_languagebind_vision_data(image):
     Input:
         image: An image read by opencv [w,h,c]
     Output:
-        image: After preproccessing, is a tensor [c,t,w,h]
+        image: After preproccessing, is a tensor [c,w,h], the frames
+            are added on the device by LanguageBindModel_Super
     """
     data_transform = transforms.Compose(
         [
@@ -126,7 +201,6 @@ def transform_languagebind_vision_data(image):
     
     image = Image.fromarray(cv2.cvtColor(image, cv2.COLOR_BGR2RGB))
     image = data_transform(image)
-    image = image.unsqueeze(1).repeat(1, 8, 1, 1)
     return image
 
 def zeroshot_classifier(model, classnames, templates, tokenizer, device):
@@ -149,6 +223,38 @@ def zeroshot_classifier(model, classnames, templates, tokenizer, device):
         zeroshot_weights = torch.stack(zeroshot_weights).cuda()
     return zeroshot_weights
 
+def explain_and_save(smdl, batch_infos, lambda_grid, save_roots):
+    """
+    Explain a batch of images (in lockstep when there are several) and save the npy/json results
+    """
+    if len(lambda_grid) > 1:
+        # one image at a time, its lambda settings share the subset evaluations
+        results = [smdl.explain_lambda_grid(element_sets_V, gt_label, lambda_grid)
+                   for _, _, element_sets_V, gt_label in batch_infos]
+    elif len(batch_infos) == 1:
+        results = [[smdl(batch_infos[0][2], batch_infos[0][3])]]
+    else:
+        results = [[result] for result in smdl.explain_batch(
+            [element_sets_V for _, _, element_sets_V, _ in batch_infos],
+            [gt_label for _, _, _, gt_label in batch_infos],
+            ks = [len(element_sets_V) for _, _, element_sets_V, _ in batch_infos])]
+    
+    for (gt_id, image_relative_path, _, _), image_results in zip(batch_infos, results):
+        for (save_npy_root_path, save_json_root_path), (submodular_image, submodular_image_set, saved_json_file) in zip(save_roots, image_results):
+            # Save npy file
+            mkdir(os.path.join(save_npy_root_path, gt_id))
+            save_element_set(
+                os.path.join(
+                    os.path.join(save_npy_root_path, gt_id), image_relative_path.replace(".JPEG", ".npy")),
+                submodular_image_set
+            )
+
+            # Save json file
+            mkdir(os.path.join(save_json_root_path, gt_id))
+            with open(os.path.join(
+                os.path.join(save_json_root_path, gt_id), image_relative_path.replace(".JPEG", ".json")), "w") as f:
+                f.write(json.dumps(saved_json_file, ensure_ascii=False, indent=4, separators=(',', ':')))
+
 def main(args):
     
     # Model Init
@@ -166,7 +272,7 @@ def main(args):
     model = model.to(device)
     model.eval()
 
-    vis_model = LanguageBindModel_Super(model)
+    vis_model = LanguageBindModel_Super(model, single_frame=args.single_frame)
     print("load languagebind model")
     
     pretrained_ckpt = f'lb203/LanguageBind_Image'
@@ -183,77 +289,116 @@ def main(args):
         torch.save(semantic_feature, semantic_path)
     
     
-    smdl = MultiModalSubModularExplanationEfficientV2(
-        vis_model, semantic_feature, transform_languagebind_vision_data, device=device, 
-        lambda1=args.lambda1, 
-        lambda2=args.lambda2, 
-        lambda3=args.lambda3, 
+    feature_cache = None
+    if args.feature_cache_dir is not None:
+        feature_cache = ElementFeatureCache(args.feature_cache_dir, model_id="languagebind_image-single-frame" if args.single_frame else "languagebind_image")
+    
+    partition_cache = None
+    if args.partition_cache_dir is not None:
+        partition_cache = PartitionCache(args.partition_cache_dir)
+    
+    # shared by the three engine variants / 三种引擎共用的参数
+    engine_kwargs = dict(
+        device=device,
+        lambda1=args.lambda1,
+        lambda2=args.lambda2,
+        lambda3=args.lambda3,
         lambda4=args.lambda4,
-        pending_samples=args.pending_samples)
+        pending_samples=args.pending_samples,
+        linear_composition=args.linear_composition,
+        forward_batch_size=args.forward_batch_size,
+        forward_memory_budget=None if args.forward_memory_budget is None else int(args.forward_memory_budget * 1024 ** 3),
+        subset_cache_memory=None if args.subset_cache_memory is None else int(args.subset_cache_memory * 1024 ** 3),
+        feature_cache=feature_cache,
+        early_stop_epsilon=args.early_stop_epsilon,
+        early_stop_min_gain=args.early_stop_min_gain,
+        early_stop_patience=args.early_stop_patience,
+        pipeline_workers=args.pipeline_workers)
+
+    if args.coarse_region_size is not None:
+        smdl = MultiModalSubModularExplanationHierarchical(
+            vis_model, semantic_feature, transform_languagebind_vision_data,
+            coarse_division=lambda image: SubRegionDivision(image, mode=args.superpixel_algorithm, region_size=args.coarse_region_size, cache=partition_cache),
+            top_groups=args.top_groups,
+            **engine_kwargs)
+    elif args.stochastic_greedy:
+        smdl = MultiModalSubModularExplanationStochasticGreedy(
+            vis_model, semantic_feature, transform_languagebind_vision_data,
+            epsilon=args.epsilon,
+            seed=args.seed,
+            **engine_kwargs)
+    else:
+        smdl = MultiModalSubModularExplanationEfficientV2(
+            vis_model, semantic_feature, transform_languagebind_vision_data,
+            **engine_kwargs)
     
     with open(args.eval_list, "r") as f:
         infos = f.read().split('\n')
     
+    lambda_grid = [(args.lambda1, args.lambda2, args.lambda3, args.lambda4)]
+    if args.lambda_grid is not None:
+        lambda_grid = parse_lambda_grid(args.lambda_grid)
+    
     mkdir(args.save_dir)
-    save_dir = os.path.join(args.save_dir, "{}-{}-{}-{}-{}-pending-samples-{}".format(args.superpixel_algorithm, args.lambda1, args.lambda2, args.lambda3, args.lambda4, args.pending_samples))  
+    save_roots = []     # (npy, json) root of each lambda setting
+    for lambda1, lambda2, lambda3, lambda4 in lambda_grid:
+        save_dir = os.path.join(args.save_dir, "{}-{}-{}-{}-{}-pending-samples-{}".format(args.superpixel_algorithm, lambda1, lambda2, lambda3, lambda4, args.pending_samples))  
+        if args.single_frame:
+            save_dir = save_dir + "-single-frame"
+        if args.coarse_region_size is not None:
+            save_dir = save_dir + "-hierarchical-{}-top-{}".format(args.coarse_region_size, args.top_groups)
+        elif args.stochastic_greedy:
+            save_dir = save_dir + "-stochastic-{}-seed-{}".format(args.epsilon, args.seed)
+        if args.early_stop_epsilon is not None or args.early_stop_min_gain is not None:
+            save_dir = save_dir + "-early-stop-{}-{}-{}".format(args.early_stop_epsilon, args.early_stop_min_gain, args.early_stop_patience)
     
-    mkdir(save_dir)
+        mkdir(save_dir)
     
-    save_npy_root_path = os.path.join(save_dir, "npy")
-    mkdir(save_npy_root_path)
+        save_npy_root_path = os.path.join(save_dir, "npy")
+        mkdir(save_npy_root_path)
     
-    save_json_root_path = os.path.join(save_dir, "json")
-    mkdir(save_json_root_path)
+        save_json_root_path = os.path.join(save_dir, "json")
+        mkdir(save_json_root_path)
+        save_roots.append((save_npy_root_path, save_json_root_path))
     
-    select_infos = infos[args.begin : args.end]
-    for info in tqdm(select_infos):
+    def read_image(info):
         gt_id = info.split(" ")[1]
         
         image_relative_path = info.split(" ")[0]
         
-        if os.path.exists(
+        if all(os.path.exists(
             os.path.join(
             os.path.join(save_json_root_path, gt_id), image_relative_path.replace(".JPEG", ".json"))
-        ):
-            continue
-        
-        # Ground Truth Label
-        gt_label = int(gt_id)
+        ) for _, save_json_root_path in save_roots):
+            return None
         
         # Read original image
         image_path = os.path.join(args.Datasets, image_relative_path)
         image = cv2.imread(image_path)
         image = cv2.resize(image, (224, 224))
+        return image
+    
+    # superpixels of the next images are computed while this one is explained / 预取后续图像的超像素
+    superpixel_service = SuperpixelService(workers=args.superpixel_workers, mode=args.superpixel_algorithm, cache=partition_cache)
+    
+    select_infos = infos[args.begin : args.end]
+    batch_infos = []
+    for info, image, element_sets_V in tqdm(superpixel_service.prefetch(select_infos, read_image, depth=args.superpixel_prefetch), total=len(select_infos)):
+        gt_id = info.split(" ")[1]
+        
+        image_relative_path = info.split(" ")[0]
+        
+        # Ground Truth Label
+        gt_label = int(gt_id)
         
-        element_sets_V = SubRegionDivision(image, mode=args.superpixel_algorithm)
         smdl.k = len(element_sets_V)
-
-    #     start = time.time()
-        submodular_image, submodular_image_set, saved_json_file = smdl(element_sets_V, gt_label)
-    #     end = time.time()
-    #     # print('程序执行时间: ',end - start)
         
-        # Save the final image
-        # save_image_root_path = os.path.join(save_dir, "image")
-        # mkdir(save_image_root_path)
-        # mkdir(os.path.join(save_image_root_path, gt_id))
-        # save_image_path = os.path.join(
-        #     save_image_root_path, image_relative_path)
-        # cv2.imwrite(save_image_path, submodular_image)
-
-        # Save npy file
-        mkdir(os.path.join(save_npy_root_path, gt_id))
-        np.save(
-            os.path.join(
-                os.path.join(save_npy_root_path, gt_id), image_relative_path.replace(".JPEG", ".npy")),
-            np.array(submodular_image_set)
-        )
-
-        # Save json file
-        mkdir(os.path.join(save_json_root_path, gt_id))
-        with open(os.path.join(
-            os.path.join(save_json_root_path, gt_id), image_relative_path.replace(".JPEG", ".json")), "w") as f:
-            f.write(json.dumps(saved_json_file, ensure_ascii=False, indent=4, separators=(',', ':')))
+        batch_infos.append((gt_id, image_relative_path, element_sets_V, gt_label))
+        if len(batch_infos) < args.image_batch:
+            continue
+        
+        explain_and_save(smdl, batch_infos, lambda_grid, save_roots)
+        batch_infos = []
 
     #     # Save GIF
     #     save_gif_root_path = os.path.join(save_dir, "gif")
@@ -270,6 +415,11 @@ def main(args):
 
         # imageio.mimsave(os.path.join(save_gif_root_path, image_relative_path.replace(".jpg", ".gif")), 
         #                       frames, 'GIF', duration=0.0085)  
+    
+    if len(batch_infos) > 0:
+        explain_and_save(smdl, batch_infos, lambda_grid, save_roots)
+    
+    superpixel_service.close()
 
 
 if __name__ == "__main__":
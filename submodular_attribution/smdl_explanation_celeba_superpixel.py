@@ -8,6 +8,7 @@ V2 version
 """
 
 import argparse
+import functools
 
 import scipy
 import os
@@ -27,6 +28,9 @@ from utils import *
 red_tr    = get_alpha_cmap('Reds')
 
 from models.submodular_face import FaceSubModularExplanation
+from models.partition_pool import PartitionPool
+from models.superpixel_service import SuperpixelService
+from models.partition_cache import PartitionCache
 
 def parse_args():
     parser = argparse.ArgumentParser(description='Submodular Explanation')
@@ -44,12 +48,27 @@ def parse_args():
                         default="slico",
                         choices=["slico", "seeds"],
                         help="")
+    parser.add_argument('--superpixel-workers',
+                        type=int, default=0,
+                        help='Worker processes computing the superpixels of the next images while the current one is explained (0: inline).')
+    parser.add_argument('--superpixel-prefetch',
+                        type=int, default=2,
+                        help='Images partitioned ahead of the one being explained.')
+    parser.add_argument('--partition-cache-dir',
+                        type=str, default=None,
+                        help='On-disk cache of superpixel label maps keyed by image content and partition parameters, shared across runs (default: off).')
     parser.add_argument('--sub-n', 
                         type=int, default=1,
                         help='')
     parser.add_argument('--sub-k', 
                         type=int, default=97,
                         help='')
+    parser.add_argument('--partition-workers',
+                        type=int, default=0,
+                        help='Worker processes searching the --sub-n partitions concurrently, one explainer replica each (0: one after another).')
+    parser.add_argument('--partition-devices',
+                        type=str, default=None,
+                        help="Semicolon separated CUDA_VISIBLE_DEVICES of the partition workers, e.g. '0;1' or '0,1;2,3'.")
     parser.add_argument('--lambda1', 
                         type=float, default=1.,
                         help='')
@@ -72,35 +91,17 @@ def parse_args():
     args = parser.parse_args()
     return args
 
-def SubRegionDivision(image, mode="slico"):
-    element_sets_V = []
-    if mode == "slico":
-        slic = cv2.ximgproc.createSuperpixelSLIC(image, region_size=15, ruler = 40.0) 
-        slic.iterate(20)     # The number of iterations, the larger the better the effect
-        label_slic = slic.getLabels()        # Get superpixel label
-        number_slic = slic.getNumberOfSuperpixels()  # Get the number of superpixels
-
-        for i in range(number_slic):
-            img_copp = image.copy()
-            img_copp = img_copp * (label_slic == i)[:,:, np.newaxis]
-            element_sets_V.append(img_copp)
-    elif mode == "seeds":
-        seeds = cv2.ximgproc.createSuperpixelSEEDS(image.shape[1], image.shape[0], image.shape[2], num_superpixels=50, num_levels=3)
-        seeds.iterate(image,10)  # The input image size must be the same as the initialization shape and the number of iterations is 10
-        label_seeds = seeds.getLabels()
-        number_seeds = seeds.getNumberOfSuperpixels()
-
-        for i in range(number_seeds):
-            img_copp = image.copy()
-            img_copp = img_copp * (label_seeds == i)[:,:, np.newaxis]
-            element_sets_V.append(img_copp)
-    return element_sets_V
-
 def main(args):
     
-    smdl = FaceSubModularExplanation(
+    smdl_factory = functools.partial(FaceSubModularExplanation, 
         cfg_path=args.cfg, n=args.sub_n, k=args.sub_k, lambda1=args.lambda1, lambda2=args.lambda2, lambda3=args.lambda3, lambda4=args.lambda4)
     
+    partition_pool = None
+    if args.partition_workers > 0:
+        devices = None if args.partition_devices is None else args.partition_devices.split(";")
+        partition_pool = PartitionPool(smdl_factory, workers=args.partition_workers, devices=devices)
+    smdl = smdl_factory(partition_pool=partition_pool)
+    
     with open(args.eval_list, "r") as f:
         infos = f.read().split('\n')
     
@@ -113,23 +114,35 @@ def main(args):
     mkdir(save_npy_root_path)
     save_josn_root_path = os.path.join(save_dir, "json")
     mkdir(save_josn_root_path)
-    for info in tqdm(infos):
+    partition_cache = None
+    if args.partition_cache_dir is not None:
+        partition_cache = PartitionCache(args.partition_cache_dir)
+    
+    def read_image(info):
         id_people = info.split(" ")[-1]
-        # save_people_path = os.path.join(save_dir, id_people)
-        # mkdir(save_people_path)
         
         image_relative_path = info.split(" ")[0]
         
         if os.path.exists(
             os.path.join(save_josn_root_path, image_relative_path.replace(".jpg", ".json"))
         ):
-            continue
+            return None
         
         # Read original image
         image_path = os.path.join(args.Datasets, image_relative_path)
         image = cv2.imread(image_path)
+        return image
+    
+    # superpixels of the next images are computed while this one is explained / 预取后续图像的超像素
+    superpixel_service = SuperpixelService(workers=args.superpixel_workers, mode=args.superpixel_algorithm, region_size=15, ruler=40.0, cache=partition_cache)
+    
+    for info, image, element_sets_V in tqdm(superpixel_service.prefetch(infos, read_image, depth=args.superpixel_prefetch), total=len(infos)):
+        id_people = info.split(" ")[-1]
+        # save_people_path = os.path.join(save_dir, id_people)
+        # mkdir(save_people_path)
+        
+        image_relative_path = info.split(" ")[0]
         
-        element_sets_V = SubRegionDivision(image, mode=args.superpixel_algorithm)
         smdl.k = len(element_sets_V)
         
         submodular_image, submodular_image_set, saved_json_file = smdl(element_sets_V, int(id_people))
@@ -144,15 +157,17 @@ def main(args):
 
         # Save npy file
         mkdir(os.path.join(save_npy_root_path, id_people))
-        np.save(
+        save_element_set(
             os.path.join(save_npy_root_path, image_relative_path.replace(".jpg", ".npy")),
-            np.array(submodular_image_set)
+            submodular_image_set
         )
 
         # Save json file
         mkdir(os.path.join(save_josn_root_path, id_people))
         with open(os.path.join(save_josn_root_path, image_relative_path.replace(".jpg", ".json")), "w") as f:
             f.write(json.dumps(saved_json_file, ensure_ascii=False, indent=4, separators=(',', ':')))
+    
+    superpixel_service.close()
 
 
 if __name__ == "__main__":
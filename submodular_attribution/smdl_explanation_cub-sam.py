@@ -28,6 +28,8 @@ import time
 red_tr    = get_alpha_cmap('Reds')
 
 from models.submodular_cub_v2 import CubSubModularExplanationV2
+from models.partition_cache import PartitionCache, SAM_PARAMS
+from models.sam_pipeline import SamMaskStore
 
 def parse_args():
     parser = argparse.ArgumentParser(description='Submodular Explanation')
@@ -44,6 +46,12 @@ def parse_args():
                         type=str,
                         default="SAM_mask/CUB-resnet",
                         help="")
+    parser.add_argument('--partition-cache-dir',
+                        type=str, default=None,
+                        help='On-disk partition cache filled by SAM_mask_generate.py, looked up before --sam-mask-dir (default: off).')
+    parser.add_argument('--sam-store',
+                        type=str, default=None,
+                        help='Sharded mask store written by SAM_mask_generate.py --store shards, used instead of --sam-mask-dir (default: off).')
     parser.add_argument('--lambda1', 
                         type=float, default=1.,
                         help='')
@@ -79,12 +87,28 @@ def main(args):
     
     mkdir(save_dir)
     
+    partition_cache = None
+    if args.partition_cache_dir is not None:
+        partition_cache = PartitionCache(args.partition_cache_dir)
+    
+    sam_store = None
+    if args.sam_store is not None:
+        sam_store = SamMaskStore(args.sam_store)
+    
     for info in tqdm(infos[:]):
         id_people = info.split(" ")[-1]
         
         image_relative_path = info.split(" ")[0]
         
-        element_sets_V = np.load(os.path.join(args.sam_mask_dir, image_relative_path.replace(".jpg", ".npy")))
+        element_sets_V = None
+        if partition_cache is not None or sam_store is not None:
+            image = cv2.imread(os.path.join(args.Datasets, image_relative_path))
+        if partition_cache is not None:
+            element_sets_V = partition_cache.load(image, "sam", **SAM_PARAMS)
+        if element_sets_V is None and sam_store is not None:
+            element_sets_V = sam_store.load(image_relative_path, image)
+        if element_sets_V is None:
+            element_sets_V = load_element_set(os.path.join(args.sam_mask_dir, image_relative_path.replace(".jpg", ".npy")))
         smdl.k = len(element_sets_V)
 
         start = time.time()
@@ -104,9 +128,9 @@ def main(args):
         save_npy_root_path = os.path.join(save_dir, "npy")
         mkdir(save_npy_root_path)
         mkdir(os.path.join(save_npy_root_path, id_people))
-        np.save(
+        save_element_set(
             os.path.join(save_npy_root_path, image_relative_path.replace(".jpg", ".npy")),
-            np.array(submodular_image_set)
+            submodular_image_set
         )
 
         # Save json file
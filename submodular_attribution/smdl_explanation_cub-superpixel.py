@@ -28,6 +28,8 @@ import time
 red_tr    = get_alpha_cmap('Reds')
 
 from models.submodular_cub_v2 import CubSubModularExplanationV2
+from models.superpixel_service import SuperpixelService
+from models.partition_cache import PartitionCache
 
 def parse_args():
     parser = argparse.ArgumentParser(description='Submodular Explanation')
@@ -50,6 +52,15 @@ def parse_args():
                         default="slico",
                         choices=["slico", "seeds"],
                         help="")
+    parser.add_argument('--superpixel-workers',
+                        type=int, default=0,
+                        help='Worker processes computing the superpixels of the next images while the current one is explained (0: inline).')
+    parser.add_argument('--superpixel-prefetch',
+                        type=int, default=2,
+                        help='Images partitioned ahead of the one being explained.')
+    parser.add_argument('--partition-cache-dir',
+                        type=str, default=None,
+                        help='On-disk cache of superpixel label maps keyed by image content and partition parameters, shared across runs (default: off).')
     parser.add_argument('--sub-n', 
                         type=int, default=1,
                         help='')
@@ -78,30 +89,6 @@ def parse_args():
     args = parser.parse_args()
     return args
 
-def SubRegionDivision(image, mode="slico"):
-    element_sets_V = []
-    if mode == "slico":
-        slic = cv2.ximgproc.createSuperpixelSLIC(image, region_size=30, ruler = 20.0) 
-        slic.iterate(20)     #迭代次数，越大效果越好
-        label_slic = slic.getLabels()        #获取超像素标签
-        number_slic = slic.getNumberOfSuperpixels()  #获取超像素数目
-
-        for i in range(number_slic):
-            img_copp = image.copy()
-            img_copp = img_copp * (label_slic == i)[:,:, np.newaxis]
-            element_sets_V.append(img_copp)
-    elif mode == "seeds":
-        seeds = cv2.ximgproc.createSuperpixelSEEDS(image.shape[1], image.shape[0], image.shape[2], num_superpixels=50, num_levels=3)
-        seeds.iterate(image,10)  #输入图像大小必须与初始化形状相同，迭代次数为10
-        label_seeds = seeds.getLabels()
-        number_seeds = seeds.getNumberOfSuperpixels()
-
-        for i in range(number_seeds):
-            img_copp = image.copy()
-            img_copp = img_copp * (label_seeds == i)[:,:, np.newaxis]
-            element_sets_V.append(img_copp)
-    return element_sets_V
-
 def main(args):
     
     smdl = CubSubModularExplanationV2(cfg_path=args.cfg, k=args.sub_k, 
@@ -116,22 +103,34 @@ def main(args):
     
     mkdir(save_dir)
     
-    for info in tqdm(infos[:]):
+    partition_cache = None
+    if args.partition_cache_dir is not None:
+        partition_cache = PartitionCache(args.partition_cache_dir)
+    
+    def read_image(info):
         id_people = info.split(" ")[-1]
-        # save_people_path = os.path.join(save_dir, id_people)
-        # mkdir(save_people_path)
         
         image_relative_path = info.split(" ")[0]
         
-        # Ground Truth Label
-        # gt_label = int(id_people)
-        
         # Read original image
         image_path = os.path.join(args.Datasets, image_relative_path)
         image = cv2.imread(image_path)
         image = cv2.resize(image, (224, 224))
+        return image
+    
+    # superpixels of the next images are computed while this one is explained / 预取后续图像的超像素
+    superpixel_service = SuperpixelService(workers=args.superpixel_workers, mode=args.superpixel_algorithm, cache=partition_cache)
+    
+    for info, image, element_sets_V in tqdm(superpixel_service.prefetch(infos, read_image, depth=args.superpixel_prefetch), total=len(infos)):
+        id_people = info.split(" ")[-1]
+        # save_people_path = os.path.join(save_dir, id_people)
+        # mkdir(save_people_path)
+        
+        image_relative_path = info.split(" ")[0]
+        
+        # Ground Truth Label
+        # gt_label = int(id_people)
         
-        element_sets_V = SubRegionDivision(image, mode=args.superpixel_algorithm)
         smdl.k = len(element_sets_V)
 
         start = time.time()
@@ -151,9 +150,9 @@ def main(args):
         save_npy_root_path = os.path.join(save_dir, "npy")
         mkdir(save_npy_root_path)
         mkdir(os.path.join(save_npy_root_path, id_people))
-        np.save(
+        save_element_set(
             os.path.join(save_npy_root_path, image_relative_path.replace(".jpg", ".npy")),
-            np.array(submodular_image_set)
+            submodular_image_set
         )
 
         # Save json file
@@ -178,6 +177,8 @@ def main(args):
 
         # imageio.mimsave(os.path.join(save_gif_root_path, image_relative_path.replace(".jpg", ".gif")), 
         #                       frames, 'GIF', duration=0.0085)  
+    
+    superpixel_service.close()
 
 
 if __name__ == "__main__":
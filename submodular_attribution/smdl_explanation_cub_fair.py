@@ -8,6 +8,7 @@ V2 version
 """
 
 import argparse
+import functools
 
 import scipy
 import os
@@ -27,6 +28,8 @@ from utils import *
 red_tr    = get_alpha_cmap('Reds')
 
 from models.submodular_cub import CubSubModularExplanation
+from models.partition_pool import PartitionPool
+from models.grid_partition import pixel_partition, grid_partition, patch_partition
 
 def parse_args():
     parser = argparse.ArgumentParser(description='Submodular Explanation')
@@ -73,6 +76,12 @@ def parse_args():
     parser.add_argument('--sub-k', 
                         type=int, default=24,
                         help='')
+    parser.add_argument('--partition-workers',
+                        type=int, default=0,
+                        help='Worker processes searching the --sub-n partitions concurrently, one explainer replica each (0: one after another).')
+    parser.add_argument('--partition-devices',
+                        type=str, default=None,
+                        help="Semicolon separated CUDA_VISIBLE_DEVICES of the partition workers, e.g. '0;1' or '0,1;2,3'.")
     parser.add_argument('--lambda1', 
                         type=float, default=1.,
                         help='')
@@ -95,86 +104,16 @@ def parse_args():
     args = parser.parse_args()
     return args
 
-def Partition_image(image, explanation_mask, partition_number=112):
-
-    b,g,r = cv2.split(image)
-
-    explanation_mask_flatten = explanation_mask.flatten()
-    
-    index = np.argsort(-explanation_mask_flatten)
-    
-    pixels_per_partition = int(len(explanation_mask_flatten) / partition_number)
-    
-    components_image_list = []
-    components_index_list = []
-    for i in range(partition_number):
-        b_tmp = b.flatten()
-        g_tmp = g.flatten()
-        r_tmp = r.flatten()
-        
-        cp_index = np.zeros_like(b_tmp)
-        cp_index[index[i*pixels_per_partition: (i+1)*pixels_per_partition]] = 1
-        
-        b_tmp[index[ : i*pixels_per_partition]] = 0
-        g_tmp[index[ : i*pixels_per_partition]] = 0
-        r_tmp[index[ : i*pixels_per_partition]] = 0
-
-        b_tmp[index[(i+1)*pixels_per_partition :]] = 0
-        g_tmp[index[(i+1)*pixels_per_partition :]] = 0
-        r_tmp[index[(i+1)*pixels_per_partition :]] = 0
-
-        b_tmp = b_tmp.reshape((image.shape[0], image.shape[1]))
-        g_tmp = g_tmp.reshape((image.shape[0], image.shape[1]))
-        r_tmp = r_tmp.reshape((image.shape[0], image.shape[1]))
-        cp_index = cp_index.reshape((image.shape[0], image.shape[1]))
-        
-        img_tmp = cv2.merge([b_tmp, g_tmp, r_tmp])
-        components_image_list.append(img_tmp)
-        components_index_list.append(cp_index)
-    return components_image_list#, components_index_list
-
-def partition_by_mulit_grad(image, explanation_mask, grad_size = 28, grad_num_per_set = 8):
-    """
-    Divide the image into grad_size x grad_size areas, divide according to eplanation_mask, each division has grad_num_per_set grads.
-    """
-    partition_number = int(grad_size * grad_size / grad_num_per_set)
-    # pixel_length_per_grad = int(image.shape[0] / grad_size)
-
-    components_image_list = []
-    pool_z = cv2.resize(explanation_mask, (grad_size, grad_size))
-
-    pool_z_flatten = pool_z.flatten()
-    index = np.argsort(- pool_z_flatten)     # From high to low
-
-    for i in range(partition_number):
-        binary_mask = np.zeros_like(index)
-        binary_mask[index[i*grad_num_per_set : (i+1)*grad_num_per_set]] = 1
-        binary_mask = binary_mask.reshape((grad_size, grad_size, 1))
-        binary_mask = cv2.resize(
-            binary_mask, (image.shape[0],image.shape[1]), interpolation=cv2.INTER_NEAREST)
-
-        components_image_list.append(
-            (image * binary_mask[:, :, np.newaxis]).astype(np.uint8)
-        )
-        
-    return components_image_list
-
-def Partition_by_patch(image, partition_size=10):
-    pixel_length = int(image.shape[0] / partition_size)
-    
-    components_image_list = []
-    for i in range(partition_size):
-        for j in range(partition_size):
-            image_tmp = np.zeros_like(image)
-            image_tmp[i*pixel_length : (i+1)*pixel_length, j*pixel_length : (j+1)*pixel_length] = image[i*pixel_length : (i+1)*pixel_length, j*pixel_length : (j+1)*pixel_length]
-            
-            components_image_list.append(image_tmp)
-    return components_image_list
-
 def main(args):
     
-    smdl = CubSubModularExplanation(cfg_path=args.cfg, n=args.sub_n, k=args.sub_k, 
-                                    lambda1=args.lambda1, lambda2=args.lambda2, lambda3=args.lambda3, lambda4=args.lambda4)
+    smdl_factory = functools.partial(CubSubModularExplanation, cfg_path=args.cfg, n=args.sub_n, k=args.sub_k, 
+                                     lambda1=args.lambda1, lambda2=args.lambda2, lambda3=args.lambda3, lambda4=args.lambda4)
+    
+    partition_pool = None
+    if args.partition_workers > 0:
+        devices = None if args.partition_devices is None else args.partition_devices.split(";")
+        partition_pool = PartitionPool(smdl_factory, workers=args.partition_workers, devices=devices)
+    smdl = smdl_factory(partition_pool=partition_pool)
     
     with open(args.eval_list, "r") as f:
         infos = f.read().split('\n')
@@ -212,14 +151,14 @@ def main(args):
         image = cv2.resize(image, (224, 224))
         
         if args.random_patch:
-            components_image_list = Partition_by_patch(image, args.random_patch_number)
+            element_sets_V = patch_partition([image], args.random_patch_number)[0]
         else:
             if args.partition == "pixel":
-                components_image_list = Partition_image(image, mask, args.pixel_partition_number)
+                element_sets_V = pixel_partition([image], [mask], args.pixel_partition_number)[0]
             elif args.partition == "grad":
-                components_image_list = partition_by_mulit_grad(image, mask, args.grad_partition_size, args.grad_number_per_set)
+                element_sets_V = grid_partition([image], [mask], args.grad_partition_size, args.grad_number_per_set)[0]
 
-        submodular_image, submodular_image_set, saved_json_file = smdl(components_image_list, int(id_people))
+        submodular_image, submodular_image_set, saved_json_file = smdl(element_sets_V, int(id_people))
         
         # Save the final image
         save_image_root_path = os.path.join(save_dir, "image-{}".format(args.sub_k))
@@ -26,6 +26,8 @@ from utils import *
 red_tr    = get_alpha_cmap('Reds')
 
 from models.submodular_face import FaceSubModularExplanation
+from models.superpixel_service import SuperpixelService
+from models.partition_cache import PartitionCache
 
 def parse_args():
     parser = argparse.ArgumentParser(description='Submodular Explanation')
@@ -43,6 +45,15 @@ def parse_args():
                         default="slico",
                         choices=["slico", "seeds"],
                         help="")
+    parser.add_argument('--superpixel-workers',
+                        type=int, default=0,
+                        help='Worker processes computing the superpixels of the next images while the current one is explained (0: inline).')
+    parser.add_argument('--superpixel-prefetch',
+                        type=int, default=2,
+                        help='Images partitioned ahead of the one being explained.')
+    parser.add_argument('--partition-cache-dir',
+                        type=str, default=None,
+                        help='On-disk cache of superpixel label maps keyed by image content and partition parameters, shared across runs (default: off).')
     parser.add_argument('--sub-n', 
                         type=int, default=1,
                         help='')
@@ -84,18 +95,30 @@ def main(args):
     save_dir = os.path.join(args.save_dir, "superpixel-{}-{}-{}-{}-{}".format(args.superpixel_algorithm, args.lambda1, args.lambda2, args.lambda3, args.lambda4))
     mkdir(save_dir)
     
-    for info in tqdm(infos):
+    partition_cache = None
+    if args.partition_cache_dir is not None:
+        partition_cache = PartitionCache(args.partition_cache_dir)
+    
+    def read_image(info):
         id_people = info.split(" ")[-1]
-        # save_people_path = os.path.join(save_dir, id_people)
-        # mkdir(save_people_path)
         
         image_relative_path = info.split(" ")[0]
         
         # Read original image
         image_path = os.path.join(args.Datasets, image_relative_path)
         image = cv2.imread(image_path)
+        return image
+    
+    # superpixels of the next images are computed while this one is explained / 预取后续图像的超像素
+    superpixel_service = SuperpixelService(workers=args.superpixel_workers, mode=args.superpixel_algorithm, cache=partition_cache)
+    
+    for info, image, element_sets_V in tqdm(superpixel_service.prefetch(infos, read_image, depth=args.superpixel_prefetch), total=len(infos)):
+        id_people = info.split(" ")[-1]
+        # save_people_path = os.path.join(save_dir, id_people)
+        # mkdir(save_people_path)
+        
+        image_relative_path = info.split(" ")[0]
         
-        element_sets_V = SubRegionDivision(image, mode=args.superpixel_algorithm)
         smdl.k = len(element_sets_V)
         
         submodular_image, submodular_image_set, saved_json_file = smdl(element_sets_V, int(id_people))
@@ -112,9 +135,9 @@ def main(args):
         save_npy_root_path = os.path.join(save_dir, "npy")
         mkdir(save_npy_root_path)
         mkdir(os.path.join(save_npy_root_path, id_people))
-        np.save(
+        save_element_set(
             os.path.join(save_npy_root_path, image_relative_path.replace(".jpg", ".npy")),
-            np.array(submodular_image_set)
+            submodular_image_set
         )
 
         # Save json file
@@ -123,6 +146,8 @@ def main(args):
         mkdir(os.path.join(save_josn_root_path, id_people))
         with open(os.path.join(save_josn_root_path, image_relative_path.replace(".jpg", ".json")), "w") as f:
             f.write(json.dumps(saved_json_file, ensure_ascii=False, indent=4, separators=(',', ':')))
+    
+    superpixel_service.close()
 
 
 if __name__ == "__main__":
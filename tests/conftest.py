@@ -0,0 +1,74 @@
+import os
+import sys
+
+import numpy as np
+import pytest
+import torch
+from PIL import Image
+from torchvision import transforms
+
+# the tests import the repo modules like the drivers do / 与驱动脚本相同的导入方式
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils import SubRegionDivision
+
+tiny_transform = transforms.Compose([
+    transforms.Resize((16, 16)),
+    transforms.ToTensor()])
+
+def preprocess(image):
+    return tiny_transform(Image.fromarray(image))
+
+class ToyModel(torch.nn.Module):
+    """
+    Conv + linear stand-in of a vision encoder, 16x16 inputs, fixed weights
+    """
+    def __init__(self, output_dim = 8):
+        super(ToyModel, self).__init__()
+        torch.manual_seed(0)
+        self.conv = torch.nn.Conv2d(3, 4, 3)
+        self.linear = torch.nn.Linear(4 * 14 * 14, output_dim)
+
+    def forward(self, x):
+        return self.linear(self.conv(x).flatten(1))
+
+def random_image(seed, size = 48):
+    return (np.random.RandomState(seed).rand(size, size, 3) * 255).astype(np.uint8)
+
+def selection_order(result, element_set):
+    """
+    Element indexes of the images returned by an engine, in selection order
+    """
+    elements = [element_set.element(i) for i in range(len(element_set))]
+    return [next(i for i, element in enumerate(elements) if np.array_equal(image, element))
+            for image in result[1]]
+
+def curve_keys(saved_json_file):
+    return [key for key, value in saved_json_file.items() if isinstance(value, list)]
+
+def assert_same_explanation(result, reference, atol = 1e-5):
+    """
+    Same selected images and the same curves, up to `atol`
+    """
+    np.testing.assert_array_equal(np.asarray(result[1]), np.asarray(reference[1]))
+    assert curve_keys(result[2]) == curve_keys(reference[2])
+    for key in curve_keys(reference[2]):
+        assert len(result[2][key]) == len(reference[2][key]), key
+        np.testing.assert_allclose(result[2][key], reference[2][key], rtol=0, atol=atol, err_msg=key)
+
+@pytest.fixture
+def model():
+    return ToyModel()
+
+@pytest.fixture
+def semantic_feature():
+    torch.manual_seed(1)
+    return torch.randn(4, 8)
+
+@pytest.fixture(scope="session")
+def element_set():
+    return SubRegionDivision(random_image(0), region_size=12)
+
+@pytest.fixture(scope="session")
+def other_element_set():
+    return SubRegionDivision(random_image(1), region_size=16)
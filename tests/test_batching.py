@@ -0,0 +1,79 @@
+import torch
+
+from conftest import ToyModel
+from models.micro_batch import ForwardBatcher
+from models.pipeline import PendingBatch, PipelinedExecutor, concat_batches
+from models.score_trace import ScoreTrace
+
+def toy_batch(size = 11):
+    torch.manual_seed(2)
+    return torch.rand(size, 3, 16, 16)
+
+class OutOfMemoryAbove(torch.nn.Module):
+    """
+    The toy model, failing like CUDA on batches larger than `limit`
+    """
+    def __init__(self, limit):
+        super(OutOfMemoryAbove, self).__init__()
+        self.model = ToyModel()
+        self.limit = limit
+        self.batch_sizes = []
+
+    def forward(self, x):
+        self.batch_sizes.append(len(x))
+        if len(x) > self.limit:
+            raise RuntimeError("CUDA out of memory. Tried to allocate")
+        return self.model(x)
+
+def test_forward_batcher_matches_full_forward():
+    model = ToyModel()
+    batch = toy_batch()
+    with torch.no_grad():
+        expected = model(batch)
+        for batcher in [ForwardBatcher(batch_size=4), ForwardBatcher(memory_budget=10 ** 5)]:
+            assert torch.allclose(batcher(model, batch), expected, atol=1e-6)
+
+def test_forward_batcher_halves_on_out_of_memory():
+    model = OutOfMemoryAbove(limit=3)
+    batch = toy_batch()
+    batcher = ForwardBatcher(batch_size=8)
+    with torch.no_grad():
+        outputs = batcher(model, batch)
+        assert torch.allclose(outputs, model.model(batch), atol=1e-6)
+    # the smaller size is kept for the next batches
+    assert batcher.batch_size == 2
+    assert max(model.batch_sizes[-3:]) <= 3
+
+def test_score_trace_grows_and_reads_back():
+    trace = ScoreTrace(["a", "b"], capacity=2, device="cpu")
+    for i in range(5):
+        trace.append("a", torch.tensor(float(i)))
+    lengths = dict(trace.lengths)
+    trace.append("b", 7.0)
+    trace.record({"a": torch.tensor([10., 11.])}, 1)
+
+    assert len(trace) == 6
+    assert trace.last(["a", "b"]) == [11.0, 7.0]
+    assert trace.since(lengths) == {"a": [11.0], "b": [7.0]}
+    assert trace.to_dict() == {"a": [0.0, 1.0, 2.0, 3.0, 4.0, 11.0], "b": [7.0]}
+
+def test_pipelined_executor_forwards_the_whole_batch():
+    model = ToyModel()
+    batch = toy_batch()
+    executor = PipelinedExecutor(workers=2, chunk_size=3, device="cpu")
+    forwarded = []
+
+    def forward(images):
+        forwarded.append(len(images))
+        return model(images)
+
+    with torch.no_grad():
+        pending = executor.submit(lambda requests: batch[requests], list(range(len(batch))))
+        assert isinstance(pending, PendingBatch) and pending.sizes == [3, 3, 3, 2]
+        packed = concat_batches([pending, batch[:2]])
+        outputs = executor.consume(packed, forward)
+
+        assert torch.allclose(outputs, model(torch.cat([batch, batch[:2]])), atol=1e-6)
+    # one forward over every chunk, the ForwardBatcher splits it
+    assert forwarded == [len(batch) + 2]
+    assert set(executor.timing()) == {"compose", "forward", "wait", "overlap"}
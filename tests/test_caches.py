@@ -0,0 +1,90 @@
+import numpy as np
+import pytest
+import torch
+
+from conftest import random_image
+from models.element_set import ElementSet
+from models.feature_cache import ElementFeatureCache
+from models.partition_cache import PartitionCache
+from models.subset_cache import SubsetCache, is_element_sum
+from utils import SubRegionDivision
+
+def test_subset_cache_keys():
+    cache = SubsetCache(5)
+    assert cache.key([0, 2]) == cache.key([2, 0])
+    assert cache.key([0, 2]) != cache.key([0, 2], reverse=True)
+    assert cache.key([0, 2], reverse=True) != cache.key([1, 3, 4])
+
+    alias = SubsetCache(5, complement_alias=True)
+    assert alias.key([0, 2], reverse=True) == alias.key([1, 3, 4])
+
+def test_is_element_sum(element_set):
+    assert is_element_sum(element_set.sum(0), element_set)
+    image = element_set.sum(0).copy()
+    image[0, 0] += 1
+    assert not is_element_sum(image, element_set)
+    # unassigned pixels are not in the sum of the elements
+    labels = element_set.labels.copy()
+    labels[0, 0] = -1
+    assert not is_element_sum(element_set.image, ElementSet(element_set.image, labels, num_elements=len(element_set)))
+
+def test_subset_cache_serves_repeated_requests():
+    cache = SubsetCache(4)
+    composed = []
+
+    def compose(requests):
+        composed.extend(requests)
+        return requests
+
+    def forward(requests):
+        return torch.tensor([[float(sum(subset)), float(reverse)] for subset, reverse in requests])
+
+    first = cache.fetch([([0, 1], False), ([2], True), ([1, 0], False)], compose, forward)
+    second = cache.fetch([([2], True), ([3], False)], compose, forward)
+
+    assert composed == [([0, 1], False), ([2], True), ([3], False)]
+    assert torch.equal(first, torch.tensor([[1., 0.], [2., 1.], [1., 0.]]))
+    assert torch.equal(second, torch.tensor([[2., 1.], [3., 0.]]))
+    assert (cache.hits, cache.misses) == (2, 3)
+
+def test_subset_cache_memory_budget():
+    cache = SubsetCache(8, memory_budget=3 * 16)   # three rows of 4 float32
+    for i in range(5):
+        cache.put(cache.key([i]), torch.full((4,), float(i)))
+        cache.get(cache.key([0]))                   # the first entry stays recently used
+
+    assert len(cache) == 3
+    assert cache.memory <= cache.memory_budget
+    assert cache.get(cache.key([0])) is not None
+    assert cache.get(cache.key([1])) is None
+
+def test_partition_cache_round_trip(tmp_path):
+    cache = PartitionCache(str(tmp_path))
+    image = random_image(2)
+
+    first = SubRegionDivision(image, region_size=12, cache=cache)
+    second = SubRegionDivision(image, region_size=12, cache=cache)
+
+    assert (cache.misses, cache.hits) == (1, 1)
+    assert second.labels.dtype == np.int8
+    np.testing.assert_array_equal(second.labels, first.labels)
+    np.testing.assert_array_equal(np.array(second), np.array(first))
+    # other parameters are other entries
+    assert cache.load(image, "slico", region_size=16, ruler=20.0) is None
+
+@pytest.mark.parametrize("on_disk", [False, True])
+def test_feature_cache_round_trip(element_set, tmp_path, on_disk):
+    cache = ElementFeatureCache(str(tmp_path) if on_disk else None, model_id="toy")
+    features = np.random.RandomState(0).rand(len(element_set), 8).astype(np.float32)
+
+    assert cache.load(element_set) is None
+    cache.save(element_set, features=features)
+    np.testing.assert_array_equal(cache.load(element_set)["features"], features)
+    assert (cache.misses, cache.hits) == (1, 1)
+
+def test_feature_cache_is_keyed_by_model(element_set, tmp_path):
+    ElementFeatureCache(str(tmp_path), model_id="toy").save(element_set, features=np.zeros(3))
+    assert ElementFeatureCache(str(tmp_path), model_id="other").load(element_set) is None
+    # the same partition stored in a narrower dtype is the same entry
+    narrow = ElementSet(element_set.image, element_set.labels.astype(np.int8), num_elements=len(element_set))
+    assert ElementFeatureCache(str(tmp_path), model_id="toy").load(narrow) is not None
@@ -0,0 +1,94 @@
+import numpy as np
+import pytest
+import torch
+
+from conftest import preprocess
+from models.composition import ElementSetComposer, LinearComposer, SubsetComposer, build_composer
+from models.element_set import ElementSet
+from models.prefix_cache import PrefixCache
+
+def test_elements_match_dense_stack(element_set):
+    dense = np.array(element_set)
+
+    assert dense.shape == (len(element_set),) + element_set.image.shape
+    for i in range(len(element_set)):
+        np.testing.assert_array_equal(element_set[i], dense[i])
+    np.testing.assert_array_equal(element_set.sum(0), dense.sum(0).astype(np.uint8))
+    np.testing.assert_array_equal(element_set[-1], dense[-1])
+
+def test_indexing_matches_dense_stack(element_set):
+    dense = np.array(element_set)
+
+    for indexes in [[3, 0, 5], slice(2, 9, 3), [4, 1, 4, 4]]:
+        np.testing.assert_array_equal(np.array(element_set[indexes]), dense[indexes])
+    with pytest.raises(IndexError):
+        element_set[len(element_set)]
+
+def test_reorder_rejects_repeated_elements(element_set):
+    reordered = element_set.reorder([2, 0, 1])
+    np.testing.assert_array_equal(np.array(reordered), np.array(element_set)[[2, 0, 1]])
+    with pytest.raises(ValueError):
+        element_set.reorder([1, 1])
+
+def test_from_dense_round_trip(element_set):
+    rebuilt = ElementSet.from_dense(np.array(element_set))
+    np.testing.assert_array_equal(np.array(rebuilt), np.array(element_set))
+
+def test_save_load_round_trip(element_set, tmp_path):
+    path = str(tmp_path / "element_set.npz")
+    element_set.save(path)
+    loaded = ElementSet.load(path)
+
+    assert len(loaded) == len(element_set)
+    np.testing.assert_array_equal(np.array(loaded), np.array(element_set))
+
+@pytest.mark.parametrize("sub_index_set", [[], [4], [0, 7, 2], list(range(10))])
+def test_composers_match_dense_sum(element_set, sub_index_set):
+    dense = np.array(element_set)
+    expected = dense[sub_index_set].sum(0).astype(np.uint8)
+
+    for composer in [ElementSetComposer(element_set), SubsetComposer(dense)]:
+        np.testing.assert_array_equal(composer.merge(sub_index_set), expected)
+        if len(sub_index_set) > 0:
+            np.testing.assert_array_equal(
+                composer.compose_reverse(sub_index_set[:-1], sub_index_set[-1]),
+                composer.org_img - expected)
+    assert isinstance(build_composer(element_set), ElementSetComposer)
+    assert isinstance(build_composer(dense), SubsetComposer)
+
+def test_linear_composer_approximates_preprocessing(element_set):
+    composer = LinearComposer(element_set, preprocess, device="cpu")
+    sub_index_sets = [[0, 3], [5], list(range(len(element_set)))]
+    batch = composer.merge(sub_index_sets)
+
+    dense = np.array(element_set)
+    for row, sub_index_set in zip(batch, sub_index_sets):
+        expected = preprocess(dense[sub_index_set].sum(0).astype(np.uint8))
+        assert torch.allclose(row, expected, atol=0.05)
+
+class SumCache(PrefixCache):
+    """
+    Running sums of integers, counting the full rebuilds
+    """
+    def __init__(self, cache_size = 4):
+        super(SumCache, self).__init__(cache_size)
+        self.unions = 0
+
+    def extend(self, running, index):
+        return running + index
+
+    def union(self, index_set):
+        self.unions += 1
+        return sum(index_set)
+
+def test_prefix_cache_extends_growing_base_sets():
+    cache = SumCache(cache_size=2)
+    order = [5, 2, 9, 7]
+    for step in range(len(order) + 1):
+        assert cache.running_sum(order[:step]) == sum(order[:step])
+
+    # only the empty base set is built from scratch
+    assert cache.unions == 1
+    assert cache.running_sum([9, 7]) == 16
+    assert cache.unions == 2
+    assert len(cache.running_sums) <= 2
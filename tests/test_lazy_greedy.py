@@ -0,0 +1,48 @@
+import numpy as np
+import pytest
+
+from conftest import assert_same_explanation, preprocess, ToyModel
+from models.lazy_greedy import LazyGreedy
+from models.submodular_single_modal import BlackBoxSingleModalSubModularExplanation
+from models.submodular_vit_torch import MultiModalSubModularExplanation
+
+def coverage_sets(seed = 0, num_sets = 12, universe = 40):
+    random = np.random.RandomState(seed)
+    return [set(random.choice(universe, random.randint(2, 10), replace=False)) for _ in range(num_sets)]
+
+def coverage_evaluate(sets, selected):
+    def evaluate(candidates):
+        covered = set().union(*[sets[i] for i in selected])
+        return {"smdl_score": np.array([len(covered | sets[c]) for c in candidates], dtype=float)}
+    return evaluate
+
+@pytest.mark.parametrize("batch_size", [1, 3])
+def test_lazy_greedy_matches_greedy_on_coverage(batch_size):
+    # set coverage is submodular, stale gains are exact upper bounds
+    sets = coverage_sets()
+    lazy = LazyGreedy(batch_size=batch_size)
+    selected = []
+    greedy = []
+    for _ in range(len(sets)):
+        candidates = [i for i in range(len(sets)) if i not in selected]
+        chosen, _ = lazy.select(candidates, coverage_evaluate(sets, selected))
+        selected.append(chosen)
+
+        scores = coverage_evaluate(sets, greedy)(
+            [i for i in range(len(sets)) if i not in greedy])["smdl_score"]
+        greedy.append([i for i in range(len(sets)) if i not in greedy][int(np.argmax(scores))])
+
+    covered = lambda order, j: len(set().union(*[sets[i] for i in order[:j]]))
+    assert [covered(selected, j) for j in range(len(sets) + 1)] == [covered(greedy, j) for j in range(len(sets) + 1)]
+    assert lazy.evaluated < lazy.full_greedy
+
+@pytest.mark.parametrize("engine", [MultiModalSubModularExplanation, BlackBoxSingleModalSubModularExplanation])
+def test_full_batch_lazy_greedy_matches_greedy(engine, semantic_feature, element_set):
+    # a batch as large as the candidate set re-scores every stale entry
+    if engine is MultiModalSubModularExplanation:
+        args = (ToyModel(), semantic_feature, preprocess)
+    else:
+        args = (ToyModel(), preprocess)
+    reference = engine(*args, device="cpu", k=8)(element_set, 1)
+    result = engine(*args, device="cpu", k=8, lazy_greedy=True, lazy_batch_size=len(element_set))(element_set, 1)
+    assert_same_explanation(result, reference)
@@ -0,0 +1,154 @@
+import numpy as np
+import pytest
+
+from conftest import assert_same_explanation, preprocess, selection_order, ToyModel
+from models.feature_cache import ElementFeatureCache
+from models.submodular_vit_efficient import (
+    MultiModalSubModularExplanationEfficientV1,
+    MultiModalSubModularExplanationEfficientV2,
+    MultiModalSubModularExplanationHierarchical,
+    MultiModalSubModularExplanationStochasticGreedy)
+from models.submodular_vit_torch import MultiModalSubModularExplanation
+from utils import SubRegionDivision
+
+# engine, k (None: every element)
+ENGINES = [
+    (MultiModalSubModularExplanation, 8),
+    (MultiModalSubModularExplanationEfficientV1, None),
+    (MultiModalSubModularExplanationEfficientV2, None),
+    (MultiModalSubModularExplanationStochasticGreedy, None),
+]
+ENGINE_IDS = [engine.__name__ for engine, _ in ENGINES]
+
+# options that must not change the explanation
+OPTIONS = {
+    "subset_cache": lambda: dict(subset_cache_memory=2 ** 27),
+    "forward_batch_size": lambda: dict(forward_batch_size=5),
+    "forward_memory_budget": lambda: dict(forward_memory_budget=10 ** 5),
+    "feature_cache": lambda: dict(feature_cache=ElementFeatureCache(None)),
+    "pipeline": lambda: dict(pipeline_workers=2, pipeline_chunk_size=4),
+}
+
+def explain(engine, semantic_feature, element_set, k, target = 1, **kwargs):
+    smdl = engine(ToyModel(), semantic_feature, preprocess, device="cpu",
+                  k=len(element_set) if k is None else k, **kwargs)
+    return smdl(element_set, target)
+
+def always_forward(engine):
+    """
+    The engine with every score term forwarded whatever the lambdas
+    """
+    return type("AlwaysForward" + engine.__name__, (engine,), {
+        "score_plan": property(lambda self: {"effectiveness": True, "consistency": True, "collaboration": True})})
+
+@pytest.mark.parametrize("engine, k", ENGINES, ids=ENGINE_IDS)
+@pytest.mark.parametrize("option", sorted(OPTIONS))
+def test_option_keeps_explanation(engine, k, option, semantic_feature, element_set):
+    reference = explain(engine, semantic_feature, element_set, k)
+    result = explain(engine, semantic_feature, element_set, k, **OPTIONS[option]())
+    assert_same_explanation(result, reference)
+
+@pytest.mark.parametrize("engine, k", ENGINES, ids=ENGINE_IDS)
+def test_element_set_matches_dense_stack(engine, k, semantic_feature, element_set):
+    reference = explain(engine, semantic_feature, np.array(element_set), k)
+    result = explain(engine, semantic_feature, element_set, k)
+    assert_same_explanation(result, reference, atol=0)
+
+@pytest.mark.parametrize("engine, k", ENGINES, ids=ENGINE_IDS)
+def test_linear_composition_keeps_order(engine, k, semantic_feature, element_set):
+    # PIL resizing is not exactly affine, the curves only match closely
+    reference = explain(engine, semantic_feature, element_set, k)
+    result = explain(engine, semantic_feature, element_set, k, linear_composition=True)
+    assert_same_explanation(result, reference, atol=1e-3)
+
+@pytest.mark.parametrize("engine, k", ENGINES, ids=ENGINE_IDS)
+@pytest.mark.parametrize("lambdas", [(1, 1, 1, 0), (1, 0, 1, 1), (0, 1, 0, 1)])
+def test_skipped_forwards_keep_explanation(engine, k, lambdas, semantic_feature, element_set):
+    lambda1, lambda2, lambda3, lambda4 = lambdas
+    kwargs = dict(lambda1=lambda1, lambda2=lambda2, lambda3=lambda3, lambda4=lambda4)
+    reference = explain(always_forward(engine), semantic_feature, element_set, k, **kwargs)
+    result = explain(engine, semantic_feature, element_set, k, **kwargs)
+    if lambda2 == 0:
+        # the effectiveness term is not computed at all, its curve stays zero
+        for saved_json_file in [result[2], reference[2]]:
+            for key in ["effectiveness_score", "effectiveness_score_increase", "effectiveness_score_decrease"]:
+                saved_json_file.pop(key, None)
+    assert_same_explanation(result, reference)
+
+@pytest.mark.parametrize("engine, k", ENGINES, ids=ENGINE_IDS)
+def test_explain_steps_matches_call(engine, k, semantic_feature, element_set):
+    smdl = engine(ToyModel(), semantic_feature, preprocess, device="cpu", k=k or len(element_set))
+    stream = smdl.explain_steps(element_set, 1)
+    steps = []
+    with pytest.raises(StopIteration) as stop:
+        while True:
+            steps.append(next(stream))
+    result = stop.value.value
+
+    assert_same_explanation(result, explain(engine, semantic_feature, element_set, k), atol=0)
+    assert [step["step"] for step in steps] == list(range(len(steps)))
+    curve = result[2][engine.insertion_curve_key]
+    np.testing.assert_allclose(steps[-1]["insertion_curve"], curve[:len(steps[-1]["insertion_curve"])])
+
+@pytest.mark.parametrize("engine, k", ENGINES, ids=ENGINE_IDS)
+def test_lambda_grid_matches_separate_runs(engine, k, semantic_feature, element_set):
+    grid = [(1, 1, 1, 1), (0, 1, 1, 0), (1, 0, 1, 1)]
+    smdl = engine(ToyModel(), semantic_feature, preprocess, device="cpu", k=k or len(element_set))
+    results = smdl.explain_lambda_grid(element_set, 1, grid)
+
+    assert len(results) == len(grid)
+    for result, (lambda1, lambda2, lambda3, lambda4) in zip(results, grid):
+        reference = explain(engine, semantic_feature, element_set, k,
+                            lambda1=lambda1, lambda2=lambda2, lambda3=lambda3, lambda4=lambda4)
+        assert_same_explanation(result, reference)
+
+def test_explain_batch_matches_separate_runs(semantic_feature, element_set, other_element_set):
+    engine = MultiModalSubModularExplanationEfficientV2
+    smdl = engine(ToyModel(), semantic_feature, preprocess, device="cpu")
+    results = smdl.explain_batch([element_set, other_element_set], [1, 2],
+                                 ks=[len(element_set), len(other_element_set)])
+
+    assert_same_explanation(results[0], explain(engine, semantic_feature, element_set, None, target=1))
+    assert_same_explanation(results[1], explain(engine, semantic_feature, other_element_set, None, target=2))
+
+@pytest.mark.parametrize("engine", [MultiModalSubModularExplanation, MultiModalSubModularExplanationEfficientV2])
+def test_partitioned_greedy(engine, semantic_feature, element_set):
+    # each partition keeps ceil(k / n) of its elements, fewer than it has
+    result = explain(engine, semantic_feature, element_set, 8, n=2)
+    order = selection_order(result, element_set)
+
+    assert len(order) == 8
+    assert len(set(order)) == len(order)
+    assert result[2]["sub-n"] == 2
+    for key in ["consistency_score", "collaboration_score"]:
+        assert len(result[2][key]) == len(order)
+
+# V1 may pick one element on both sides of a step, its ordering is not a permutation
+@pytest.mark.parametrize("engine", [
+    MultiModalSubModularExplanation,
+    MultiModalSubModularExplanationEfficientV2,
+    MultiModalSubModularExplanationStochasticGreedy])
+@pytest.mark.parametrize("early_stop", [dict(early_stop_epsilon=0.5), dict(early_stop_min_gain=10.0, early_stop_patience=1)])
+def test_early_stop_curves_cover_the_ordering(engine, early_stop, semantic_feature, element_set):
+    smdl = engine(ToyModel(), semantic_feature, preprocess, device="cpu", k=len(element_set), **early_stop)
+    result = smdl(element_set, 1)
+    order = selection_order(result, element_set)
+
+    assert len(order) == len(element_set)
+    assert len(result[2]["consistency_score"]) == len(order)
+    assert len(result[2]["collaboration_score"]) == len(order)
+    # the saved insertion curve is the score of every prefix of the ordering
+    prefix_scores = smdl.run_steps(smdl.prefix_scores_steps(np.array(order)))
+    np.testing.assert_allclose(result[2]["consistency_score"], prefix_scores["consistency_score"].numpy(), atol=1e-5)
+
+def test_hierarchical_orders_every_element(semantic_feature, element_set):
+    smdl = MultiModalSubModularExplanationHierarchical(
+        ToyModel(), semantic_feature, preprocess, device="cpu", k=len(element_set),
+        coarse_division=lambda image: SubRegionDivision(image, region_size=24), top_groups=2)
+    result = smdl(element_set, 1)
+    order = selection_order(result, element_set)
+
+    assert sorted(order) == list(range(len(element_set)))
+    assert len(result[2]["consistency_score"]) == len(order)
+    prefix_scores = smdl.run_steps(smdl.prefix_scores_steps(np.array(order)))
+    np.testing.assert_allclose(result[2]["consistency_score"], prefix_scores["consistency_score"].numpy(), atol=1e-5)
@@ -0,0 +1,78 @@
+import cv2
+import numpy as np
+import pytest
+
+from conftest import random_image
+from models.grid_partition import grid_partition, patch_partition, pixel_partition
+from models.superpixel_service import SuperpixelService
+from utils import SubRegionDivision
+
+# the original per-element loops of the CUB / CelebA / VGGFace2 drivers
+
+def loop_pixel_partition(image, explanation_mask, partition_number):
+    index = np.argsort(-explanation_mask.flatten())
+    pixels_per_partition = int(explanation_mask.size / partition_number)
+    components_image_list = []
+    for i in range(partition_number):
+        keep = np.zeros(explanation_mask.size, dtype=bool)
+        keep[index[i * pixels_per_partition : (i + 1) * pixels_per_partition]] = True
+        components_image_list.append(image * keep.reshape(explanation_mask.shape)[:, :, np.newaxis])
+    return components_image_list
+
+def loop_grid_partition(image, explanation_mask, grad_size, grad_num_per_set):
+    partition_number = int(grad_size * grad_size / grad_num_per_set)
+    index = np.argsort(-cv2.resize(explanation_mask, (grad_size, grad_size)).flatten())
+    components_image_list = []
+    for i in range(partition_number):
+        binary_mask = np.zeros_like(index)
+        binary_mask[index[i * grad_num_per_set : (i + 1) * grad_num_per_set]] = 1
+        binary_mask = cv2.resize(
+            binary_mask.reshape((grad_size, grad_size, 1)), (image.shape[0], image.shape[1]), interpolation=cv2.INTER_NEAREST)
+        components_image_list.append((image * binary_mask[:, :, np.newaxis]).astype(np.uint8))
+    return components_image_list
+
+def loop_patch_partition(image, partition_size):
+    pixel_length = int(image.shape[0] / partition_size)
+    components_image_list = []
+    for i in range(partition_size):
+        for j in range(partition_size):
+            image_tmp = np.zeros_like(image)
+            rows = slice(i * pixel_length, (i + 1) * pixel_length)
+            columns = slice(j * pixel_length, (j + 1) * pixel_length)
+            image_tmp[rows, columns] = image[rows, columns]
+            components_image_list.append(image_tmp)
+    return components_image_list
+
+@pytest.fixture
+def batch():
+    images = [random_image(seed, size=56) for seed in range(3)]
+    priors = [np.random.RandomState(seed).rand(56, 56).astype(np.float32) for seed in range(3)]
+    return images, priors
+
+def test_pixel_partition_matches_loop(batch):
+    images, priors = batch
+    for element_set, image, prior in zip(pixel_partition(images, priors, partition_number=49), images, priors):
+        np.testing.assert_array_equal(np.array(element_set), np.array(loop_pixel_partition(image, prior, 49)))
+
+def test_grid_partition_matches_loop(batch):
+    images, priors = batch
+    for element_set, image, prior in zip(grid_partition(images, priors, grad_size=14, grad_num_per_set=4), images, priors):
+        np.testing.assert_array_equal(np.array(element_set), np.array(loop_grid_partition(image, prior, 14, 4)))
+
+def test_patch_partition_matches_loop(batch):
+    images, _ = batch
+    for element_set, image in zip(patch_partition(images, partition_size=5), images):
+        np.testing.assert_array_equal(np.array(element_set), np.array(loop_patch_partition(image, 5)))
+
+@pytest.mark.parametrize("workers", [0, 1])
+def test_superpixel_service_matches_division(workers):
+    images = [random_image(seed) for seed in range(3)]
+    with SuperpixelService(workers=workers, region_size=12) as service:
+        element_sets = service.divide_batch(images)
+        prefetched = list(service.prefetch(range(3), lambda i: None if i == 1 else images[i]))
+
+    for image, element_set in zip(images, element_sets):
+        np.testing.assert_array_equal(element_set.labels, SubRegionDivision(image, region_size=12).labels)
+    assert [item for item, _, _ in prefetched] == [0, 2]
+    for item, image, element_set in prefetched:
+        np.testing.assert_array_equal(element_set.labels, element_sets[item].labels)
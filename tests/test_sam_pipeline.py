@@ -0,0 +1,135 @@
+import os
+
+import numpy as np
+import pytest
+
+from conftest import random_image
+from models.element_set import ElementSet
+from models.partition_cache import PartitionCache
+from models.sam_concepts import sam_label_map
+from models.sam_pipeline import (
+    MaskFileWriter, SamMaskStore, SuperpixelMaskGenerator, rle_decode, rle_encode, run_mask_pipeline)
+from utils import load_element_set
+
+def pairwise_sam_concepts(sam_masks, image):
+    """
+    The original pairwise overlap resolution of SAM_mask_generate.py, dense
+    """
+    num = len(sam_masks)
+    mask_sets_V = [mask['segmentation'].astype(np.uint8) for mask in sam_masks]
+
+    for i in range(num - 1):
+        for j in range(i + 1, num):
+            intersection_region = (mask_sets_V[i] + mask_sets_V[j] == 2).astype(np.uint8)
+            if intersection_region.sum() == 0:
+                continue
+            proportion_1 = intersection_region.sum() / mask_sets_V[i].sum()
+            proportion_2 = intersection_region.sum() / mask_sets_V[j].sum()
+            if proportion_1 > proportion_2:
+                mask_sets_V[j] -= intersection_region
+            else:
+                mask_sets_V[i] -= intersection_region
+    element_sets_V = []
+    for mask in mask_sets_V:
+        if mask.mean() > 0.0005:
+            element_sets_V.append(image * mask[:, :, np.newaxis])
+    element_sets_V.append(image - np.array(element_sets_V).sum(0).astype(np.uint8))
+    return element_sets_V
+
+def random_masks(seed, size = 64, num = 12):
+    random = np.random.RandomState(seed)
+    rows, columns = np.mgrid[:size, :size]
+    masks = []
+    for _ in range(num):
+        y, x = random.randint(0, size, 2)
+        radius = random.randint(1, size // 3)
+        masks.append({"segmentation": (rows - y) ** 2 + (columns - x) ** 2 < radius ** 2})
+    # one duplicate and one speck below the minimum area
+    masks.append({"segmentation": masks[0]["segmentation"].copy()})
+    speck = np.zeros((size, size), dtype=bool)
+    speck[0, 0] = True
+    masks.append({"segmentation": speck})
+    return masks
+
+@pytest.mark.parametrize("seed", range(4))
+def test_sam_label_map_matches_pairwise_rule(seed):
+    image = random_image(seed, size=64)
+    masks = random_masks(seed)
+    labels, num_elements = sam_label_map([mask["segmentation"] for mask in masks], image.shape)
+
+    reference = np.array(pairwise_sam_concepts(masks, image))
+    np.testing.assert_array_equal(np.array(ElementSet(image, labels, num_elements=num_elements)), reference)
+
+def test_rle_round_trip():
+    labels = np.random.RandomState(0).randint(-1, 5, (7, 9)).astype(np.int32)
+    values, lengths = rle_encode(labels)
+
+    assert lengths.sum() == labels.size
+    np.testing.assert_array_equal(rle_decode(values, lengths, labels.shape), labels)
+    values, lengths = rle_encode(np.zeros((4, 4), dtype=np.int32))
+    assert (values.tolist(), lengths.tolist()) == ([0], [16])
+
+@pytest.fixture
+def images():
+    return {"{}.png".format(i): random_image(i, size=64) for i in range(5)}
+
+def expected_labels(image):
+    masks = SuperpixelMaskGenerator().generate(image[..., ::-1])
+    return sam_label_map([mask["segmentation"] for mask in masks], image.shape)
+
+@pytest.mark.parametrize("store", ["shards", "files"])
+def test_mask_pipeline_writes_every_image(images, tmp_path, store):
+    root = str(tmp_path / store)
+    writer = SamMaskStore(root, shard_size=2) if store == "shards" else MaskFileWriter(root)
+    counts = run_mask_pipeline(SuperpixelMaskGenerator(), sorted(images), images.get, writer, prefetch=2)
+
+    assert counts == {"ok": 5, "failed": 0, "skipped": 0}
+    reader = SamMaskStore(root)
+    for name, image in images.items():
+        labels, num_elements = expected_labels(image)
+        if store == "shards":
+            element_set = reader.load(name, image)
+        else:
+            element_set = load_element_set(os.path.join(root, name))
+        assert len(element_set) == num_elements
+        np.testing.assert_array_equal(element_set.labels, labels)
+
+def test_mask_pipeline_resumes_and_records_failures(images, tmp_path):
+    root = str(tmp_path)
+    read_image = lambda name: None if name == "2.png" else images[name]
+    counts = run_mask_pipeline(SuperpixelMaskGenerator(), sorted(images), read_image, SamMaskStore(root, shard_size=2))
+    assert counts == {"ok": 4, "failed": 1, "skipped": 0}
+    assert [record["image"] for record in SamMaskStore(root).manifest.failures()] == ["2.png"]
+
+    counts = run_mask_pipeline(SuperpixelMaskGenerator(), sorted(images), images.get, SamMaskStore(root, shard_size=2))
+    assert counts == {"ok": 1, "failed": 0, "skipped": 4}
+    assert SamMaskStore(root).manifest.failures() == []
+
+def test_interrupted_mask_pipeline_keeps_finished_images(images, tmp_path):
+    generator = SuperpixelMaskGenerator()
+
+    class Interrupted(object):
+        calls = 0
+
+        def generate(self, image):
+            self.calls += 1
+            if self.calls == 3:
+                raise KeyboardInterrupt
+            return generator.generate(image)
+
+    with pytest.raises(KeyboardInterrupt):
+        run_mask_pipeline(Interrupted(), sorted(images), images.get, SamMaskStore(str(tmp_path), shard_size=10))
+    store = SamMaskStore(str(tmp_path))
+    assert [store.done(name) for name in sorted(images)] == [True, True, False, False, False]
+
+def test_mask_pipeline_fills_partition_cache(images, tmp_path):
+    cache = PartitionCache(str(tmp_path / "cache"))
+    run_mask_pipeline(SuperpixelMaskGenerator(), sorted(images), images.get, SamMaskStore(str(tmp_path / "a")),
+                      partition_cache=cache)
+    run_mask_pipeline(None, sorted(images), images.get, SamMaskStore(str(tmp_path / "b")),
+                      partition_cache=cache)
+
+    first, second = SamMaskStore(str(tmp_path / "a")), SamMaskStore(str(tmp_path / "b"))
+    assert cache.hits == len(images)
+    for name, image in images.items():
+        np.testing.assert_array_equal(second.load(name, image).labels, first.load(name, image).labels)
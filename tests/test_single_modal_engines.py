@@ -0,0 +1,42 @@
+import numpy as np
+import pytest
+
+from conftest import assert_same_explanation, preprocess, ToyModel
+from models.submodular_single_modal import (
+    BlackBoxSingleModalSubModularExplanation,
+    BlackBoxSingleModalSubModularExplanationEfficient,
+    BlackBoxSingleModalSubModularExplanationStochasticGreedy)
+
+# engine, k (None: every element)
+ENGINES = [
+    (BlackBoxSingleModalSubModularExplanation, 8),
+    (BlackBoxSingleModalSubModularExplanationEfficient, None),
+    (BlackBoxSingleModalSubModularExplanationStochasticGreedy, None),
+]
+ENGINE_IDS = [engine.__name__ for engine, _ in ENGINES]
+
+def explain(engine, element_set, k, **kwargs):
+    smdl = engine(ToyModel(), preprocess, device="cpu", k=len(element_set) if k is None else k, **kwargs)
+    return smdl(element_set, 1)
+
+@pytest.mark.parametrize("engine, k", ENGINES, ids=ENGINE_IDS)
+def test_subset_cache_keeps_explanation(engine, k, element_set):
+    reference = explain(engine, element_set, k)
+    result = explain(engine, element_set, k, subset_cache_memory=2 ** 27)
+    assert_same_explanation(result, reference)
+
+@pytest.mark.parametrize("engine, k", ENGINES, ids=ENGINE_IDS)
+def test_element_set_matches_dense_stack(engine, k, element_set):
+    reference = explain(engine, np.array(element_set), k)
+    result = explain(engine, element_set, k)
+    assert_same_explanation(result, reference, atol=0)
+
+@pytest.mark.parametrize("engine, k", ENGINES, ids=ENGINE_IDS)
+@pytest.mark.parametrize("lambdas", [(20, 0, 0.01), (0, 5, 0)])
+def test_skipped_forwards_keep_explanation(engine, k, lambdas, element_set):
+    lambda1, lambda2, lambda3 = lambdas
+    always_forward = type("AlwaysForward" + engine.__name__, (engine,), {
+        "score_plan": property(lambda self: {"consistency": True, "collaboration": True})})
+
+    kwargs = dict(lambda1=lambda1, lambda2=lambda2, lambda3=lambda3)
+    assert_same_explanation(explain(engine, element_set, k, **kwargs), explain(always_forward, element_set, k, **kwargs))
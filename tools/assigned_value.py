@@ -231,7 +231,7 @@ def main(args):
 
             with open(json_file_path, 'r', encoding='utf-8') as f:
                 saved_json_file = json.load(f)            
-            submodular_image_set = np.load(npy_file_path)
+            submodular_image_set = load_element_set(npy_file_path)
             
             image = submodular_image_set.sum(0)
     